@@ -2,6 +2,8 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+import click
+import csv
 import os
 
 db = SQLAlchemy()
@@ -10,31 +12,143 @@ login_manager = LoginManager()
 login_manager.login_view = 'main.login'
 login_manager.login_message_category = 'info'
 
-def create_app():
+def create_app(config_overrides=None, config_name=None):
+    from config import config_by_name
+    from app import engine
+
     app = Flask(__name__)
-    app.config['SECRET_KEY'] = 'your-secret-key'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.from_object(config_by_name[config_name or os.environ.get('APP_CONFIG', 'default')])
     app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static/profile_pics')
+    if config_overrides:
+        app.config.update(config_overrides)
 
+    engine.init_app(app)
     db.init_app(app)
+    engine.configure_engine(app, db)
     bcrypt.init_app(app)
     login_manager.init_app(app)
 
+    from app import cache, dashboard, export, jobs, hierarchy, identity, logins, metrics, nplusone, pagination, refdata, search, stats, tokens, typeahead
+    metrics.init_app(app)
+    cache.init_app(app)
+    dashboard.init_app(app)
+    identity.init_app(app)
+    tokens.init_app(app)
+    logins.init_app(app)
+    typeahead.init_app(app)
+    jobs.init_app(app)
+    nplusone.init_app(app)
+    app.add_template_global(refdata.department_name)
+    app.add_template_global(pagination.page_url)
+    app.add_template_global(export.export_url)
+
     from app.routes import bp as main_routes
+    from app.routes import admin, auth, export as export_routes, resources, search as search_routes, upload, users
     app.register_blueprint(main_routes)
+    for api in (admin, auth, export_routes, resources, search_routes, upload, users):
+        app.register_blueprint(api.bp)
+        # API clients get a 401 rather than a redirect to the login page
+        login_manager.blueprint_login_views[api.bp.name] = None
 
     # Add CLI command to recreate database
     @app.cli.command("recreate-db")
     def recreate_db():
         """Recreates the database. WARNING: This will delete all data!"""
-        db.drop_all()
-        db.create_all()
+        from app.migrate import recreate_database
+        recreate_database()
         print("Database recreated!")
 
-    return app
+    @app.cli.command("upgrade-db")
+    @click.argument("revision", default="head")
+    def upgrade_db(revision):
+        """Applies pending schema migrations."""
+        from app.migrate import upgrade_database
+        print(f"Database at revision {upgrade_database(revision)}.")
+
+    @app.cli.command("check-query-plans")
+    def check_query_plans():
+        """Checks that the hot scoped queries use their indexes without a full scan; exits 1 if any don't."""
+        from app.queryplan import check_query_plans
+        failed = 0
+        for description, index, plan, ok in check_query_plans():
+            print(f"{'ok' if ok else 'MISSING'}  {description} ({index})")
+            if not ok:
+                failed += 1
+                print('    ' + plan.replace('\n', '\n    '))
+        if failed:
+            raise SystemExit(1)
+
+    @app.cli.command("rebuild-department-tree")
+    def rebuild_department_tree():
+        """Recomputes the department ancestor/descendant index from parent_id."""
+        count = hierarchy.rebuild_department_tree()
+        db.session.commit()
+        print(f"Indexed {count} departments.")
+
+    @app.cli.command("rebuild-search-index")
+    def rebuild_search_index():
+        """Reindexes users, departments, resources and facilities for search."""
+        from app.search import rebuild_search_index
+        count = rebuild_search_index()
+        db.session.commit()
+        print(f"Indexed {count} records.")
 
-@login_manager.user_loader
-def load_user(user_id):
-    from app.models import User
-    return User.query.get(int(user_id))
\ No newline at end of file
+    @app.cli.command("rebuild-stats")
+    def rebuild_stats():
+        """Recomputes the admin dashboard counters from the tables."""
+        count = stats.rebuild_counters()
+        db.session.commit()
+        print(f"Rebuilt {count} counters.")
+
+    @app.cli.command("verify-stats")
+    def verify_stats():
+        """Compares the admin dashboard counters with the tables; exits 1 on drift."""
+        drift = stats.verify_counters()
+        for name, key, stored, actual in drift:
+            print(f"{name}[{key}]: stored {stored}, actual {actual}")
+        if drift:
+            raise SystemExit(1)
+        print("Counters match.")
+
+    @app.cli.command("fail-orphaned-jobs")
+    def fail_orphaned_jobs():
+        """Fails import jobs left queued or running; run at startup, before any worker accepts uploads."""
+        print(f"Failed {jobs.fail_orphaned_jobs()} orphaned import jobs.")
+
+    @app.cli.command("seed-org")
+    @click.option("--scale", type=float, default=1.0, help="1.0 = 100k users, 10k departments, 500k resources, 20k facilities")
+    @click.option("--depth", type=int, default=6, help="department tree depth")
+    @click.option("--seed", type=int, default=42, help="random seed; the same seed builds the same data")
+    @click.option("--password", default="password", help="password shared by every generated account")
+    @click.option("--reset", is_flag=True, help="drop and recreate the database first")
+    def seed_org(scale, depth, seed, password, reset):
+        """Fills the database with a synthetic organization for scale testing."""
+        from app.migrate import recreate_database, upgrade_database
+        from app.seed import seed_organization, SeedError
+        if reset:
+            recreate_database()
+        else:
+            upgrade_database()
+        try:
+            counts = seed_organization(scale, depth, seed, password,
+                                       on_step=lambda name, seconds: print(f"{name:<30} {seconds:>7.2f}s"))
+        except SeedError as e:
+            raise click.ClickException(str(e))
+        print(", ".join(f"{count} {kind}" for kind, count in counts.items()))
+
+    @app.cli.command("export-password-tokens")
+    @click.argument("output", type=click.File("w"), default="-")
+    def export_password_tokens(output):
+        """Writes email and set-password link for accounts that haven't set a password yet and whose link is still valid."""
+        from datetime import datetime
+        from flask import url_for
+        from app.models import User
+        writer = csv.writer(output)
+        writer.writerow(['email', 'set_password_url'])
+        users = User.query.filter(User.password_token.isnot(None),
+                                  User.password_token_expires_at > datetime.utcnow()).order_by(User.id)
+        with app.test_request_context():
+            for user in users.yield_per(1000):
+                writer.writerow([user.email, url_for('main.set_password', token=user.password_token, _external=True)])
+
+    return app
@@ -0,0 +1,192 @@
+"""Bundle imports: a whole organization from several related CSV files in one pass.
+
+A bundle is a zip holding any of departments.csv, users.csv, resources.csv
+and facilities.csv. Rows name rows of the other files (or their own) through
+a `key` column of their choosing: a department's parent_key and head_key, a
+user's department_key and manager_key, a resource's department_key and
+assigned_to_key. Plain *_id columns still refer to rows already in the
+database.
+
+The files are validated together (app.validation.validate_bundle), then
+loaded in dependency order: departments, users, resources, facilities, with
+department and manager chains sorted parents first. Every row gets its id up
+front, from above the table's current maximum, so keys resolve to ids
+before anything is written. References to a file loaded later (a
+department's head) are written as NULL and filled in by one set-based
+UPDATE once their rows exist. The load is chunked Core inserts in a single
+transaction: a bundle lands whole or not at all, and a concurrent insert
+that takes one of the allocated ids rolls it back.
+"""
+import os
+import shutil
+import zipfile
+
+import pandas as pd
+from sqlalchemy import bindparam, func, select
+
+from app import db
+from app.cache import invalidate, row_tags
+from app.hierarchy import sync_department_tree
+from app.importer import (IMPORT_SPECS, ImportStats, ImportValidationError, DEFAULT_CHUNK_SIZE, DEFAULT_PASSWORD,
+                          password_setter)
+from app.search import index_new_rows
+from app.stats import apply_rows
+from app.validation import KEY_REFERENCES, read_frame, report_path, validate_bundle
+
+# Load order: every file's references point to an earlier file, to itself or (deferred) to users
+BUNDLE_KINDS = ('departments', 'users', 'resources', 'facilities')
+
+
+def write_bundle(parts, path):
+    """Pack uploaded CSV files, {kind: file storage}, into a bundle zip at path"""
+    with zipfile.ZipFile(path, 'w') as archive:
+        for kind, part in parts.items():
+            with archive.open(f'{kind}.csv', 'w', force_zip64=True) as member:
+                shutil.copyfileobj(part.stream, member)
+
+
+def read_bundle(path):
+    """{kind: frame} for the members of a bundle zip; folders inside the zip are ignored"""
+    frames = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename).lower()
+            kind, extension = os.path.splitext(name)
+            if info.is_dir() or extension != '.csv' or kind not in BUNDLE_KINDS:
+                continue
+            if kind in frames:
+                raise ImportValidationError([f'{name} appears more than once in the bundle'])
+            with archive.open(info) as member:
+                frames[kind] = read_frame(member)
+    if not frames:
+        raise ImportValidationError([f'A bundle needs at least one of: {", ".join(k + ".csv" for k in BUNDLE_KINDS)}'])
+    return frames
+
+
+def read_validated_bundle(path):
+    """Read and validate a spooled bundle; {kind: frame} with chains sorted parents first
+
+    On any problem the report is written next to the file (see
+    app.validation.report_path) and ImportValidationError is raised.
+    """
+    frames = read_bundle(path)
+    report = validate_bundle(frames)
+    if report:
+        report.write_csv(report_path(path))
+        raise ImportValidationError(report.summary())
+    return {
+        kind: df.sort_values('_depth', kind='stable').drop(columns='_depth') if '_depth' in df.columns else df
+        for kind, df in frames.items()
+    }
+
+
+def _allocate_ids(frames):
+    """{kind: (last id before the bundle, pd.Series of new ids indexed by key)}; adds an _id column to each frame"""
+    allocated = {}
+    for kind, df in frames.items():
+        model = IMPORT_SPECS[kind][0]
+        last_id = db.session.scalar(select(func.max(model.id))) or 0
+        df['_id'] = range(last_id + 1, last_id + 1 + len(df))
+        keys = df['key'] if 'key' in df.columns else pd.Series('', index=df.index)
+        allocated[kind] = (last_id, pd.Series(df['_id'].to_numpy(), index=keys.to_numpy())[keys.to_numpy() != ''])
+    return allocated
+
+
+def _resolve_keys(kind, df, allocated):
+    """Fill id columns from key columns; returns {id column: ids} for references to a later file"""
+    deferred = {}
+    for key_column, (column, target) in KEY_REFERENCES[kind].items():
+        # Validation leaves keys only where the referenced file has them
+        if key_column not in df.columns or target not in allocated:
+            continue
+        ids = df[key_column].map(allocated[target][1]).where(df[key_column] != '')
+        if BUNDLE_KINDS.index(target) > BUNDLE_KINDS.index(kind):
+            deferred[column] = ids
+            continue
+        resolved = ids.notna()
+        values = df[column] if column in df.columns else pd.Series('', index=df.index)
+        df[column] = values.where(~resolved, ids.astype('Int64').astype(str))
+    return deferred
+
+
+def _build_rows(kind, df, stats):
+    """Insertable rows for a validated frame, each with its allocated id"""
+    build_row = IMPORT_SPECS[kind][1]
+    rows = []
+    for raw in df.to_dict('records'):
+        stats.rows_read += 1
+        row = build_row(raw)
+        if row is None:
+            stats.skipped += 1
+            continue
+        row['id'] = raw['_id']
+        rows.append(row)
+    return rows
+
+
+def _apply_deferred(model, rows, deferred):
+    """Set references to rows loaded after model's, with one executemany UPDATE per column"""
+    by_id = {row['id']: row for row in rows}
+    table = model.__table__
+    for column, ids in deferred.items():
+        pairs = [(int(row_id), int(value)) for row_id, value in ids.dropna().items() if row_id in by_id]
+        if not pairs:
+            continue
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('row_id')).values({column: bindparam('new_value')}),
+            [{'row_id': row_id, 'new_value': value} for row_id, value in pairs]
+        )
+        for row_id, value in pairs:
+            by_id[row_id][column] = value
+
+
+def load_bundle(frames, password=DEFAULT_PASSWORD, password_mode=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Load a validated bundle, {kind: frame} from read_validated_bundle(), in one transaction
+
+    Returns ImportStats for the whole bundle. password and password_mode are
+    as for app.importer.run_import.
+    """
+    stats = ImportStats('bundle')
+    set_passwords = password_setter(password, password_mode)
+    connection = db.session.connection()
+    written, deferred = {}, []
+    # Chunks are not committed one by one, so the SQLite write lock is held for the whole load
+    try:
+        allocated = _allocate_ids(frames)
+        for kind in BUNDLE_KINDS:
+            if kind not in frames:
+                continue
+            model = IMPORT_SPECS[kind][0]
+            df = frames[kind]
+            later = _resolve_keys(kind, df, allocated)
+            # Deferred references are keyed by the referring row's allocated id
+            deferred.append((kind, {column: ids.set_axis(df['_id']) for column, ids in later.items()}))
+            rows = _build_rows(kind, df, stats)
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                if kind == 'users':
+                    set_passwords(chunk)
+                # Core executemany on the table: no ORM bookkeeping per row
+                connection.execute(model.__table__.insert(), chunk)
+                stats.chunks += 1
+            stats.inserted += len(rows)
+            written[kind] = rows
+
+        for kind, columns in deferred:
+            _apply_deferred(IMPORT_SPECS[kind][0], written[kind], columns)
+
+        for kind, rows in written.items():
+            apply_rows(IMPORT_SPECS[kind][0], rows)
+        if 'departments' in written:
+            sync_department_tree()
+        # After the tree, so department paths are indexed too
+        for kind in written:
+            index_new_rows(IMPORT_SPECS[kind][0], allocated[kind][0], preload=True)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for kind, rows in written.items():
+        invalidate(*row_tags(IMPORT_SPECS[kind][0], rows))
+    return stats.finish()
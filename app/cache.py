@@ -0,0 +1,209 @@
+"""In-process versioned cache with invalidation on commit.
+
+Every entry records the version of each tag it depends on when it was
+computed. Committing a change to a model bumps that model's tags, which makes
+every dependent entry stale without having to find and delete it. The cache
+is bounded (least recently used entries are evicted first) and entries also
+expire after a TTL, which bounds staleness for writes made by other processes.
+Concurrent misses on one key are collapsed: one caller computes the value
+while the others wait for it.
+"""
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import NoInspectionAvailable
+from sqlalchemy.orm import Session
+
+_MISSING = object()
+
+
+class VersionedCache:
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Tag -> value of the bump clock when the tag last changed
+        self._versions = {}
+        self._clock = 0
+        self._lock = threading.RLock()
+        self._flights = {}
+        self.hits = 0
+        self.misses = 0
+
+    def versions(self, tags, as_of=None):
+        """Current version of each tag; tags bumped after clock value as_of get -1, which never matches"""
+        with self._lock:
+            return tuple(
+                (tag, -1 if as_of is not None and version > as_of else version)
+                for tag, version in ((tag, self._versions.get(tag, 0)) for tag in tags)
+            )
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, snapshot, expires_at = entry
+                fresh = expires_at > time.monotonic() and all(
+                    self._versions.get(tag, 0) == version for tag, version in snapshot
+                )
+                if fresh:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, tags=(), ttl=None, snapshot=None):
+        """Store value; snapshot is the tag versions the value was computed from"""
+        with self._lock:
+            if snapshot is None:
+                snapshot = self.versions(tags)
+            self._entries[key] = (value, snapshot, time.monotonic() + (ttl or self.ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_set(self, key, factory, tags=(), ttl=None):
+        return self.get_or_build(key, lambda: (factory(), tags), ttl=ttl)
+
+    def get_or_build(self, key, builder, ttl=None):
+        """Like get_or_set, for values whose tags are only known once built
+
+        builder returns (value, tags). Only one caller per key runs it at a
+        time; the rest wait and then read what it stored.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        flight = self._join_flight(key)
+        try:
+            with flight[0]:
+                # Whoever held the lock before us may have just stored it
+                value = self.get(key, _MISSING)
+                if value is _MISSING:
+                    with self._lock:
+                        started = self._clock
+                    value, tags = builder()
+                    # A write that landed mid-build leaves the entry stale
+                    self.set(key, value, ttl=ttl, snapshot=self.versions(tags, as_of=started))
+                return value
+        finally:
+            self._leave_flight(key, flight)
+
+    def _join_flight(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = [threading.Lock(), 0]
+            flight[1] += 1
+            return flight
+
+    def _leave_flight(self, key, flight):
+        with self._lock:
+            flight[1] -= 1
+            if not flight[1]:
+                del self._flights[key]
+
+    def bump(self, *tags):
+        with self._lock:
+            self._clock += 1
+            for tag in tags:
+                self._versions[tag] = self._clock
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+reference_cache = VersionedCache()
+
+# All caches whose tags are bumped when a model change commits
+_caches = [reference_cache]
+
+# Model class -> function(obj) returning extra tags beyond the table name and row id
+_tag_builders = {}
+
+
+def register_cache(cache):
+    _caches.append(cache)
+    return cache
+
+
+def register_tags(model, builder):
+    """Add model-specific tags (e.g. 'resource.department:3') for changed rows"""
+    _tag_builders.setdefault(model, []).append(builder)
+
+
+def attr_values(obj, name):
+    """Non-null values an attribute has had in this flush, old and new
+
+    A row moving from department 1 to 2 must invalidate entries for both.
+    Plain objects (e.g. bulk-insert rows) just report their current value.
+    """
+    try:
+        history = inspect(obj).attrs[name].history
+    except NoInspectionAvailable:
+        values = {getattr(obj, name, None)}
+    else:
+        values = set(history.added) | set(history.unchanged) | set(history.deleted)
+    values.discard(None)
+    return values
+
+
+def model_tags(obj):
+    table = obj.__table__.name
+    tags = {table, f'{table}:{obj.id}'}
+    for builder in _tag_builders.get(type(obj), ()):
+        tags.update(builder(obj))
+    return tags
+
+
+def row_tags(model, rows):
+    """Tags for rows written with a bulk INSERT, where no ORM objects exist"""
+    tags = {model.__table__.name}
+    for builder in _tag_builders.get(model, ()):
+        for row in rows:
+            tags.update(builder(SimpleNamespace(**row)))
+    return tags
+
+
+def invalidate(*tags):
+    """Bump tags on every cache, e.g. after a bulk write that bypassed the ORM"""
+    for cache in _caches:
+        cache.bump(*tags)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_tags(session, flush_context):
+    pending = session.info.setdefault('cache_tags', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if hasattr(obj, '__table__'):
+            pending.update(model_tags(obj))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        invalidate(*tags)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop('cache_tags', None)
+
+
+def init_app(app):
+    app.config.setdefault('REFERENCE_CACHE_MAX_ENTRIES', 256)
+    app.config.setdefault('REFERENCE_CACHE_TTL', 300)
+    reference_cache.max_entries = app.config['REFERENCE_CACHE_MAX_ENTRIES']
+    reference_cache.ttl = app.config['REFERENCE_CACHE_TTL']
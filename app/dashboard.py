@@ -0,0 +1,114 @@
+"""Cached dashboard data.
+
+The dashboard is computed once per user and scope (role, department, manager)
+and kept in dashboard_cache as plain dicts. Each entry is tagged with exactly
+the rows it was built from - the user, their manager, department and head,
+the department's membership, the user's reports and assigned resources, and
+the resources in scope - so an edit only drops the dashboards that show it.
+Concurrent misses for the same user are collapsed by VersionedCache, so an
+expired entry is recomputed by one request while the others wait.
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, undefer
+
+from app import db
+from app.cache import VersionedCache, attr_values, register_cache, register_tags
+from app.models import User, Department, Resource
+from app.scope import ALL, SUBTREE, resolve_scope
+
+dashboard_cache = register_cache(VersionedCache(max_entries=2048, ttl=60))
+
+register_tags(User, lambda user: {f'user.department:{v}' for v in attr_values(user, 'department_id')}
+              | {f'user.manager:{v}' for v in attr_values(user, 'manager_id')})
+register_tags(Resource, lambda resource: {f'resource.department:{v}' for v in attr_values(resource, 'department_id')}
+              | {f'resource.assigned_to:{v}' for v in attr_values(resource, 'assigned_to_id')})
+
+_RESOURCE_COLUMNS = (Resource.id, Resource.name, Resource.type, Resource.status, Resource.department_id)
+
+
+def _resource_rows(query):
+    return [dict(row._mapping) for row in db.session.execute(query)]
+
+
+def _available_resources(user, limit, tags):
+    query = (
+        select(*_RESOURCE_COLUMNS)
+        .where(Resource.status == 'available')
+        .order_by(Resource.name, Resource.id)
+        .limit(limit)
+    )
+    scope = resolve_scope(user)
+    query = scope.apply(query, Resource)
+    if scope.kind == ALL:
+        tags.add('resource')
+    else:
+        if scope.kind == SUBTREE:
+            # Any department move can change the subtree
+            tags.add('department')
+        tags.update(f'resource.department:{d}' for d in scope.department_ids())
+    return _resource_rows(query)
+
+
+def _build(user, resource_limit):
+    tags = {f'user:{user.id}', f'user.manager:{user.id}', f'resource.assigned_to:{user.id}'}
+    data = {
+        'username': user.username,
+        'email': user.email,
+        'role': user.role,
+        'department': 'No Department',
+        'manager': 'No Manager'
+    }
+
+    if user.manager_id:
+        tags.add(f'user:{user.manager_id}')
+        data['manager'] = db.session.scalar(select(User.username).where(User.id == user.manager_id)) or 'No Manager'
+
+    if user.department_id:
+        tags.update({f'department:{user.department_id}', f'user.department:{user.department_id}'})
+        dept = db.session.scalars(
+            select(Department)
+            .options(joinedload(Department.head).load_only(User.id, User.username), undefer(Department.member_count))
+            .where(Department.id == user.department_id)
+        ).first()
+        if dept:
+            if dept.head_id:
+                tags.add(f'user:{dept.head_id}')
+            data.update({
+                'department': dept.name,
+                'department_head': dept.head.username if dept.head else 'No Head',
+                'department_description': dept.description,
+                'department_members': dept.member_count
+            })
+
+    team_members = [
+        dict(row._mapping) for row in db.session.execute(
+            select(User.id, User.username, User.email, User.department_id)
+            .where(User.manager_id == user.id)
+            .order_by(User.username)
+        )
+    ]
+    tags.update(f'user:{member["id"]}' for member in team_members)
+    data['is_manager'] = bool(team_members)
+
+    assigned = _resource_rows(select(*_RESOURCE_COLUMNS).where(Resource.assigned_to_id == user.id).order_by(Resource.name))
+    available = _available_resources(user, resource_limit, tags)
+    return {
+        'user_data': data,
+        'team_members': team_members,
+        'assigned_resources': assigned,
+        'resources': available
+    }, tags
+
+
+def dashboard_data(user, resource_limit=100):
+    """Return the dashboard context for user, computing it at most once per change"""
+    key = (user.id, user.role, user.department_id, user.manager_id, resource_limit)
+    return dashboard_cache.get_or_build(key, lambda: _build(user, resource_limit))
+
+
+def init_app(app):
+    app.config.setdefault('DASHBOARD_CACHE_MAX_ENTRIES', 2048)
+    app.config.setdefault('DASHBOARD_CACHE_TTL', 60)
+    app.config.setdefault('DASHBOARD_RESOURCE_LIMIT', 100)
+    dashboard_cache.max_entries = app.config['DASHBOARD_CACHE_MAX_ENTRIES']
+    dashboard_cache.ttl = app.config['DASHBOARD_CACHE_TTL']
@@ -0,0 +1,83 @@
+"""Database engine profiles.
+
+sqlite - a local SQLite file in WAL mode, so readers no longer wait for the
+         writer, with a busy timeout instead of immediate "database is
+         locked" errors and the synchronous/mmap/cache pragmas applied to
+         every new connection.
+server - a client/server database (PostgreSQL, MySQL) behind a sized
+         connection pool with overflow, checkout timeout, recycling and
+         pre-ping so connections dropped by the server are replaced.
+
+The profile comes from DB_ENGINE_PROFILE, or from the database URI when that
+is unset. Settings live on the Config classes in config.py.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+ENGINE_PROFILES = ('sqlite', 'server')
+
+
+def engine_profile(config):
+    profile = config.get('DB_ENGINE_PROFILE')
+    if not profile:
+        profile = 'sqlite' if make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name() == 'sqlite' else 'server'
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"DB_ENGINE_PROFILE must be one of {', '.join(ENGINE_PROFILES)}")
+    return profile
+
+
+def sqlite_pragmas(config):
+    """PRAGMA name -> value for the sqlite profile, skipping any set to None"""
+    pragmas = {
+        'journal_mode': config.get('SQLITE_JOURNAL_MODE'),
+        'busy_timeout': config.get('SQLITE_BUSY_TIMEOUT_MS'),
+        'synchronous': config.get('SQLITE_SYNCHRONOUS'),
+        'mmap_size': config.get('SQLITE_MMAP_SIZE'),
+        # Negative cache_size is in KiB rather than pages
+        'cache_size': -config['SQLITE_CACHE_SIZE_KB'] if config.get('SQLITE_CACHE_SIZE_KB') else None
+    }
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured profile"""
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if engine_profile(config) == 'sqlite':
+        busy_timeout = config.get('SQLITE_BUSY_TIMEOUT_MS')
+        if busy_timeout is not None:
+            # The driver waits this long for a lock too, before the pragma is applied
+            options.setdefault('connect_args', {}).setdefault('timeout', busy_timeout / 1000)
+        return options
+
+    options.setdefault('pool_size', config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+    options.setdefault('pool_pre_ping', config['DB_POOL_PRE_PING'])
+    return options
+
+
+def _apply_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+    return on_connect
+
+
+def init_app(app):
+    """Call before db.init_app(app): sets the engine options for the profile"""
+    app.config['DB_ENGINE_PROFILE'] = engine_profile(app.config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
+
+def configure_engine(app, db):
+    """Call after db.init_app(app): installs the per-connection pragmas"""
+    if app.config['DB_ENGINE_PROFILE'] != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(app.config)
+    with app.app_context():
+        event.listen(db.engine, 'connect', _apply_pragmas(pragmas))
@@ -1,10 +1,64 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
-from wtforms import StringField, PasswordField, SubmitField, BooleanField, SelectField, TextAreaField
+from flask import url_for
+from markupsafe import Markup, escape
+from wtforms import Field, StringField, PasswordField, SubmitField, BooleanField, SelectField, TextAreaField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
-from app.models import User, Department
-
-__all__ = ['LoginForm', 'RegistrationForm', 'UpdateProfileForm', 'UpdateUserForm', 'DepartmentForm', 'ResourceForm', 'FacilityForm', 'CSVUploadForm']
+from wtforms.widgets import html_params
+from app.models import User, Department, Resource
+from app.refdata import top_level_department_choices, admin_choices
+from app import typeahead
+from app.scope import resolve_scope
+from app.upsert import key_in_use, upsert_unsupported
+
+__all__ = ['LoginForm', 'RegistrationForm', 'UpdateProfileForm', 'UpdateUserForm', 'DepartmentForm', 'ResourceForm', 'FacilityForm', 'CSVUploadForm', 'SetPasswordForm']
+
+class TypeaheadInput:
+    """Text box that autocompletes from /typeahead/<kind>; the chosen id goes in a hidden input"""
+
+    def __call__(self, field, **kwargs):
+        kwargs.setdefault('id', field.id)
+        current = field.data and typeahead.label(field.kind, field.data)
+        text = html_params(
+            type='text', value=current or '', placeholder=field.placeholder, autocomplete='off',
+            list=f'{field.id}-options', data_typeahead=url_for('main.typeahead', kind=field.kind),
+            data_target=f'{field.id}-value', **kwargs
+        )
+        hidden = html_params(type='hidden', id=f'{field.id}-value', name=field.name, value=field.data or '')
+        return Markup(f'<input {text}><input {hidden}><datalist id="{escape(field.id)}-options"></datalist>')
+
+
+class TypeaheadField(Field):
+    """Id of a user, admin or department picked by typing; empty means None
+
+    Submitted ids are checked against the typeahead index instead of a
+    precomputed list of choices. Departments, and the departments of users,
+    must also be in the current user's scope.
+    """
+    widget = TypeaheadInput()
+
+    def __init__(self, label=None, validators=None, kind='users', placeholder='', **kwargs):
+        super(TypeaheadField, self).__init__(label, validators, **kwargs)
+        self.kind = kind
+        self.placeholder = placeholder
+
+    def process_formdata(self, valuelist):
+        self.data = None
+        if valuelist and valuelist[0] not in ('', '0'):
+            try:
+                self.data = int(valuelist[0])
+            except ValueError:
+                raise ValueError(self.gettext('Not a valid choice.'))
+
+    def pre_validate(self, form):
+        if self.data is None:
+            return
+        if typeahead.label(self.kind, self.data) is None:
+            raise ValidationError(self.gettext('Not a valid choice.'))
+        if not resolve_scope().contains(typeahead.department(self.kind, self.data)):
+            if self.kind == 'departments':
+                raise ValidationError('You cannot choose a department outside your own.')
+            raise ValidationError('You cannot choose someone outside your department.')
 
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -23,13 +77,11 @@ class RegistrationForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(RegistrationForm, self).__init__(*args, **kwargs)
-        # Get all departments
-        departments = Department.query.filter_by(parent_id=None).all()  # Get main departments
-        self.department.choices = [(0, 'Select Department')] + [(d.id, d.name) for d in departments]
+        # Get main departments
+        self.department.choices = [(0, 'Select Department')] + list(top_level_department_choices())
         
         # Get all managers (department admins and org admins)
-        managers = User.query.filter(User.role.in_(['DEPT_ADMIN', 'ORG_ADMIN'])).all()
-        self.manager.choices = [(0, 'Select Manager')] + [(u.id, f"{u.username} ({u.role})") for u in managers]
+        self.manager.choices = [(0, 'Select Manager')] + list(admin_choices())
 
     def validate_username(self, username):
         user = User.query.filter_by(username=username.data).first()
@@ -41,6 +93,11 @@ class RegistrationForm(FlaskForm):
         if user:
             raise ValidationError('Email is already registered. Please use another one.')
 
+class SetPasswordForm(FlaskForm):
+    password = PasswordField('Password', validators=[DataRequired(), Length(min=6)])
+    confirm_password = PasswordField('Confirm Password', validators=[DataRequired(), EqualTo('password')])
+    submit = SubmitField('Set Password')
+
 class UpdateProfileForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=2, max=20)])
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -72,15 +129,13 @@ class UpdateUserForm(FlaskForm):
         ('DEPT_ADMIN', 'Department Admin'),
         ('ORG_ADMIN', 'Organization Admin')
     ])
-    department = SelectField('Department', coerce=int)
+    department = TypeaheadField('Department', kind='departments', placeholder='Select Department')
     submit = SubmitField('Update User')
 
     def __init__(self, original_username=None, original_email=None, *args, **kwargs):
         super(UpdateUserForm, self).__init__(*args, **kwargs)
         self.original_username = original_username
         self.original_email = original_email
-        departments = Department.query.all()
-        self.department.choices = [(0, 'Select Department')] + [(d.id, d.name) for d in departments]
 
     def validate_username(self, username):
         if username.data != self.original_username:
@@ -97,16 +152,20 @@ class UpdateUserForm(FlaskForm):
 class DepartmentForm(FlaskForm):
     name = StringField('Department Name', validators=[DataRequired(), Length(min=2, max=100)])
     description = TextAreaField('Description', validators=[Length(max=500)])
-    head = SelectField('Department Head', coerce=int)
-    parent = SelectField('Parent Department', coerce=int)
+    head = TypeaheadField('Department Head', kind='admins', placeholder='Select Head')
+    parent = TypeaheadField('Parent Department', kind='departments', placeholder='No Parent')
     submit = SubmitField('Save Department')
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, original=None, keep_parent=False, *args, **kwargs):
         super(DepartmentForm, self).__init__(*args, **kwargs)
-        admins = User.query.filter(User.role.in_(['DEPT_ADMIN', 'ORG_ADMIN'])).all()
-        self.head.choices = [(0, 'Select Head')] + [(u.id, f"{u.username} ({u.role})") for u in admins]
-        departments = Department.query.all()
-        self.parent.choices = [(0, 'No Parent')] + [(d.id, d.name) for d in departments]
+        self.original = original
+        self.keep_parent = keep_parent
+
+    def validate_name(self, name):
+        parent_id = self.original.parent_id if self.keep_parent else self.parent.data
+        if key_in_use(Department, {'name': name.data, 'parent_id': parent_id},
+                      exclude_id=self.original.id if self.original else None):
+            raise ValidationError('A department with this name already exists under the same parent.')
 
 class ResourceForm(FlaskForm):
     name = StringField('Resource Name', validators=[DataRequired(), Length(min=2, max=100)])
@@ -122,13 +181,17 @@ class ResourceForm(FlaskForm):
         ('maintenance', 'Under Maintenance'),
         ('retired', 'Retired')
     ])
-    assigned_to = SelectField('Assigned To', coerce=int)
+    assigned_to = TypeaheadField('Assigned To', kind='users', placeholder='Not Assigned')
     submit = SubmitField('Save Resource')
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, department_id=None, original_id=None, *args, **kwargs):
         super(ResourceForm, self).__init__(*args, **kwargs)
-        users = User.query.all()
-        self.assigned_to.choices = [(0, 'Not Assigned')] + [(u.id, f"{u.username} ({u.department.name if u.department else 'No Department'})") for u in users]
+        self.department_id = department_id
+        self.original_id = original_id
+
+    def validate_name(self, name):
+        if key_in_use(Resource, {'name': name.data, 'department_id': self.department_id}, exclude_id=self.original_id):
+            raise ValidationError('A resource with this name already exists in the department.')
 
 class FacilityForm(FlaskForm):
     name = StringField('Facility Name', validators=[DataRequired(), Length(max=100)])
@@ -140,21 +203,34 @@ class FacilityForm(FlaskForm):
     ])
     capacity = StringField('Capacity')
     location = StringField('Location', validators=[DataRequired(), Length(max=200)])
-    department = SelectField('Department', coerce=int)
+    department = TypeaheadField('Department', validators=[DataRequired()], kind='departments')
     submit = SubmitField('Submit')
 
-    def __init__(self, *args, **kwargs):
-        super(FacilityForm, self).__init__(*args, **kwargs)
-        self.department.choices = [(d.id, d.name) for d in Department.query.all()]
-
 class CSVUploadForm(FlaskForm):
     file = FileField('CSV File', validators=[
         DataRequired(),
-        FileAllowed(['csv'], 'CSV files only!')
+        FileAllowed(['csv', 'zip'], 'CSV files, or a zip of them for a bundle, only!')
     ])
     upload_type = SelectField('Upload Type', choices=[
         ('users', 'Users'),
         ('departments', 'Departments'),
-        ('resources', 'Resources')
+        ('resources', 'Resources'),
+        ('bundle', 'Bundle (zip of departments, users, resources and facilities CSVs)')
+    ])
+    mode = SelectField('Existing Rows', choices=[
+        ('insert', 'Skip rows that already exist'),
+        ('upsert', 'Update rows that already exist')
     ])
     submit = SubmitField('Upload')
+
+    def validate_file(self, file):
+        is_zip = file.data.filename.lower().endswith('.zip')
+        if is_zip != (self.upload_type.data == 'bundle'):
+            raise ValidationError('Upload bundles as a zip and everything else as a CSV file.')
+
+    def validate_mode(self, mode):
+        if self.upload_type.data == 'bundle' and mode.data != 'insert':
+            raise ValidationError('Bundles only add new rows.')
+        unsupported = upsert_unsupported() if mode.data == 'upsert' else None
+        if unsupported:
+            raise ValidationError(unsupported)
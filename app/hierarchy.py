@@ -0,0 +1,227 @@
+"""Department tree index and reporting-line queries.
+
+department_closure holds one row per (ancestor, descendant) pair, including
+each department paired with itself at depth 0, so "everything under X" is a
+single indexed lookup on the primary key. The table is maintained from mapper
+events for ORM writes; bulk inserts call sync_department_tree() instead.
+"""
+from sqlalchemy import cast, event, func, select, text, true
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.models import Department, DepartmentClosure, User
+
+
+class DepartmentCycleError(ValueError):
+    """Raised when a department would be moved underneath itself"""
+
+
+def descendant_ids(dept_id, include_self=True):
+    """SELECT of the ids of every department under dept_id, for use in IN (...) filters"""
+    query = select(DepartmentClosure.descendant_id).where(DepartmentClosure.ancestor_id == dept_id)
+    if not include_self:
+        query = query.where(DepartmentClosure.depth > 0)
+    return query
+
+
+def ancestor_ids(dept_id, include_self=True):
+    """SELECT of the ids of every department above dept_id, nearest first"""
+    query = select(DepartmentClosure.ancestor_id).where(DepartmentClosure.descendant_id == dept_id)
+    if not include_self:
+        query = query.where(DepartmentClosure.depth > 0)
+    return query.order_by(DepartmentClosure.depth)
+
+
+def is_descendant(dept_id, ancestor_id):
+    return db.session.scalar(
+        select(DepartmentClosure.depth).where(
+            DepartmentClosure.ancestor_id == ancestor_id,
+            DepartmentClosure.descendant_id == dept_id
+        )
+    ) is not None
+
+
+_LINK_PENDING = text("""
+    INSERT INTO department_closure (ancestor_id, descendant_id, depth)
+    SELECT c.ancestor_id, d.id, c.depth + 1
+    FROM department d
+    JOIN department_closure c ON c.descendant_id = d.parent_id
+    WHERE NOT EXISTS (SELECT 1 FROM department_closure s WHERE s.descendant_id = d.id AND s.depth = 0)
+""")
+
+_ADD_SELF_ROWS = text("""
+    INSERT INTO department_closure (ancestor_id, descendant_id, depth)
+    SELECT d.id, d.id, 0
+    FROM department d
+    WHERE NOT EXISTS (SELECT 1 FROM department_closure s WHERE s.descendant_id = d.id AND s.depth = 0)
+      AND (d.parent_id IS NULL
+           OR NOT EXISTS (SELECT 1 FROM department p WHERE p.id = d.parent_id)
+           OR EXISTS (SELECT 1 FROM department_closure s WHERE s.descendant_id = d.parent_id AND s.depth = 0))
+""")
+
+
+def sync_department_tree(connection=None):
+    """Add closure rows for departments that don't have any yet
+
+    Works one tree level per pass, so a bulk-inserted batch is indexed in as
+    many set-based statements as the batch is deep. Departments caught in a
+    parent_id cycle are never linked. Returns the number of departments added.
+    """
+    connection = connection or db.session.connection()
+    added = 0
+    while True:
+        connection.execute(_LINK_PENDING)
+        inserted = connection.execute(_ADD_SELF_ROWS).rowcount
+        if not inserted:
+            return added
+        added += inserted
+
+
+def rebuild_department_tree(connection=None):
+    """Recompute the whole closure table from Department.parent_id"""
+    connection = connection or db.session.connection()
+    connection.execute(DepartmentClosure.__table__.delete())
+    return sync_department_tree(connection)
+
+
+def _move_subtree(connection, dept_id, new_parent_id):
+    closure = DepartmentClosure.__table__
+    subtree = select(closure.c.descendant_id).where(closure.c.ancestor_id == dept_id)
+
+    if new_parent_id is not None:
+        in_subtree = connection.execute(
+            select(closure.c.depth).where(closure.c.ancestor_id == dept_id, closure.c.descendant_id == new_parent_id)
+        ).first()
+        if in_subtree is not None:
+            raise DepartmentCycleError(f'Department {new_parent_id} is inside the subtree of department {dept_id}')
+
+    # Detach the subtree from its old ancestors
+    connection.execute(
+        closure.delete().where(
+            closure.c.descendant_id.in_(subtree),
+            closure.c.ancestor_id.notin_(subtree)
+        )
+    )
+
+    if new_parent_id is not None:
+        # Attach it below every ancestor of the new parent
+        above = aliased(DepartmentClosure, name='above')
+        below = aliased(DepartmentClosure, name='below')
+        connection.execute(
+            closure.insert().from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+                .join_from(above, below, true())
+                .where(above.descendant_id == new_parent_id, below.ancestor_id == dept_id)
+            )
+        )
+
+
+@event.listens_for(Department, 'after_insert')
+def _department_inserted(mapper, connection, target):
+    closure = DepartmentClosure.__table__
+    if target.parent_id is not None:
+        connection.execute(
+            closure.insert().from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                select(closure.c.ancestor_id, db.literal(target.id), closure.c.depth + 1)
+                .where(closure.c.descendant_id == target.parent_id)
+            )
+        )
+    connection.execute(closure.insert().values(ancestor_id=target.id, descendant_id=target.id, depth=0))
+
+
+@event.listens_for(Department, 'after_update')
+def _department_updated(mapper, connection, target):
+    closure = DepartmentClosure.__table__
+    current_parent_id = connection.execute(
+        select(closure.c.ancestor_id).where(closure.c.descendant_id == target.id, closure.c.depth == 1)
+    ).scalar()
+    new_parent_id = target.parent_id or None
+    if current_parent_id != new_parent_id:
+        _move_subtree(connection, target.id, new_parent_id)
+
+
+@event.listens_for(Department, 'after_delete')
+def _department_deleted(mapper, connection, target):
+    closure = DepartmentClosure.__table__
+    connection.execute(
+        closure.delete().where((closure.c.ancestor_id == target.id) | (closure.c.descendant_id == target.id))
+    )
+
+
+# Reporting lines are walked with recursive CTEs over User.manager_id. Each
+# row carries the comma-delimited path of ids visited so far, which stops the
+# recursion on bad data that loops back on itself.
+DEFAULT_MAX_DEPTH = 50
+
+
+def _path(*ids):
+    expr = db.literal(',')
+    for id_ in ids:
+        expr = expr + cast(id_, db.String) + ','
+    return expr
+
+
+def manager_chain_cte(user_id, max_depth=DEFAULT_MAX_DEPTH):
+    """CTE of (id, depth) for every manager above user_id, depth 1 being the direct manager"""
+    chain = (
+        select(User.manager_id.label('id'), db.literal(1).label('depth'), _path(User.id, User.manager_id).label('path'))
+        .where(User.id == user_id, User.manager_id.isnot(None), User.manager_id != User.id)
+        .cte('manager_chain', recursive=True)
+    )
+    return chain.union_all(
+        select(User.manager_id, chain.c.depth + 1, (chain.c.path + cast(User.manager_id, db.String) + ','))
+        .where(
+            User.id == chain.c.id,
+            User.manager_id.isnot(None),
+            chain.c.depth < max_depth,
+            ~chain.c.path.contains(',' + cast(User.manager_id, db.String) + ',')
+        )
+    )
+
+
+def reports_cte(user_id, max_depth=DEFAULT_MAX_DEPTH):
+    """CTE of (id, depth) for everyone reporting to user_id directly or indirectly"""
+    reports = (
+        select(User.id.label('id'), db.literal(1).label('depth'), _path(User.manager_id, User.id).label('path'))
+        .where(User.manager_id == user_id, User.id != user_id)
+        .cte('reports', recursive=True)
+    )
+    return reports.union_all(
+        select(User.id, reports.c.depth + 1, (reports.c.path + cast(User.id, db.String) + ','))
+        .where(
+            User.manager_id == reports.c.id,
+            reports.c.depth < max_depth,
+            ~reports.c.path.contains(',' + cast(User.id, db.String) + ',')
+        )
+    )
+
+
+def manager_chain(user_id, max_depth=DEFAULT_MAX_DEPTH):
+    """Return the managers above user_id, nearest first, in one query"""
+    chain = manager_chain_cte(user_id, max_depth)
+    return list(db.session.scalars(select(User).join(chain, User.id == chain.c.id).order_by(chain.c.depth)))
+
+
+def report_counts(user_id, max_depth=DEFAULT_MAX_DEPTH):
+    """Return {depth: headcount} for the report tree under user_id, in one query"""
+    reports = reports_cte(user_id, max_depth)
+    rows = db.session.execute(
+        select(reports.c.depth, func.count()).group_by(reports.c.depth).order_by(reports.c.depth)
+    )
+    return {depth: count for depth, count in rows}
+
+
+def reports(user_id, max_depth=DEFAULT_MAX_DEPTH, limit=None, offset=0):
+    """Return [(user, depth)] for the report tree under user_id, ordered by level, in one query"""
+    tree = reports_cte(user_id, max_depth)
+    query = (
+        select(User, tree.c.depth)
+        .join(tree, User.id == tree.c.id)
+        .order_by(tree.c.depth, User.id)
+        .offset(offset)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return db.session.execute(query).all()
@@ -0,0 +1,92 @@
+"""Cached identity for the Flask-Login user loader.
+
+Loading current_user used to SELECT the whole user row on every
+authenticated request. The loader now returns an Identity built from a small
+record - id, role, department, manager and active flag - held in
+identity_cache for IDENTITY_CACHE_TTL seconds. Records are tagged with the
+user's row, so a committed role or department edit or a deactivation drops
+it straight away, and deactivated users are logged out. Flask-Login keeps the Identity for the rest of the request. Any other
+attribute (username, relationships, methods) loads the User row on first
+use, once per request.
+"""
+from flask_login import UserMixin
+from sqlalchemy import select
+
+from app import db, login_manager
+from app.cache import VersionedCache, register_cache
+from app.models import User
+from app.scope import resolve_scope
+
+identity_cache = register_cache(VersionedCache(max_entries=4096, ttl=30))
+
+_RECORD_FIELDS = ('id', 'role', 'department_id', 'manager_id', 'is_active')
+
+
+def _build_record(user_id):
+    row = db.session.execute(
+        select(User.id, User.role, User.department_id, User.manager_id, User.is_active).where(User.id == user_id)
+    ).first()
+    if row is None:
+        return None, (f'user:{user_id}',)
+    return dict(row._mapping), (f'user:{user_id}',)
+
+
+def identity_record(user_id):
+    """Cached {id, role, department_id, manager_id, is_active} for a user, or None"""
+    return identity_cache.get_or_build(f'identity:{user_id}', lambda: _build_record(user_id))
+
+
+class Identity(UserMixin):
+    """current_user backed by a cached identity record; the User row loads only when needed"""
+
+    def __init__(self, record):
+        object.__setattr__(self, '_record', record)
+        object.__setattr__(self, '_user', None)
+
+    @property
+    def user(self):
+        if self._user is None:
+            object.__setattr__(self, '_user', db.session.get(User, self._record['id']))
+        return self._user
+
+    def _field(self, name):
+        # Once the row is loaded (and maybe edited) it wins over the cached record
+        return getattr(self._user, name) if self._user is not None else self._record[name]
+
+    id = property(lambda self: self._field('id'))
+    role = property(lambda self: self._field('role'))
+    department_id = property(lambda self: self._field('department_id'))
+    manager_id = property(lambda self: self._field('manager_id'))
+    is_active = property(lambda self: self._field('is_active'))
+
+    @property
+    def scope(self):
+        """The app.scope.Scope of this user's role and department"""
+        return resolve_scope(self)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.user, name, value)
+
+    def __repr__(self):
+        return f"Identity({self._record['id']}, '{self._record['role']}')"
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    record = identity_record(int(user_id))
+    # A deactivated account is logged out on its next request
+    if record is None or not record['is_active']:
+        return None
+    return Identity(record)
+
+
+def init_app(app):
+    app.config.setdefault('IDENTITY_CACHE_MAX_ENTRIES', 4096)
+    app.config.setdefault('IDENTITY_CACHE_TTL', 30)
+    identity_cache.max_entries = app.config['IDENTITY_CACHE_MAX_ENTRIES']
+    identity_cache.ttl = app.config['IDENTITY_CACHE_TTL']
@@ -0,0 +1,417 @@
+"""Streaming, chunked bulk import engine shared by the CSV upload paths.
+
+Rows are consumed in bounded-size chunks. Each chunk is de-duplicated
+against the database with a single set-based query, written with one bulk
+INSERT and committed on its own, so the SQLite write lock is only held for
+the duration of a single chunk. Writing needs memory for one chunk at a
+time; uploads are validated as a whole first, also a chunk at a time (see
+app.validation.read_validated_csv).
+
+In upsert mode rows whose natural key already exists update that row
+instead of being skipped, and only rows whose content changed are written
+(see app.upsert).
+"""
+import csv
+import io
+import math
+import time
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy import func, insert, or_, select
+
+from app import db
+from app.models import User, Department, Resource, Facility
+from app.cache import invalidate, row_tags
+from app.search import index_new_rows, index_rows
+from app.stats import apply_rows
+from app.hierarchy import sync_department_tree
+from app.passwords import assign_passwords, DEFAULT_TOKEN_TTL, UNUSABLE_PASSWORD
+from app.upsert import NATURAL_KEYS, upsert_rows
+from app.tokens import claims_changed, revoke_user_tokens
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_PASSWORD = 'defaultpassword'
+IMPORT_MODES = ('insert', 'upsert')
+
+
+class ImportValidationError(Exception):
+    """Raised when a chunk fails validation; carries the error list and progress so far"""
+
+    def __init__(self, errors, stats=None):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+        self.stats = stats
+
+
+class ImportCancelled(Exception):
+    """Raised from a progress callback to stop an import between chunks"""
+
+
+class ImportStats:
+    """Counters reported back to the caller once an import finishes"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows_read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.chunks = 0
+        self.started_at = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started_at
+        return self
+
+    @property
+    def rows_per_sec(self):
+        elapsed = self.elapsed or (time.perf_counter() - self.started_at)
+        return self.rows_read / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'rows_read': self.rows_read,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'duplicates': self.duplicates,
+            'skipped': self.skipped,
+            'chunks': self.chunks,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_sec': round(self.rows_per_sec, 1)
+        }
+
+
+def iter_csv_chunks(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of row dicts from a binary CSV stream without reading it all into memory"""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    reader = csv.DictReader(text)
+    try:
+        while True:
+            chunk = list(islice(reader, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        # Don't let the wrapper close the underlying upload stream
+        text.detach()
+
+
+def read_csv_file(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream chunks from a CSV file on disk, closing it once exhausted"""
+    with open(path, 'rb') as f:
+        yield from iter_csv_chunks(f, chunk_size)
+
+
+def _clean(value):
+    """Normalise blank strings and pandas NaN to None"""
+    if value is None:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def _to_int(value):
+    value = _clean(value)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return int(float(value))
+
+
+def _build_user(row):
+    email = _clean(row.get('email'))
+    username = _clean(row.get('username')) or _clean(row.get('name'))
+    if not email or not username:
+        return None
+    return {
+        'username': str(username),
+        'email': str(email),
+        'role': _clean(row.get('role')) or 'REGULAR_USER',
+        'department_id': _to_int(row.get('department_id')),
+        'manager_id': _to_int(row.get('manager_id'))
+    }
+
+
+def _build_department(row):
+    name = _clean(row.get('name'))
+    if not name:
+        return None
+    parent_id = row.get('parent_id') if 'parent_id' in row else row.get('parent_department_id')
+    department = {
+        'name': str(name),
+        'description': _clean(row.get('description')) or '',
+        'head_id': _to_int(row.get('head_id')),
+        'parent_id': _to_int(parent_id)
+    }
+    # Files whose rows refer to each other carry explicit ids (see app.validation)
+    if _to_int(row.get('id')) is not None:
+        department['id'] = _to_int(row.get('id'))
+    return department
+
+
+def _build_resource(row):
+    name = _clean(row.get('name'))
+    resource_type = _clean(row.get('type'))
+    department_id = _to_int(row.get('department_id'))
+    if not name or not resource_type or department_id is None:
+        return None
+    return {
+        'name': str(name),
+        'type': str(resource_type),
+        'status': _clean(row.get('status')) or 'available',
+        'department_id': department_id,
+        'assigned_to_id': _to_int(row.get('assigned_to_id'))
+    }
+
+
+def _build_facility(row):
+    name = _clean(row.get('name'))
+    department_id = _to_int(row.get('department_id'))
+    if not name or department_id is None:
+        return None
+    return {
+        'name': str(name),
+        'type': _clean(row.get('type')) or 'OFFICE',
+        'capacity': _to_int(row.get('capacity')),
+        'location': _clean(row.get('location')),
+        'status': _clean(row.get('status')) or 'available',
+        'department_id': department_id
+    }
+
+
+def _existing_user_keys(rows):
+    emails = {r['email'] for r in rows}
+    usernames = {r['username'] for r in rows}
+    existing = db.session.execute(
+        select(User.email, User.username).where(or_(User.email.in_(emails), User.username.in_(usernames)))
+    ).all()
+    return {('email', e) for e, _ in existing} | {('username', u) for _, u in existing}
+
+
+def _user_keys(row):
+    return [('email', row['email']), ('username', row['username'])]
+
+
+def _existing_department_keys(rows):
+    # Keyed like the unique index on (name, COALESCE(parent_id, 0)): a name repeats under different parents
+    names = {r['name'] for r in rows}
+    return set(db.session.execute(
+        select(Department.name, func.coalesce(Department.parent_id, 0)).where(Department.name.in_(names))
+    ).all())
+
+
+def _department_keys(row):
+    return [(row['name'], row['parent_id'] or 0)]
+
+
+def _existing_named_keys(model):
+    def existing(rows):
+        names = {r['name'] for r in rows}
+        return set(db.session.execute(
+            select(model.name, model.department_id).where(model.name.in_(names))
+        ).all())
+    return existing
+
+
+def _named_keys(row):
+    return [(row['name'], row['department_id'])]
+
+
+# kind -> (model, row builder, set-based existing-key lookup, natural keys of a row)
+IMPORT_SPECS = {
+    'users': (User, _build_user, _existing_user_keys, _user_keys),
+    'departments': (Department, _build_department, _existing_department_keys, _department_keys),
+    'resources': (Resource, _build_resource, _existing_named_keys(Resource), _named_keys),
+    'facilities': (Facility, _build_facility, _existing_named_keys(Facility), _named_keys)
+}
+
+
+# kind -> {column: CSV headers it is read from}; an upsert only overwrites columns the file has
+UPSERT_COLUMNS = {
+    'users': {'username': ('username', 'name'), 'role': ('role',), 'department_id': ('department_id',),
+              'manager_id': ('manager_id',)},
+    'departments': {'description': ('description',), 'head_id': ('head_id',)},
+    'resources': {'type': ('type',), 'status': ('status',), 'assigned_to_id': ('assigned_to_id',)},
+    'facilities': {'type': ('type',), 'capacity': ('capacity',), 'location': ('location',), 'status': ('status',)}
+}
+
+
+def _prepare_chunk(kind, chunk, stats):
+    """Build insertable rows for one chunk, dropping invalid rows and duplicates"""
+    model, build_row, existing_keys, row_keys = IMPORT_SPECS[kind]
+
+    rows = []
+    for raw in chunk:
+        stats.rows_read += 1
+        row = build_row(raw)
+        if row is None:
+            stats.skipped += 1
+            continue
+        rows.append(row)
+
+    if not rows:
+        return rows
+
+    # One query per chunk resolves duplicates against the database
+    seen = existing_keys(rows)
+    fresh = []
+    for row in rows:
+        keys = row_keys(row)
+        if any(key in seen for key in keys):
+            stats.duplicates += 1
+            continue
+        seen.update(keys)
+        fresh.append(row)
+    return fresh
+
+
+def _insert_chunk(kind, chunk, stats, set_passwords):
+    model = IMPORT_SPECS[kind][0]
+    rows = _prepare_chunk(kind, chunk, stats)
+    if not rows:
+        return
+    if kind == 'users':
+        set_passwords(rows)
+    last_id = db.session.scalar(select(func.max(model.id))) or 0
+    db.session.execute(insert(model), rows)
+    apply_rows(model, rows)
+    if kind == 'departments':
+        # Bulk inserts bypass mapper events, so index the new rows here
+        sync_department_tree()
+    explicit_ids = [row['id'] for row in rows if 'id' in row]
+    if explicit_ids:
+        index_rows(model, explicit_ids)
+    else:
+        index_new_rows(model, last_id)
+    db.session.commit()
+    # Bulk inserts don't go through the ORM flush, so invalidate caches here
+    invalidate(*row_tags(model, rows))
+    stats.inserted += len(rows)
+
+
+def _build_upsert_chunk(kind, chunk, stats):
+    """Build rows for one chunk, keeping the first row for each natural key"""
+    model, build_row = IMPORT_SPECS[kind][:2]
+    rows, seen = [], set()
+    for raw in chunk:
+        stats.rows_read += 1
+        row = build_row(raw)
+        if row is None:
+            stats.skipped += 1
+            continue
+        if 'id' in row:
+            raise ValueError('Rows cannot carry their own ids in upsert mode')
+        key = tuple(row[name] for name in NATURAL_KEYS[model])
+        if key in seen:
+            stats.duplicates += 1
+            continue
+        seen.add(key)
+        if model is User:
+            # Filled in for new accounts only; existing ones keep their password
+            row.update(password=UNUSABLE_PASSWORD, password_token=None, password_token_expires_at=None)
+        rows.append(row)
+    return rows
+
+
+def _upsert_chunk(kind, chunk, stats, set_passwords):
+    model = IMPORT_SPECS[kind][0]
+    rows = _build_upsert_chunk(kind, chunk, stats)
+    if not rows:
+        return
+    headers = set(chunk[0])
+    update_columns = [
+        column for column, sources in UPSERT_COLUMNS[kind].items() if headers.intersection(sources)
+    ]
+
+    last_id = db.session.scalar(select(func.max(model.id))) or 0
+    inserted, updated = upsert_rows(model, rows, update_columns,
+                                    prepare_new=set_passwords if model is User else None)
+    old_rows = [old for _, old, _ in updated]
+    new_rows = [{**old, **{column: row[column] for column in update_columns}} for _, old, row in updated]
+    apply_rows(model, inserted)
+    apply_rows(model, old_rows, sign=-1)
+    apply_rows(model, new_rows)
+    if inserted:
+        if kind == 'departments':
+            sync_department_tree()
+        index_new_rows(model, last_id)
+    if updated:
+        index_rows(model, [id_ for id_, _, _ in updated], replace=True)
+    db.session.commit()
+
+    # Table-level tags tell listeners (e.g. the typeahead index) that rows changed outside the ORM
+    invalidate(*row_tags(model, inserted + old_rows + new_rows))
+    if updated:
+        # Row tags drop cached identities (see app.identity) along with everything else about these rows
+        invalidate(*(f'{model.__table__.name}:{id_}' for id_, _, _ in updated))
+    if model is User:
+        revoke_user_tokens([old['id'] for old, new in zip(old_rows, new_rows) if claims_changed(old, new)])
+    stats.inserted += len(inserted)
+    stats.updated += len(updated)
+    stats.unchanged += len(rows) - len(inserted) - len(updated)
+
+
+def password_setter(password, password_mode=None):
+    """Function giving a list of new user rows their passwords, as configured for imports"""
+    mode = password_mode or current_app.config.get('IMPORT_PASSWORD_MODE', 'hash')
+    if mode == 'shared' and not current_app.testing:
+        # One salted hash for a whole batch: crack it once and every account falls
+        raise ValueError("The 'shared' password mode is only allowed under TESTING")
+
+    def set_passwords(rows):
+        assign_passwords(rows, password, mode=mode,
+                         rounds=current_app.config.get('BCRYPT_LOG_ROUNDS', 12),
+                         workers=current_app.config.get('PASSWORD_HASH_WORKERS'),
+                         token_ttl=current_app.config.get('PASSWORD_TOKEN_TTL', DEFAULT_TOKEN_TTL))
+    return set_passwords
+
+
+def run_import(kind, chunks, password=DEFAULT_PASSWORD, on_progress=None, password_mode=None, mode='insert'):
+    """Import an iterable of row-dict chunks for the given kind and return ImportStats
+
+    mode is 'insert' (rows whose natural key exists are skipped as duplicates)
+    or 'upsert' (they update the existing row where their content differs).
+
+    password_mode overrides IMPORT_PASSWORD_MODE for user imports (see
+    app.passwords.assign_passwords).
+
+    on_progress, if given, is called with the running ImportStats after every
+    committed chunk and may raise ImportCancelled to stop the import.
+    """
+    if kind not in IMPORT_SPECS:
+        raise ValueError(f'Unknown import type: {kind}')
+    if mode not in IMPORT_MODES:
+        raise ValueError(f'Unknown import mode: {mode}')
+    stats = ImportStats(kind)
+    set_passwords = password_setter(password, password_mode)
+
+    try:
+        for chunk in chunks:
+            if mode == 'upsert':
+                _upsert_chunk(kind, chunk, stats, set_passwords)
+            else:
+                _insert_chunk(kind, chunk, stats, set_passwords)
+            stats.chunks += 1
+            if on_progress:
+                on_progress(stats)
+    except (ImportValidationError, ImportCancelled) as e:
+        db.session.rollback()
+        e.stats = stats.finish()
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return stats.finish()
@@ -1,14 +1,14 @@
-from app import create_app, db, bcrypt
+from app import create_app, db
 from app.models import User, Department, Resource, Facility
+from app.passwords import hash_passwords
+from app.migrate import recreate_database
 from datetime import datetime
 
 def init_db():
     app = create_app()
     with app.app_context():
-        # Drop all tables
-        db.drop_all()
-        # Create all tables
-        db.create_all()
+        # Drop all tables and rebuild the schema from the migrations
+        recreate_database()
 
         # Create initial departments
         departments = {
@@ -50,14 +50,21 @@ def init_db():
             }
         }
 
+        # Hash each seed password once; every seeded account shares it
+        admin_password, user_password = hash_passwords(
+            ['admin123', 'user123'],
+            rounds=app.config.get('BCRYPT_LOG_ROUNDS', 12),
+            dedupe=True
+        )
+
         # Create master admin
         master_admin = User(
             username='masteradmin',
             email='master@example.com',
+            password=admin_password,
             role='MASTER_ADMIN',
             join_date=datetime.utcnow()
         )
-        master_admin.set_password('admin123')
         db.session.add(master_admin)
         db.session.commit()
 
@@ -77,11 +84,11 @@ def init_db():
             org_admin = User(
                 username=f'orgadmin_{main_dept_key.lower()}',
                 email=f'org_{main_dept_key.lower()}@example.com',
+                password=admin_password,
                 role='ORG_ADMIN',
                 department_id=main_dept.id,
                 join_date=datetime.utcnow()
             )
-            org_admin.set_password('admin123')
             db.session.add(org_admin)
             db.session.commit()
 
@@ -99,12 +106,12 @@ def init_db():
                 dept_admin = User(
                     username=f"deptadmin_{sub_dept_data['name'].lower().replace(' ', '_')}",
                     email=f"dept_{sub_dept_data['name'].lower().replace(' ', '_')}@example.com",
+                    password=admin_password,
                     role='DEPT_ADMIN',
                     department_id=sub_dept.id,
                     manager_id=org_admin.id,
                     join_date=datetime.utcnow()
                 )
-                dept_admin.set_password('admin123')
                 db.session.add(dept_admin)
                 db.session.commit()
 
@@ -117,12 +124,12 @@ def init_db():
                     user = User(
                         username=f"user_{sub_dept_data['name'].lower().replace(' ', '_')}_{i}",
                         email=f"user_{sub_dept_data['name'].lower().replace(' ', '_')}_{i}@example.com",
-                        role='USER',
+                        password=user_password,
+                        role='REGULAR_USER',
                         department_id=sub_dept.id,
                         manager_id=dept_admin.id,
                         join_date=datetime.utcnow()
                     )
-                    user.set_password('user123')
                     db.session.add(user)
                 db.session.commit()
 
@@ -0,0 +1,334 @@
+"""Persistent background runner for bulk import jobs.
+
+Uploads are spooled to disk and handed to a bounded thread pool so the web
+request returns immediately. Job state lives in the import_job table, which
+makes progress visible from any worker process and survives restarts.
+The spooled upload is deleted when its job ends; a validation error report
+written next to it is kept for download.
+
+A job runs in the process that accepted it, which refreshes the updated_at
+of every job it holds, queued or running, every IMPORT_JOB_HEARTBEAT_SECONDS.
+A job without a heartbeat for IMPORT_JOB_STALE_SECONDS is taken to have
+lost its process: it no longer counts towards IMPORT_MAX_ACTIVE_JOBS and is
+marked failed when next read. A process never gives up on the jobs it holds
+itself. After a restart, fail_orphaned_jobs() fails every job left queued or
+running at once.
+
+Bundle imports (see app.bundle) load in a single transaction, so their jobs
+report progress only once the whole bundle has committed and cannot be
+cancelled once running. That transaction can keep the heartbeat from being
+written (SQLite locks the whole database for it), so running bundles are
+never taken to be stale.
+"""
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+
+from flask import current_app
+from sqlalchemy import and_, func, not_, or_, select, update
+
+from app import db
+from app.bundle import load_bundle, read_validated_bundle, write_bundle
+from app.importer import run_import, ImportCancelled, ImportValidationError, DEFAULT_PASSWORD
+from app.models import ImportJob
+from app.validation import report_path
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class TooManyJobs(Exception):
+    """Raised when the concurrent import job cap has been reached"""
+
+
+def init_app(app):
+    app.config.setdefault('IMPORT_WORKERS', 2)
+    app.config.setdefault('IMPORT_MAX_ACTIVE_JOBS', 4)
+    app.config.setdefault('IMPORT_JOB_STALE_SECONDS', 600)
+    app.config.setdefault('IMPORT_JOB_HEARTBEAT_SECONDS', 60)
+    app.config.setdefault('IMPORT_SPOOL_DIR', os.path.join(app.instance_path, 'imports'))
+    app.extensions['import_executor'] = ThreadPoolExecutor(
+        max_workers=app.config['IMPORT_WORKERS'],
+        thread_name_prefix='import-job'
+    )
+    app.extensions['import_heartbeat'] = Heartbeat(app)
+
+
+class Heartbeat:
+    """Refreshes updated_at for the jobs this process holds, from a thread of its own while there are any"""
+
+    def __init__(self, app):
+        self.app = app
+        self.job_ids = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __contains__(self, job_id):
+        return job_id in self.job_ids
+
+    def add(self, job_id):
+        with self._lock:
+            self.job_ids.add(job_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='import-heartbeat', daemon=True)
+                self._thread.start()
+
+    def discard(self, job_id):
+        with self._lock:
+            self.job_ids.discard(job_id)
+
+    def beat(self):
+        """Write the heartbeat of every job held; running bundles are skipped as their transaction holds the lock"""
+        job_ids = list(self.job_ids)
+        if not job_ids:
+            return
+        with self.app.app_context():
+            try:
+                db.session.execute(
+                    update(ImportJob)
+                    .where(ImportJob.id.in_(job_ids), ImportJob.status.in_(ACTIVE_STATUSES), not_(_running_bundle()))
+                    .values(updated_at=datetime.utcnow())
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.app.logger.warning('Could not record the import job heartbeat', exc_info=True)
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['IMPORT_JOB_HEARTBEAT_SECONDS'])
+            with self._lock:
+                if not self.job_ids:
+                    self._thread = None
+                    return
+            self.beat()
+
+
+def spool_path(job_id, extension='.csv'):
+    return os.path.join(current_app.config['IMPORT_SPOOL_DIR'], f'{job_id}{extension}')
+
+
+def error_report_path(job_id):
+    """The CSV of validation problems for a job (see app.validation); may not exist"""
+    return report_path(spool_path(job_id))
+
+
+def _count_rows(f):
+    lines = 0
+    last = b''
+    for block in iter(lambda: f.read(1 << 20), b''):
+        lines += block.count(b'\n')
+        last = block
+    if last and not last.endswith(b'\n'):
+        lines += 1
+    # Don't count the header line
+    return max(lines - 1, 0)
+
+
+def _spool_upload(file, path):
+    """Save the uploaded file (or, for a bundle, {kind: file}) to disk and return an estimate of its data rows"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if isinstance(file, dict):
+        write_bundle(file, path)
+    else:
+        file.save(path)
+    if not path.endswith('.zip'):
+        with open(path, 'rb') as f:
+            return _count_rows(f)
+    rows = 0
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.filename.lower().endswith('.csv'):
+                with archive.open(info) as member:
+                    rows += _count_rows(member)
+    return rows
+
+
+def _heartbeat():
+    return current_app.extensions['import_heartbeat']
+
+
+def _running_bundle():
+    return and_(ImportJob.kind == 'bundle', ImportJob.status == 'running')
+
+
+def _stale_before():
+    return datetime.utcnow() - timedelta(seconds=current_app.config['IMPORT_JOB_STALE_SECONDS'])
+
+
+def _is_stale(job):
+    return (job.status in ACTIVE_STATUSES and job.updated_at < _stale_before()
+            and not (job.kind == 'bundle' and job.status == 'running') and job.id not in _heartbeat())
+
+
+def active_job_count():
+    """Queued and running jobs, leaving out those whose process stopped sending heartbeats"""
+    return db.session.scalar(
+        select(func.count(ImportJob.id))
+        .where(ImportJob.status.in_(ACTIVE_STATUSES), or_(
+            ImportJob.updated_at >= _stale_before(), _running_bundle(), ImportJob.id.in_(list(_heartbeat().job_ids))
+        ))
+    )
+
+
+def fail_orphaned_jobs(updated_before=None):
+    """Fail queued and running jobs last updated before updated_before (default: now); returns how many
+
+    Call at startup, before this process accepts uploads: jobs only run in
+    the process that accepted them, so any still active were lost with it.
+    """
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(ImportJob)
+        .where(ImportJob.status.in_(ACTIVE_STATUSES), ImportJob.updated_at < (updated_before or now))
+        .values(status='failed', error='Import worker stopped responding', finished_at=now)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def _submit(app, kind, mode, file, filename, extension, load, created_by_id):
+    if active_job_count() >= app.config['IMPORT_MAX_ACTIVE_JOBS']:
+        raise TooManyJobs('Too many import jobs are already running. Please try again later.')
+
+    job_id = str(uuid.uuid4())
+    path = spool_path(job_id, extension)
+    rows_total = _spool_upload(file, path)
+
+    job = ImportJob(
+        id=job_id,
+        kind=kind,
+        mode=mode,
+        filename=filename[:255],
+        created_by_id=created_by_id,
+        rows_total=rows_total
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    app.extensions['import_heartbeat'].add(job_id)
+    app.extensions['import_executor'].submit(_run_job, app, job_id, path, load)
+    return job
+
+
+def submit_import(app, kind, file, chunk_reader, password=DEFAULT_PASSWORD, created_by_id=None, mode='insert'):
+    """Spool an upload, record a queued ImportJob and schedule it on the worker pool
+
+    chunk_reader is called with the spooled file path inside the worker and
+    must return an iterable of row-dict chunks for run_import; mode is passed
+    on to run_import.
+    """
+    return _submit(app, kind, mode, file, file.filename, '.csv',
+                   partial(_load_csv, kind, chunk_reader, password, mode), created_by_id)
+
+
+def submit_bundle(app, file, password=DEFAULT_PASSWORD, created_by_id=None):
+    """Like submit_import, for a bundle: an uploaded zip, or {kind: uploaded CSV} packed into one"""
+    filename = ', '.join(part.filename for part in file.values()) if isinstance(file, dict) else file.filename
+    return _submit(app, 'bundle', 'insert', file, filename, '.zip', partial(_load_bundle, password), created_by_id)
+
+
+def cancel_import(job_id):
+    """Flag a job for cancellation; the worker stops after its current chunk"""
+    job = db.session.get(ImportJob, job_id)
+    if job is None:
+        return None
+    if job.status in ACTIVE_STATUSES:
+        job.cancel_requested = True
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+    return job
+
+
+def get_job(job_id):
+    """Load a job, failing it if it is queued or running but its process stopped sending heartbeats"""
+    job = db.session.get(ImportJob, job_id)
+    if job is not None and _is_stale(job):
+        job.status = 'failed'
+        job.error = 'Import worker stopped responding'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    return job
+
+
+def _record_progress(job_id, stats, **values):
+    """Write the latest counters for a job and return whether cancellation was requested"""
+    rows_total = db.session.scalar(select(ImportJob.rows_total).where(ImportJob.id == job_id)) or 0
+    throughput = stats.rows_per_sec
+    remaining = max(rows_total - stats.rows_read, 0)
+    progress = {
+        'rows_processed': stats.rows_read,
+        'rows_inserted': stats.inserted,
+        'rows_updated': stats.updated,
+        'rows_unchanged': stats.unchanged,
+        'rows_duplicate': stats.duplicates,
+        'rows_failed': stats.skipped,
+        'throughput': throughput,
+        'eta_seconds': remaining / throughput if throughput else None,
+        'updated_at': datetime.utcnow()
+    }
+    progress.update(values)
+    db.session.execute(update(ImportJob).where(ImportJob.id == job_id).values(**progress))
+    db.session.commit()
+    return db.session.scalar(select(ImportJob.cancel_requested).where(ImportJob.id == job_id))
+
+
+def _finish(job_id, status, stats=None, error=None):
+    values = {'status': status, 'finished_at': datetime.utcnow(), 'error': error}
+    if status == 'completed':
+        values['eta_seconds'] = 0
+    if stats is not None:
+        _record_progress(job_id, stats, **values)
+    else:
+        db.session.execute(update(ImportJob).where(ImportJob.id == job_id).values(updated_at=datetime.utcnow(), **values))
+        db.session.commit()
+
+
+def _load_csv(kind, chunk_reader, password, mode, path, on_progress):
+    return run_import(kind, chunk_reader(path), password=password, on_progress=on_progress, mode=mode)
+
+
+def _load_bundle(password, path, on_progress):
+    # One transaction: progress is recorded by _finish once it has committed, and until then
+    # the job is exempt from the staleness check
+    return load_bundle(read_validated_bundle(path), password=password)
+
+
+def _run_job(app, job_id, path, load):
+    with app.app_context():
+        try:
+            job = db.session.get(ImportJob, job_id)
+            # Cancelled, or given up on while it waited in the queue
+            if job is None or job.cancel_requested or job.status != 'queued':
+                return
+            job.status = 'running'
+            job.started_at = job.updated_at = datetime.utcnow()
+            db.session.commit()
+
+            def on_progress(stats):
+                if _record_progress(job_id, stats):
+                    raise ImportCancelled()
+
+            stats = load(path, on_progress)
+            _finish(job_id, 'completed', stats)
+        except ImportCancelled as e:
+            _finish(job_id, 'cancelled', e.stats)
+        except ImportValidationError as e:
+            _finish(job_id, 'failed', e.stats, error='; '.join(e.errors))
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('Import job %s failed', job_id)
+            _finish(job_id, 'failed', error=str(e))
+        finally:
+            app.extensions['import_heartbeat'].discard(job_id)
+            db.session.remove()
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,28 @@
+"""Relationship loader options for each view.
+
+Relationships stay lazy in app.models so single-object pages only load what
+they touch. Views that read a relationship for every row of a listing apply
+one of these option sets instead, so the related rows come back in the same
+query (joinedload, for many-to-one) or one extra IN query (selectinload, for
+collections) rather than one query per row.
+"""
+from sqlalchemy.orm import joinedload, undefer
+
+from app.models import User, Department, Resource
+
+# manage_departments.html: head, parent and headcount on every row
+DEPARTMENT_LISTING = (
+    joinedload(Department.head).load_only(User.id, User.username),
+    joinedload(Department.parent).load_only(Department.id, Department.name),
+    undefer(Department.member_count)
+)
+
+# manage_resources.html: the assignee's username on every row
+RESOURCE_LISTING = (
+    joinedload(Resource.assigned_user).load_only(User.id, User.username),
+)
+
+# User detail endpoints that show the department and its head
+USER_WITH_DEPARTMENT = (
+    joinedload(User.department).joinedload(Department.head),
+)
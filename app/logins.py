@@ -0,0 +1,178 @@
+"""Login pipeline: bounded password verification and buffered last_login writes.
+
+bcrypt checks run on a fixed pool of LOGIN_HASH_WORKERS threads (bcrypt
+releases the GIL), so a login storm uses at most that many cores instead of
+one per request thread. Once LOGIN_MAX_PENDING checks are queued, further
+logins fail fast with LoginBusy rather than piling up. A hash with a lower
+work factor than BCRYPT_LOG_ROUNDS is upgraded on the next successful login;
+stronger ones are left as they are.
+
+last_login timestamps are buffered in memory and written in one batched
+UPDATE every LAST_LOGIN_FLUSH_INTERVAL seconds (or once LAST_LOGIN_FLUSH_SIZE
+are waiting), instead of one commit per login. Set LOGIN_HASH_WORKERS or
+LAST_LOGIN_FLUSH_INTERVAL to 0 to do that step on the request thread.
+"""
+import atexit
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import bcrypt as _bcrypt
+from flask import current_app
+from sqlalchemy import bindparam, or_, update
+
+from app import db
+from app.metrics import timed
+from app.models import User
+from app.passwords import UNUSABLE_PASSWORD
+
+logger = logging.getLogger(__name__)
+
+
+class LoginBusy(Exception):
+    """Raised when too many password checks are already queued"""
+
+
+def hash_rounds(hashed):
+    """Work factor of a bcrypt hash, e.g. 12 for $2b$12$..."""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _check(password, hashed, rounds):
+    """(matches, upgraded hash or None); runs on the pool"""
+    if not _bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8')):
+        return False, None
+    # Only ever upgrade: a hash stronger than configured (e.g. from a server with more rounds) is kept
+    current = hash_rounds(hashed)
+    if current is not None and current >= rounds:
+        return True, None
+    return True, _bcrypt.hashpw(password.encode('utf-8'), _bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+class PasswordVerifier:
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash') if workers else None
+        self._slots = threading.BoundedSemaphore(max_pending) if workers else None
+
+    def check(self, password, hashed, rounds):
+        if self._executor is None:
+            return _check(password, hashed, rounds)
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy('Too many sign-ins in progress; try again in a moment.')
+        try:
+            return self._executor.submit(_check, password, hashed, rounds).result()
+        finally:
+            self._slots.release()
+
+
+def verify_password(user, password):
+    """True if password matches user's hash; upgrades the hash to BCRYPT_LOG_ROUNDS on success
+
+    Raises LoginBusy when the verification queue is full.
+    """
+    if not user.password or user.password == UNUSABLE_PASSWORD:
+        return False
+    rounds = current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+    with timed('bcrypt'):
+        matches, upgraded = current_app.extensions['password_verifier'].check(password, user.password, rounds)
+    if upgraded:
+        user.password = upgraded
+        db.session.commit()
+    return matches
+
+
+class LastLoginBuffer:
+    def __init__(self, app, interval, max_size):
+        self.app = app
+        self.interval = interval
+        self.max_size = max_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record(self, user_id, when):
+        with self._lock:
+            self._pending[user_id] = max(when, self._pending.get(user_id, when))
+            full = len(self._pending) >= self.max_size
+            if self._thread is None:
+                # Started on first use so CLI commands and scripts don't spawn it
+                self._thread = threading.Thread(target=self._run, name='last-login-flush', daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Writing buffered last_login times failed')
+
+    def flush(self):
+        """Write every buffered timestamp in one UPDATE; returns the number written"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        table = User.__table__
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam('user_id'))
+            .where(or_(table.c.last_login.is_(None), table.c.last_login < bindparam('when')))
+            .values(last_login=bindparam('when'))
+        )
+        with self.app.app_context():
+            try:
+                db.session.execute(statement, [{'user_id': u, 'when': w} for u, w in pending.items()])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Put them back so the next flush retries
+                with self._lock:
+                    for user_id, when in pending.items():
+                        self._pending[user_id] = max(when, self._pending.get(user_id, when))
+                raise
+            finally:
+                db.session.remove()
+        return len(pending)
+
+
+def record_login(user):
+    """Note a successful login; last_login is written by the next batch flush"""
+    now = datetime.utcnow()
+    buffer = current_app.extensions.get('last_login_buffer')
+    if buffer is None:
+        user.last_login = now
+        db.session.commit()
+    else:
+        buffer.record(user.id, now)
+
+
+def flush_last_logins():
+    buffer = current_app.extensions.get('last_login_buffer')
+    return buffer.flush() if buffer is not None else 0
+
+
+def init_app(app):
+    app.config.setdefault('LOGIN_HASH_WORKERS', os.cpu_count() or 1)
+    app.config.setdefault('LOGIN_MAX_PENDING', 16 * (os.cpu_count() or 1))
+    app.config.setdefault('LAST_LOGIN_FLUSH_INTERVAL', 5)
+    app.config.setdefault('LAST_LOGIN_FLUSH_SIZE', 1000)
+    app.extensions['password_verifier'] = PasswordVerifier(
+        app.config['LOGIN_HASH_WORKERS'], app.config['LOGIN_MAX_PENDING']
+    )
+    if app.config['LAST_LOGIN_FLUSH_INTERVAL']:
+        buffer = app.extensions['last_login_buffer'] = LastLoginBuffer(
+            app, app.config['LAST_LOGIN_FLUSH_INTERVAL'], app.config['LAST_LOGIN_FLUSH_SIZE']
+        )
+        atexit.register(buffer.flush)
@@ -0,0 +1,234 @@
+"""Per-request instrumentation.
+
+Every request records its endpoint, wall time, SQL statement count and time,
+template render time and bcrypt time. Finished requests are folded into
+per-endpoint stats kept in memory: the last METRICS_WINDOW samples of each
+measurement (for p50/p95/p99) and the slowest distinct statements, with
+literals and IN-lists collapsed so statements group by shape. Memory is
+bounded by the number of endpoints. Requests slower than
+METRICS_SLOW_REQUEST_MS are logged.
+"""
+import logging
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+MEASUREMENTS = ('duration_ms', 'queries', 'db_ms', 'template_ms', 'bcrypt_ms')
+PERCENTILES = (50, 95, 99)
+
+_WHITESPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'IN \((?:\?|%\(\w+\)s|:\w+)(?:, (?:\?|%\(\w+\)s|:\w+))*\)', re.IGNORECASE)
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def normalize_statement(statement, max_length=500):
+    """Collapse whitespace, literals and IN-lists so statements group by shape"""
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    statement = _IN_LIST.sub('IN (...)', statement)
+    statement = _LITERAL.sub('?', statement)
+    return statement[:max_length]
+
+
+class RequestMetrics:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.bcrypt_ms = 0.0
+        self.statements = []
+
+    def add_query(self, statement, ms):
+        self.queries += 1
+        self.db_ms += ms
+        self.statements.append((ms, statement))
+
+
+def _percentiles(samples):
+    if not samples:
+        return {f'p{p}': None for p in PERCENTILES}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {f'p{p}': round(ordered[min(last, int(round(p / 100 * last)))], 2) for p in PERCENTILES}
+
+
+class EndpointStats:
+    def __init__(self, window, max_statements):
+        self.count = 0
+        self.errors = 0
+        self.samples = {name: deque(maxlen=window) for name in MEASUREMENTS}
+        self.max_statements = max_statements
+        # normalized statement -> [max_ms, total_ms, count]
+        self.statements = {}
+
+    def add(self, metrics, duration_ms, status_code):
+        self.count += 1
+        if status_code >= 500:
+            self.errors += 1
+        values = (duration_ms, metrics.queries, metrics.db_ms, metrics.template_ms, metrics.bcrypt_ms)
+        for name, value in zip(MEASUREMENTS, values):
+            self.samples[name].append(value)
+        for ms, statement in metrics.statements:
+            key = normalize_statement(statement)
+            entry = self.statements.get(key)
+            if entry is None:
+                if len(self.statements) >= self.max_statements:
+                    # Make room by dropping the fastest statement seen so far, if this one is slower
+                    fastest = min(self.statements, key=lambda k: self.statements[k][0])
+                    if self.statements[fastest][0] >= ms:
+                        continue
+                    del self.statements[fastest]
+                entry = self.statements[key] = [0.0, 0.0, 0]
+            entry[0] = max(entry[0], ms)
+            entry[1] += ms
+            entry[2] += 1
+
+    def to_dict(self):
+        slowest = sorted(self.statements.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            **{name: _percentiles(samples) for name, samples in self.samples.items()},
+            'slowest_statements': [
+                {'statement': statement, 'max_ms': round(max_ms, 2), 'avg_ms': round(total / count, 2), 'count': count}
+                for statement, (max_ms, total, count) in slowest
+            ]
+        }
+
+
+class MetricsRegistry:
+    def __init__(self, window=1024, max_statements=10):
+        self.window = window
+        self.max_statements = max_statements
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def record(self, metrics, duration_ms, status_code):
+        with self._lock:
+            stats = self._endpoints.get(metrics.endpoint)
+            if stats is None:
+                stats = self._endpoints[metrics.endpoint] = EndpointStats(self.window, self.max_statements)
+            stats.add(metrics, duration_ms, status_code)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'since': self.started_at,
+                'window': self.window,
+                'endpoints': {endpoint: stats.to_dict() for endpoint, stats in sorted(self._endpoints.items())}
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self.started_at = time.time()
+
+
+registry = MetricsRegistry()
+
+
+def _current():
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+@contextmanager
+def timed(kind):
+    """Add the time spent in the block to the current request's <kind>_ms, e.g. timed('bcrypt')"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _current()
+        if metrics is not None:
+            attr = f'{kind}_ms'
+            setattr(metrics, attr, getattr(metrics, attr) + (time.perf_counter() - started) * 1000)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_query_start'].pop()
+    metrics = _current()
+    if metrics is not None:
+        metrics.add_query(statement, (time.perf_counter() - started) * 1000)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('metrics_query_start'):
+        connection.info['metrics_query_start'].pop()
+
+
+def _before_render(sender, template, context, **extra):
+    metrics = _current()
+    if metrics is not None:
+        g.setdefault('template_render_start', []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    metrics = _current()
+    starts = g.get('template_render_start')
+    if metrics is not None and starts:
+        metrics.template_ms += (time.perf_counter() - starts.pop()) * 1000
+
+
+def _start_request():
+    g.request_metrics = RequestMetrics(request.endpoint or '<unmatched>')
+
+
+def _finish_request(response):
+    metrics = g.pop('request_metrics', None)
+    if metrics is None:
+        return response
+    duration_ms = (time.perf_counter() - metrics.started) * 1000
+    registry.record(metrics, duration_ms, response.status_code)
+
+    threshold = current_app.config['METRICS_SLOW_REQUEST_MS']
+    if threshold is not None and duration_ms >= threshold:
+        slowest = max(metrics.statements, default=None)
+        logger.warning(
+            'Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, templates %.1f ms, bcrypt %.1f ms%s',
+            request.method, request.path, metrics.endpoint, duration_ms, metrics.queries, metrics.db_ms,
+            metrics.template_ms, metrics.bcrypt_ms,
+            f'; slowest statement {slowest[0]:.1f} ms: {normalize_statement(slowest[1])}' if slowest else ''
+        )
+    return response
+
+
+def _teardown_request(exc):
+    # after_request doesn't run for unhandled exceptions; record those as 500s
+    if g.get('request_metrics') is not None:
+        _finish_request(current_app.response_class(status=500))
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_WINDOW', 1024)
+    app.config.setdefault('METRICS_SLOW_STATEMENTS', 10)
+    app.config.setdefault('METRICS_SLOW_REQUEST_MS', None)
+    if not app.config['METRICS_ENABLED']:
+        return
+    registry.window = app.config['METRICS_WINDOW']
+    registry.max_statements = app.config['METRICS_SLOW_STATEMENTS']
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
@@ -0,0 +1,67 @@
+"""Schema migrations (Alembic, see migrations/).
+
+upgrade_database() brings any database to the latest revision. Databases
+created before migrations existed (by db.create_all()) have no
+alembic_version table; they are stamped with the newest revision whose schema
+they already have and then upgraded from there.
+"""
+import os
+
+from alembic import command
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import inspect
+
+from app import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+# Newest first: (revision, a table or index only present from that revision on)
+_SCHEMA_MARKERS = (
+    ('0005', ('resource', 'uq_resource_name_department_id')),
+    ('0004', ('search_index', None)),
+    ('0003', ('resource', 'ix_resource_department_id_status')),
+    ('0002', ('stat_counter', None)),
+    ('0001', ('user', None)),
+)
+
+
+def alembic_config():
+    config = Config(os.path.join(MIGRATIONS_DIR, 'alembic.ini'))
+    config.set_main_option('script_location', MIGRATIONS_DIR)
+    return config
+
+
+def current_revision():
+    with db.engine.connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision()
+
+
+def _detect_revision():
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    for revision, (table, index) in _SCHEMA_MARKERS:
+        if table not in tables:
+            continue
+        if index is None or index in {ix['name'] for ix in inspector.get_indexes(table)}:
+            return revision
+    return None
+
+
+def upgrade_database(revision='head'):
+    """Apply pending migrations; returns the revision the database ended on"""
+    config = alembic_config()
+    if current_revision() is None:
+        existing = _detect_revision()
+        if existing:
+            command.stamp(config, existing)
+    command.upgrade(config, revision)
+    return current_revision()
+
+
+def recreate_database():
+    """Drop every table and build the schema again from the migrations"""
+    db.drop_all()
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('DROP TABLE IF EXISTS alembic_version')
+    return upgrade_database()
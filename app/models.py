@@ -1,21 +1,25 @@
 from datetime import datetime
-from app import db, login_manager
+from app import db
 from flask_login import UserMixin
-
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.orm import column_property
 
 class User(db.Model, UserMixin):
+    __table_args__ = (
+        # Department-scoped listings filter on department_id and sort by username
+        db.Index('ix_user_department_id_username', 'department_id', 'username'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(60), nullable=False)
+    password_token = db.Column(db.String(64), unique=True, index=True, nullable=True)
+    password_token_expires_at = db.Column(db.DateTime, nullable=True)
     role = db.Column(db.String(20), nullable=False)
     department_id = db.Column(db.Integer, db.ForeignKey('department.id', use_alter=True, name='fk_user_department'), nullable=True)
-    manager_id = db.Column(db.Integer, db.ForeignKey('user.id', use_alter=True, name='fk_user_manager'), nullable=True)
+    manager_id = db.Column(db.Integer, db.ForeignKey('user.id', use_alter=True, name='fk_user_manager'), nullable=True, index=True)
     profile_image = db.Column(db.String(20), nullable=True, default='default.jpg')
-    join_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    join_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     last_login = db.Column(db.DateTime, nullable=True)
     is_active = db.Column(db.Boolean, nullable=False, default=True)
 
@@ -28,44 +32,203 @@ class User(db.Model, UserMixin):
     def __repr__(self):
         return f"User('{self.username}', '{self.email}', '{self.role}')"
 
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'email': self.email,
+            'role': self.role,
+            'department_id': self.department_id,
+            'manager_id': self.manager_id,
+            'profile_image': self.profile_image,
+            'join_date': self.join_date.isoformat() if self.join_date else None,
+            'last_login': self.last_login.isoformat() if self.last_login else None,
+            'is_active': self.is_active
+        }
+
     def set_password(self, password):
         from app import bcrypt
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
+        from app.metrics import timed
+        with timed('bcrypt'):
+            self.password = bcrypt.generate_password_hash(password).decode('utf-8')
 
     def check_password(self, password):
         from app import bcrypt
-        return bcrypt.check_password_hash(self.password, password)
+        from app.passwords import UNUSABLE_PASSWORD
+        from app.metrics import timed
+        if not self.password or self.password == UNUSABLE_PASSWORD:
+            return False
+        with timed('bcrypt'):
+            return bcrypt.check_password_hash(self.password, password)
+
+    @property
+    def must_set_password(self):
+        return self.password_token is not None
 
 class Department(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     description = db.Column(db.String(500))
-    head_id = db.Column(db.Integer, db.ForeignKey('user.id', use_alter=True, name='fk_department_head'), nullable=True)
-    parent_id = db.Column(db.Integer, db.ForeignKey('department.id', use_alter=True, name='fk_department_parent'), nullable=True)
+    head_id = db.Column(db.Integer, db.ForeignKey('user.id', use_alter=True, name='fk_department_head'), nullable=True, index=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey('department.id', use_alter=True, name='fk_department_parent'), nullable=True, index=True)
     
     # Relationships
     users = db.relationship('User', foreign_keys='User.department_id', back_populates='department')
     head = db.relationship('User', foreign_keys=[head_id], back_populates='managed_departments')
     parent = db.relationship('Department', remote_side=[id], backref=db.backref('sub_departments', lazy='dynamic'))
 
+    # Headcount as a correlated subquery; deferred, so listings opt in with undefer()
+    member_count = column_property(
+        select(func.count(User.id)).where(User.department_id == id).correlate_except(User).scalar_subquery(),
+        deferred=True
+    )
+
     def __repr__(self):
         return f"Department('{self.name}')"
 
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'head_id': self.head_id,
+            'parent_id': self.parent_id
+        }
+
+# Natural key for upsert imports (see app.upsert); top-level names collide too
+db.Index('uq_department_name_parent_id', Department.name,
+         func.coalesce(Department.parent_id, literal_column('0')), unique=True)
+
+class DepartmentClosure(db.Model):
+    """Ancestor/descendant pairs for the department tree, kept in sync by app.hierarchy"""
+    __tablename__ = 'department_closure'
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('department.id', ondelete='CASCADE'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('department.id', ondelete='CASCADE'), primary_key=True, index=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"DepartmentClosure({self.ancestor_id} -> {self.descendant_id}, depth={self.depth})"
+
 class Resource(db.Model):
+    __table_args__ = (
+        db.Index('ix_resource_department_id_status', 'department_id', 'status'),
+        # Available-resource lists ordered by name
+        db.Index('ix_resource_status_name', 'status', 'name'),
+        db.Index('uq_resource_name_department_id', 'name', 'department_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     type = db.Column(db.String(50), nullable=False)
     status = db.Column(db.String(20), nullable=False, default='available')
     department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=True)
-    assigned_to_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    assigned_to_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    department = db.relationship('Department', backref=db.backref('resources', lazy='dynamic'))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'type': self.type,
+            'status': self.status,
+            'department_id': self.department_id,
+            'assigned_to_id': self.assigned_to_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
 
 class Facility(db.Model):
+    __table_args__ = (
+        db.Index('ix_facility_department_id_status', 'department_id', 'status'),
+        db.Index('uq_facility_name_department_id', 'name', 'department_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     type = db.Column(db.String(50), nullable=False)
     capacity = db.Column(db.Integer)
     location = db.Column(db.String(200))
     status = db.Column(db.String(20), nullable=False, default='available')
     department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    department = db.relationship('Department', backref=db.backref('facilities', lazy='dynamic'))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'type': self.type,
+            'capacity': self.capacity,
+            'location': self.location,
+            'status': self.status,
+            'department_id': self.department_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class ImportJob(db.Model):
+    id = db.Column(db.String(36), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    mode = db.Column(db.String(10), nullable=False, default='insert')
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    filename = db.Column(db.String(255))
+    created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    rows_total = db.Column(db.Integer)
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    rows_inserted = db.Column(db.Integer, nullable=False, default=0)
+    rows_duplicate = db.Column(db.Integer, nullable=False, default=0)
+    rows_updated = db.Column(db.Integer, nullable=False, default=0)
+    rows_unchanged = db.Column(db.Integer, nullable=False, default=0)
+    rows_failed = db.Column(db.Integer, nullable=False, default=0)
+    throughput = db.Column(db.Float, nullable=False, default=0.0)
+    eta_seconds = db.Column(db.Float)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    error = db.Column(db.Text)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"ImportJob('{self.id}', '{self.kind}', '{self.status}')"
+
+    @property
+    def progress(self):
+        if self.status == 'completed':
+            return 100
+        if not self.rows_total:
+            return 0
+        return min(99, int(self.rows_processed * 100 / self.rows_total))
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'mode': self.mode,
+            'status': self.status,
+            'filename': self.filename,
+            'progress': self.progress,
+            'rows_total': self.rows_total,
+            'rows_processed': self.rows_processed,
+            'rows_inserted': self.rows_inserted,
+            'rows_duplicate': self.rows_duplicate,
+            'rows_updated': self.rows_updated,
+            'rows_unchanged': self.rows_unchanged,
+            'rows_failed': self.rows_failed,
+            'throughput': round(self.throughput or 0.0, 1),
+            'eta_seconds': round(self.eta_seconds, 1) if self.eta_seconds is not None else None,
+            'cancel_requested': self.cancel_requested,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class StatCounter(db.Model):
+    """Maintained row counts per dimension (e.g. name='resources.status', key='available'), see app.stats"""
+    __tablename__ = 'stat_counter'
+    name = db.Column(db.String(50), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True, default='')
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"StatCounter('{self.name}', '{self.key}', {self.value})"
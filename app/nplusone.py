@@ -0,0 +1,51 @@
+"""Development check for N+1 query patterns.
+
+With NPLUSONE_MODE set to 'log' or 'raise', every lazy relationship load that
+reaches the database is counted per request by relationship (e.g.
+Department.head). Loading the same relationship NPLUSONE_THRESHOLD times in
+one request is the signature of a loop over rows, typically a listing
+template, and is logged or raised as NPlusOneError. Fix it by adding the
+relationship to the view's option set in app.loaders. Keep it 'off' in
+production.
+"""
+import logging
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+NPLUSONE_MODES = ('off', 'log', 'raise')
+
+
+class NPlusOneError(RuntimeError):
+    pass
+
+
+def _lazy_load(orm_execute_state):
+    if not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None or not has_request_context():
+        return
+    mode = current_app.config['NPLUSONE_MODE']
+    if mode == 'off':
+        return
+
+    relationship = str(orm_execute_state.loader_strategy_path[-1])
+    counts = g.setdefault('nplusone_counts', {})
+    counts[relationship] = count = counts.get(relationship, 0) + 1
+    if count != current_app.config['NPLUSONE_THRESHOLD']:
+        return
+
+    message = f'Repeated lazy load of {relationship} in {request.endpoint} ({count} queries so far)'
+    if mode == 'raise':
+        raise NPlusOneError(message)
+    logger.warning(message)
+
+
+def init_app(app):
+    app.config.setdefault('NPLUSONE_MODE', 'off')
+    app.config.setdefault('NPLUSONE_THRESHOLD', 2)
+    if app.config['NPLUSONE_MODE'] not in NPLUSONE_MODES:
+        raise ValueError(f"NPLUSONE_MODE must be one of {', '.join(NPLUSONE_MODES)}")
+    if app.config['NPLUSONE_MODE'] != 'off' and not event.contains(Session, 'do_orm_execute', _lazy_load):
+        event.listen(Session, 'do_orm_execute', _lazy_load)
@@ -0,0 +1,184 @@
+"""Keyset (cursor) pagination for list views and list endpoints.
+
+Pages are fetched with WHERE (sort_key, id) > (:last_sort_key, :last_id)
+ORDER BY sort_key, id LIMIT n, so page 1000 costs the same as page 1 as long
+as the sort column is indexed. Cursors are opaque url-safe tokens that encode
+the boundary row's sort key and id.
+"""
+import base64
+import json
+from datetime import datetime
+
+from flask import request, url_for
+from sqlalchemy import tuple_
+
+from app.models import User, Department, Resource, Facility
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(sort_value, id_):
+    if isinstance(sort_value, datetime):
+        sort_value = {'dt': sort_value.isoformat()}
+    raw = json.dumps([sort_value, id_], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, id_ = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor('Invalid page cursor') from e
+    if isinstance(sort_value, dict) and 'dt' in sort_value:
+        sort_value = datetime.fromisoformat(sort_value['dt'])
+    return sort_value, id_
+
+
+class Page:
+    def __init__(self, items, sort, limit, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.sort = sort
+        self.limit = limit
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def meta(self):
+        return {
+            'sort': self.sort,
+            'limit': self.limit,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor
+        }
+
+
+class PageRequest:
+    """Sort, page size and cursor parsed from the query string"""
+
+    def __init__(self, sort, descending, limit, after=None, before=None):
+        self.sort = sort
+        self.descending = descending
+        self.limit = limit
+        self.after = after
+        self.before = before
+
+    @classmethod
+    def from_args(cls, args, sortable, default_sort='id'):
+        """sortable lists the column names a listing allows; prefix '-' to sort descending"""
+        sort = args.get('sort', default_sort)
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        if sort not in sortable:
+            sort, descending = default_sort.lstrip('-'), default_sort.startswith('-')
+        limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        return cls(sort, descending, limit, after=args.get('after'), before=args.get('before'))
+
+    @property
+    def sort_param(self):
+        return f"-{self.sort}" if self.descending else self.sort
+
+
+def paginate(query, model, page_request):
+    """Apply keyset pagination to an ORM query and return a Page
+
+    The query is ordered by (sort column, id); `after` walks forward from a
+    cursor and `before` walks backward, in both cases with an index range scan.
+    """
+    sort_col = getattr(model, page_request.sort)
+    id_col = model.id
+    key = tuple_(sort_col, id_col)
+    limit = page_request.limit
+
+    backwards = page_request.before is not None
+    cursor = page_request.before if backwards else page_request.after
+    # Walking backwards over an ascending listing is a forward walk over the descending one
+    descending = page_request.descending != backwards
+
+    if cursor:
+        boundary = decode_cursor(cursor)
+        query = query.filter(key < boundary if descending else key > boundary)
+
+    if descending:
+        query = query.order_by(sort_col.desc(), id_col.desc())
+    else:
+        query = query.order_by(sort_col.asc(), id_col.asc())
+
+    items = query.limit(limit + 1).all()
+    more = len(items) > limit
+    items = items[:limit]
+    if backwards:
+        items.reverse()
+
+    def cursor_for(item):
+        return encode_cursor(getattr(item, page_request.sort), item.id)
+
+    next_cursor = prev_cursor = None
+    if items:
+        if more or backwards:
+            next_cursor = cursor_for(items[-1])
+        if (more and backwards) or (cursor and not backwards):
+            prev_cursor = cursor_for(items[0])
+    return Page(items, page_request.sort_param, limit, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def apply_filters(query, args, filters):
+    """Filter a query from the query string; filters maps arg name -> (type, criterion builder)"""
+    for name, (type_, build) in filters.items():
+        value = args.get(name, type=type_)
+        if value is not None and value != '':
+            query = query.filter(build(value))
+    return query
+
+
+def page_url(**changes):
+    """URL of the current listing with the given query args replaced (None removes one)"""
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('before', None)
+    args.update(changes)
+    args = {k: v for k, v in args.items() if v is not None}
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+# Sortable columns are limited to indexed, non-null columns so every page is a range scan
+USER_SORTS = ('id', 'username', 'email', 'join_date')
+USER_FILTERS = {
+    'role': (str, lambda v: User.role == v),
+    'status': (str, lambda v: User.is_active == (v == 'active')),
+    'department_id': (int, lambda v: User.department_id == v)
+}
+
+DEPARTMENT_SORTS = ('id', 'name')
+DEPARTMENT_FILTERS = {
+    'parent_id': (int, lambda v: Department.parent_id == v),
+    'head_id': (int, lambda v: Department.head_id == v)
+}
+
+RESOURCE_SORTS = ('id', 'name', 'created_at')
+RESOURCE_FILTERS = {
+    'status': (str, lambda v: Resource.status == v),
+    'type': (str, lambda v: Resource.type == v),
+    'department_id': (int, lambda v: Resource.department_id == v),
+    'assigned_to_id': (int, lambda v: Resource.assigned_to_id == v)
+}
+
+FACILITY_SORTS = ('id', 'name', 'created_at')
+FACILITY_FILTERS = {
+    'status': (str, lambda v: Facility.status == v),
+    'type': (str, lambda v: Facility.type == v),
+    'department_id': (int, lambda v: Facility.department_id == v)
+}
@@ -0,0 +1,97 @@
+"""Password hashing for bulk user creation.
+
+bcrypt is deliberately slow and runs on one core per call, so creating many
+accounts at once fans the work out over a process pool. Imports can also skip
+hashing entirely and hand out one-time "set your password" tokens instead,
+valid for PASSWORD_TOKEN_TTL seconds. Sharing one hash across a batch is only
+allowed under TESTING.
+"""
+import multiprocessing
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import bcrypt as _bcrypt
+
+# Stored in place of a hash for accounts that must set a password first;
+# never a valid bcrypt hash, so it can't match any password.
+UNUSABLE_PASSWORD = '!'
+
+PASSWORD_MODES = ('hash', 'shared', 'token')
+DEFAULT_TOKEN_TTL = 7 * 24 * 60 * 60
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def _hash_one(args):
+    password, rounds = args
+    return _bcrypt.hashpw(password.encode('utf-8'), _bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _get_pool(workers):
+    """Return a long-lived process pool so worker start-up is paid once"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn keeps the children clear of the web process' threads and sockets
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+        return _pool
+
+
+def hash_passwords(passwords, rounds=12, workers=None, dedupe=False):
+    """Return one bcrypt hash per password, in order
+
+    With dedupe, each distinct plaintext is hashed once and the hash is shared
+    by every account using it. Otherwise every account gets its own salt and
+    the hashing is spread across `workers` processes (default: all cores).
+    """
+    passwords = list(passwords)
+    todo = list(dict.fromkeys(passwords)) if dedupe else passwords
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(todo) < 2:
+        hashes = [_hash_one((p, rounds)) for p in todo]
+    else:
+        chunksize = max(1, len(todo) // (workers * 4))
+        hashes = list(_get_pool(workers).map(_hash_one, [(p, rounds) for p in todo], chunksize=chunksize))
+
+    if dedupe:
+        by_password = dict(zip(todo, hashes))
+        return [by_password[p] for p in passwords]
+    return hashes
+
+
+def new_password_token():
+    """Return a URL-safe one-time token for the set-password link"""
+    return secrets.token_urlsafe(32)
+
+
+def assign_passwords(rows, password, mode='hash', rounds=12, workers=None, token_ttl=DEFAULT_TOKEN_TTL):
+    """Fill the password columns of bulk-insert user rows according to mode
+
+    hash   - a separately salted hash per account, computed on the process pool
+    shared - the default password is hashed once and shared by the batch (tests only)
+    token  - no hash; each account gets a set-password token valid for token_ttl seconds
+    """
+    if mode not in PASSWORD_MODES:
+        raise ValueError(f'Unknown password mode: {mode}')
+
+    if mode == 'token':
+        expires_at = datetime.utcnow() + timedelta(seconds=token_ttl)
+        for row in rows:
+            row['password'] = UNUSABLE_PASSWORD
+            row['password_token'] = new_password_token()
+            row['password_token_expires_at'] = expires_at
+        return rows
+
+    hashes = hash_passwords([password] * len(rows), rounds=rounds, workers=workers, dedupe=(mode == 'shared'))
+    for row, hashed in zip(rows, hashes):
+        row['password'] = hashed
+    return rows
@@ -0,0 +1,71 @@
+"""Query-plan check for the hot, scoped queries.
+
+Each entry pairs a query the routes run on every page load with the index it
+is meant to use. check_query_plans() asks the database for each plan (EXPLAIN
+QUERY PLAN on SQLite, EXPLAIN elsewhere) and reports the queries whose plan
+does not mention their index or scans a whole table or index, so a dropped
+index or a rewritten filter that falls back to a table scan is caught before
+it ships. tests/test_queryplan.py runs it on the migrated schema.
+"""
+import re
+
+from sqlalchemy import func, select
+
+from app import db
+from app.models import User, Department, Resource, Facility
+from app.scope import Scope, SUBTREE
+
+# (description, query, index the plan must use)
+HOT_QUERIES = (
+    ('department-scoped resources by status',
+     select(Resource.id).where(Resource.department_id == 1, Resource.status == 'available'),
+     'ix_resource_department_id_status'),
+    ('organization-scoped resources',
+     select(Resource.id).where(Scope(SUBTREE, 1).where(Resource)),
+     'ix_resource_department_id_status'),
+    ('available resources by name',
+     select(Resource.id, Resource.name).where(Resource.status == 'available').order_by(Resource.name).limit(100),
+     'ix_resource_status_name'),
+    ('resources assigned to a user',
+     select(Resource.id).where(Resource.assigned_to_id == 1),
+     'ix_resource_assigned_to_id'),
+    ('department user listing',
+     select(User.id).where(User.department_id == 1).order_by(User.username).limit(50),
+     'ix_user_department_id_username'),
+    ('department headcount',
+     select(func.count(User.id)).where(User.department_id == 1),
+     'ix_user_department_id_username'),
+    ('direct reports',
+     select(User.id).where(User.manager_id == 1),
+     'ix_user_manager_id'),
+    ('sub-departments',
+     select(Department.id).where(Department.parent_id == 1),
+     'ix_department_parent_id'),
+    ('departments headed by a user',
+     select(Department.id).where(Department.head_id == 1),
+     'ix_department_head_id'),
+    ('department facilities',
+     select(Facility.id).where(Facility.department_id == 1),
+     'ix_facility_department_id_status'),
+)
+
+
+# SQLite reports full scans as "SCAN <table>" (with or without an index), PostgreSQL as "Seq Scan"
+_FULL_SCAN = re.compile(r'\bSCAN \w+|\bSeq Scan\b')
+
+
+def explain(query):
+    connection = db.session.connection()
+    compiled = query.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+    prefix = 'EXPLAIN QUERY PLAN' if connection.dialect.name == 'sqlite' else 'EXPLAIN'
+    rows = connection.exec_driver_sql(f'{prefix} {compiled}').all()
+    return '\n'.join(' '.join(str(col) for col in row) for row in rows)
+
+
+def check_query_plans():
+    """Return [(description, index, plan, ok)] for every hot query"""
+    results = []
+    for description, query, index in HOT_QUERIES:
+        plan = explain(query)
+        results.append((description, index, plan, index in plan and not _FULL_SCAN.search(plan)))
+    return results
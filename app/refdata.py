@@ -0,0 +1,61 @@
+"""Cached reference data for forms, validators and templates.
+
+Dropdown choices and lookups are read with narrow column queries and kept in
+app.cache.reference_cache, so building a form no longer loads whole tables.
+Entries are invalidated whenever a User or Department change commits.
+"""
+from functools import wraps
+
+from sqlalchemy import select
+
+from app import db
+from app.cache import reference_cache
+from app.models import User, Department
+
+ROLES = ('MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN', 'REGULAR_USER')
+ADMIN_ROLES = ('DEPT_ADMIN', 'ORG_ADMIN')
+
+
+def _cached(key, tags):
+    def decorator(f):
+        @wraps(f)
+        def wrapper():
+            return reference_cache.get_or_set(key, f, tags=tags)
+        return wrapper
+    return decorator
+
+
+@_cached('departments', tags=('department',))
+def department_choices():
+    """(id, name) for every department"""
+    return tuple(db.session.execute(select(Department.id, Department.name).order_by(Department.id)).tuples())
+
+
+@_cached('top_level_departments', tags=('department',))
+def top_level_department_choices():
+    """(id, name) for departments without a parent"""
+    return tuple(db.session.execute(
+        select(Department.id, Department.name).where(Department.parent_id.is_(None)).order_by(Department.id)
+    ).tuples())
+
+
+@_cached('department_names', tags=('department',))
+def department_names():
+    """{id: name} for every department"""
+    return dict(department_choices())
+
+
+@_cached('admins', tags=('user',))
+def admin_choices():
+    """(id, "username (role)") for department and organization admins"""
+    rows = db.session.execute(
+        select(User.id, User.username, User.role).where(User.role.in_(ADMIN_ROLES)).order_by(User.id)
+    )
+    return tuple((id_, f'{username} ({role})') for id_, username, role in rows)
+
+
+def department_name(dept_id, default='No Department'):
+    """Template helper: a department's name from the cached lookup"""
+    if dept_id is None:
+        return default
+    return department_names().get(dept_id, default)
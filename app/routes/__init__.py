@@ -1,17 +1,31 @@
-from flask import render_template, url_for, flash, redirect, request
+from flask import render_template, url_for, flash, redirect, request, current_app, jsonify, abort
 from flask_login import login_user, current_user, logout_user, login_required
 from app import db, bcrypt
-from app.models import User, Department, Resource
-from app.forms import RegistrationForm, LoginForm
+from app.models import User, Department, Resource, ImportJob
+from app.hierarchy import DepartmentCycleError
+from app.scope import resolve_scope
+from app.loaders import DEPARTMENT_LISTING, RESOURCE_LISTING
+from app.dashboard import dashboard_data
+from app.metrics import timed
+from app.pagination import PageRequest, InvalidCursor, paginate, apply_filters
+from app.pagination import USER_SORTS, USER_FILTERS, DEPARTMENT_SORTS, DEPARTMENT_FILTERS, RESOURCE_SORTS, RESOURCE_FILTERS
+from app.forms import RegistrationForm, LoginForm, SetPasswordForm
 from app.forms import UpdateUserForm, DepartmentForm, ResourceForm, CSVUploadForm
+from app.importer import DEFAULT_CHUNK_SIZE
+from app.export import EXPORTS, export_response
+from app.jobs import submit_import, submit_bundle, error_report_path, TooManyJobs
+from app.validation import read_validated_csv
+from app.logins import LoginBusy, record_login, verify_password
+from app import typeahead as typeahead_index
 from flask import Blueprint
 from datetime import datetime
-import csv
-import io
-from werkzeug.utils import secure_filename
+from functools import partial
+import os
 
 bp = Blueprint('main', __name__)
 
+RECENT_IMPORTS = 10
+
 @bp.context_processor
 def inject_now():
     return {'now': datetime.utcnow()}
@@ -30,7 +44,7 @@ def register():
         user = User(
             username=form.username.data,
             email=form.email.data,
-            role='USER',  # Only regular users can register
+            role='REGULAR_USER',  # Only regular users can register
             department_id=form.department.data,
             manager_id=form.manager.data,
             join_date=datetime.utcnow()
@@ -58,10 +72,15 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        try:
+            valid = user is not None and verify_password(user, form.password.data)
+        except LoginBusy as e:
+            flash(str(e), 'warning')
+            return render_template('login.html', title='Login', form=form), 503
+        
+        if valid:
             login_user(user, remember=form.remember.data)
-            user.last_login = datetime.utcnow()
-            db.session.commit()
+            record_login(user)
             
             next_page = request.args.get('next')
             if next_page:
@@ -72,49 +91,34 @@ def login():
     
     return render_template('login.html', title='Login', form=form)
 
+@bp.route("/set-password/<token>", methods=['GET', 'POST'])
+def set_password(token):
+    if current_user.is_authenticated:
+        return redirect(url_for('main.dashboard'))
+    
+    user = User.query.filter_by(password_token=token).first()
+    if not user:
+        flash('That password link is invalid or has already been used.', 'danger')
+        return redirect(url_for('main.login'))
+    if user.password_token_expires_at is None or user.password_token_expires_at < datetime.utcnow():
+        flash('That password link has expired. Ask an administrator for a new one.', 'danger')
+        return redirect(url_for('main.login'))
+    
+    form = SetPasswordForm()
+    if form.validate_on_submit():
+        user.set_password(form.password.data)
+        user.password_token = user.password_token_expires_at = None
+        db.session.commit()
+        flash('Your password has been set! You can now log in.', 'success')
+        return redirect(url_for('main.login'))
+    
+    return render_template('set_password.html', title='Set Password', form=form, user=user)
+
 @bp.route("/dashboard")
 @login_required
 def dashboard():
-    user_data = {
-        'username': current_user.username,
-        'email': current_user.email,
-        'role': current_user.role,
-        'department': current_user.department.name if current_user.department else 'No Department',
-        'manager': current_user.manager.username if current_user.manager else 'No Manager',
-        'is_manager': bool(User.query.filter_by(manager_id=current_user.id).first())
-    }
-
-    # Get department details
-    if current_user.department:
-        dept = current_user.department
-        user_data['department_head'] = dept.head.username if dept.head else 'No Head'
-        user_data['department_description'] = dept.description
-        user_data['department_members'] = len(dept.users)
-
-    # Get available resources
-    resources_query = Resource.query
-    if current_user.role == 'MASTER_ADMIN':
-        resources = resources_query.all()
-    elif current_user.role == 'ORG_ADMIN':
-        dept_ids = [d.id for d in Department.query.filter_by(parent_id=current_user.department_id).all()]
-        resources = resources_query.filter(Resource.department_id.in_([current_user.department_id] + dept_ids)).all()
-    else:
-        resources = resources_query.filter_by(department_id=current_user.department_id).all()
-
-    # Get team members if user is a manager
-    team_members = []
-    if user_data['is_manager']:
-        team_members = User.query.filter_by(manager_id=current_user.id).all()
-
-    # Get assigned resources
-    assigned_resources = Resource.query.filter_by(assigned_to_id=current_user.id).all()
-
-    return render_template('dashboard.html', 
-                         title='Dashboard',
-                         user_data=user_data,
-                         resources=resources,
-                         team_members=team_members,
-                         assigned_resources=assigned_resources)
+    data = dashboard_data(current_user, current_app.config['DASHBOARD_RESOURCE_LIMIT'])
+    return render_template('dashboard.html', title='Dashboard', **data)
 
 @bp.route("/manage/users")
 @login_required
@@ -123,18 +127,18 @@ def manage_users():
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('main.dashboard'))
     
-    users = []
-    if current_user.role == 'MASTER_ADMIN':
-        users = User.query.all()
-    elif current_user.role == 'ORG_ADMIN':
-        dept_ids = [d.id for d in Department.query.filter_by(parent_id=current_user.department_id).all()]
-        users = User.query.filter(User.department_id.in_([current_user.department_id] + dept_ids)).all()
-    else:  # DEPT_ADMIN
-        users = User.query.filter_by(department_id=current_user.department_id).all()
+    query = resolve_scope().apply(User.query, User)
+    query = apply_filters(query, request.args, USER_FILTERS)
+    try:
+        page = paginate(query, User, PageRequest.from_args(request.args, USER_SORTS, 'username'))
+    except InvalidCursor:
+        flash('That page link has expired. Showing the first page.', 'info')
+        return redirect(url_for('main.manage_users'))
     
     return render_template('admin/manage_users.html', 
                          title='Manage Users',
-                         users=users)
+                         users=page.items,
+                         page=page)
 
 @bp.route("/manage/departments")
 @login_required
@@ -143,19 +147,19 @@ def manage_departments():
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('main.dashboard'))
     
-    departments = []
-    if current_user.role == 'MASTER_ADMIN':
-        departments = Department.query.all()
-    else:  # ORG_ADMIN
-        departments = Department.query.filter(
-            (Department.id == current_user.department_id) |
-            (Department.parent_id == current_user.department_id)
-        ).all()
+    query = resolve_scope().apply(Department.query.options(*DEPARTMENT_LISTING), Department)
+    query = apply_filters(query, request.args, DEPARTMENT_FILTERS)
+    try:
+        page = paginate(query, Department, PageRequest.from_args(request.args, DEPARTMENT_SORTS, 'name'))
+    except InvalidCursor:
+        flash('That page link has expired. Showing the first page.', 'info')
+        return redirect(url_for('main.manage_departments'))
     
     form = DepartmentForm()
     return render_template('admin/manage_departments.html', 
                          title='Manage Departments',
-                         departments=departments,
+                         departments=page.items,
+                         page=page,
                          form=form)
 
 @bp.route("/manage/resources")
@@ -165,21 +169,33 @@ def manage_resources():
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('main.dashboard'))
     
-    resources = []
-    if current_user.role == 'MASTER_ADMIN':
-        resources = Resource.query.all()
-    elif current_user.role == 'ORG_ADMIN':
-        dept_ids = [d.id for d in Department.query.filter_by(parent_id=current_user.department_id).all()]
-        resources = Resource.query.filter(Resource.department_id.in_([current_user.department_id] + dept_ids)).all()
-    else:  # DEPT_ADMIN
-        resources = Resource.query.filter_by(department_id=current_user.department_id).all()
+    query = resolve_scope().apply(Resource.query.options(*RESOURCE_LISTING), Resource)
+    query = apply_filters(query, request.args, RESOURCE_FILTERS)
+    try:
+        page = paginate(query, Resource, PageRequest.from_args(request.args, RESOURCE_SORTS, 'name'))
+    except InvalidCursor:
+        flash('That page link has expired. Showing the first page.', 'info')
+        return redirect(url_for('main.manage_resources'))
     
     form = ResourceForm()
     return render_template('admin/manage_resources.html', 
                          title='Manage Resources',
-                         resources=resources,
+                         resources=page.items,
+                         page=page,
                          form=form)
 
+@bp.route("/manage/<kind>/export")
+@login_required
+def export_records(kind):
+    if current_user.role not in ['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN']:
+        flash('You do not have permission to access this page.', 'danger')
+        return redirect(url_for('main.dashboard'))
+    if kind not in EXPORTS:
+        abort(404)
+    
+    # Same scope and filters as the listing, streamed as CSV however many rows match
+    return export_response(kind, resolve_scope(), request.args)
+
 @bp.route("/user/<int:user_id>/edit", methods=['GET', 'POST'])
 @login_required
 def edit_user(user_id):
@@ -187,7 +203,7 @@ def edit_user(user_id):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('main.dashboard'))
     
-    user = User.query.get_or_404(user_id)
+    user = resolve_scope().get_or_404(User, user_id)
     form = UpdateUserForm(original_username=user.username, original_email=user.email)
     
     if form.validate_on_submit():
@@ -219,8 +235,8 @@ def edit_department(dept_id):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('main.dashboard'))
     
-    department = Department.query.get_or_404(dept_id)
-    form = DepartmentForm()
+    department = resolve_scope().get_or_404(Department, dept_id)
+    form = DepartmentForm(original=department, keep_parent=current_user.role != 'MASTER_ADMIN')
     
     if form.validate_on_submit():
         department.name = form.name.data
@@ -228,7 +244,12 @@ def edit_department(dept_id):
         department.head_id = form.head.data
         if current_user.role == 'MASTER_ADMIN':
             department.parent_id = form.parent.data
-        db.session.commit()
+        try:
+            db.session.commit()
+        except DepartmentCycleError:
+            db.session.rollback()
+            flash('A department cannot be moved under one of its own sub-departments.', 'danger')
+            return redirect(url_for('main.edit_department', dept_id=dept_id))
         flash('Department has been updated!', 'success')
         return redirect(url_for('main.manage_departments'))
     
@@ -251,8 +272,8 @@ def edit_resource(resource_id):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('main.dashboard'))
     
-    resource = Resource.query.get_or_404(resource_id)
-    form = ResourceForm()
+    resource = resolve_scope().get_or_404(Resource, resource_id)
+    form = ResourceForm(department_id=resource.department_id, original_id=resource.id)
     
     if form.validate_on_submit():
         resource.name = form.name.data
@@ -281,14 +302,14 @@ def add_resource():
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('main.dashboard'))
     
-    form = ResourceForm()
+    form = ResourceForm(department_id=current_user.department_id)
     
     if form.validate_on_submit():
         resource = Resource(
             name=form.name.data,
             type=form.type.data,
             status=form.status.data,
-            assigned_to_id=form.assigned_to.data if form.assigned_to.data != 0 else None,
+            assigned_to_id=form.assigned_to.data,
             department_id=current_user.department_id
         )
         db.session.add(resource)
@@ -314,8 +335,8 @@ def add_department():
         department = Department(
             name=form.name.data,
             description=form.description.data,
-            head_id=form.head.data if form.head.data != 0 else None,
-            parent_id=form.parent.data if form.parent.data != 0 else None
+            head_id=form.head.data,
+            parent_id=form.parent.data
         )
         db.session.add(department)
         db.session.commit()
@@ -337,13 +358,14 @@ def add_user():
     form = UpdateUserForm()
     
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash('defaultpassword').decode('utf-8')
+        with timed('bcrypt'):
+            hashed_password = bcrypt.generate_password_hash('defaultpassword').decode('utf-8')
         user = User(
             username=form.username.data,
             email=form.email.data,
             password=hashed_password,
             role=form.role.data if current_user.role == 'MASTER_ADMIN' else 'REGULAR_USER',
-            department_id=form.department.data if form.department.data != 0 else None
+            department_id=form.department.data
         )
         db.session.add(user)
         db.session.commit()
@@ -355,6 +377,17 @@ def add_user():
                          form=form,
                          user=None)
 
+@bp.route("/typeahead/<kind>")
+@login_required
+def typeahead(kind):
+    if current_user.role not in ['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN']:
+        abort(403)
+    if kind not in typeahead_index.KINDS:
+        abort(404)
+    matches = typeahead_index.match(kind, request.args.get('q', ''), request.args.get('limit', 10, type=int),
+                                    scope=resolve_scope())
+    return jsonify({'results': [{'id': id_, 'label': label} for id_, label in matches]})
+
 @bp.route("/logout")
 @login_required
 def logout():
@@ -365,7 +398,8 @@ def logout():
 @bp.route("/upload/csv", methods=['GET', 'POST'])
 @login_required
 def upload_csv():
-    if current_user.role not in ['MASTER_ADMIN', 'ORG_ADMIN']:
+    # Imported rows aren't checked against a scope; see app.routes.upload
+    if current_user.role != 'MASTER_ADMIN':
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('main.dashboard'))
     
@@ -373,56 +407,33 @@ def upload_csv():
     if form.validate_on_submit():
         if form.file.data:
             try:
-                # Read CSV file
-                stream = io.StringIO(form.file.data.stream.read().decode("UTF8"), newline=None)
-                csv_data = csv.DictReader(stream)
-                
-                if form.upload_type.data == 'users':
-                    for row in csv_data:
-                        # Check if user already exists
-                        if not User.query.filter_by(email=row['email']).first():
-                            hashed_password = bcrypt.generate_password_hash('defaultpassword').decode('utf-8')
-                            user = User(
-                                username=row['username'],
-                                email=row['email'],
-                                password=hashed_password,
-                                role=row.get('role', 'REGULAR_USER'),
-                                department_id=int(row['department_id']) if row.get('department_id') else None
-                            )
-                            db.session.add(user)
-                
-                elif form.upload_type.data == 'departments':
-                    for row in csv_data:
-                        if not Department.query.filter_by(name=row['name']).first():
-                            department = Department(
-                                name=row['name'],
-                                description=row.get('description', ''),
-                                head_id=int(row['head_id']) if row.get('head_id') else None,
-                                parent_id=int(row['parent_id']) if row.get('parent_id') else None
-                            )
-                            db.session.add(department)
-                
-                elif form.upload_type.data == 'resources':
-                    for row in csv_data:
-                        if not Resource.query.filter_by(name=row['name'], department_id=int(row['department_id'])).first():
-                            resource = Resource(
-                                name=row['name'],
-                                type=row['type'],
-                                status=row.get('status', 'available'),
-                                department_id=int(row['department_id']),
-                                assigned_to_id=int(row['assigned_to_id']) if row.get('assigned_to_id') else None
-                            )
-                            db.session.add(resource)
-                
-                db.session.commit()
-                flash(f'Successfully uploaded {form.upload_type.data} data!', 'success')
-                return redirect(url_for('main.dashboard'))
+                chunk_size = current_app.config.get('IMPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+                if form.upload_type.data == 'bundle':
+                    job = submit_bundle(current_app._get_current_object(), form.file.data,
+                                        created_by_id=current_user.id)
+                else:
+                    job = submit_import(current_app._get_current_object(), form.upload_type.data, form.file.data,
+                                        partial(read_validated_csv, kind=form.upload_type.data,
+                                                chunk_size=chunk_size, mode=form.mode.data),
+                                        created_by_id=current_user.id, mode=form.mode.data)
+                flash(f'Your {form.upload_type.data} upload has been queued (job {job.id}). '
+                      f'Rows are imported in the background; follow it under Recent Imports.', 'success')
+                return redirect(url_for('main.upload_csv'))
             
+            except TooManyJobs as e:
+                flash(str(e), 'warning')
+                return redirect(url_for('main.upload_csv'))
             except Exception as e:
                 db.session.rollback()
                 flash(f'Error processing CSV file: {str(e)}', 'danger')
                 return redirect(url_for('main.upload_csv'))
     
+    # The uploader's latest jobs, each linking its error report once validation has written one
+    jobs = ImportJob.query.filter_by(created_by_id=current_user.id) \
+        .order_by(ImportJob.created_at.desc()).limit(RECENT_IMPORTS).all()
+    error_reports = {job.id for job in jobs if os.path.exists(error_report_path(job.id))}
     return render_template('admin/upload_csv.html', 
                          title='Upload CSV',
-                         form=form)
+                         form=form,
+                         jobs=jobs,
+                         error_reports=error_reports)
@@ -1,10 +1,20 @@
 from flask import Blueprint, request, jsonify
 from flask_login import login_required, current_user
 from functools import wraps
-from app.models import User, Department, Resource, Facility, db
+from app.models import User, Department, db
+from app.hierarchy import DepartmentCycleError
+from app.scope import resolve_scope
+from app.upsert import key_in_use
+from app.refdata import ROLES
+from app.stats import counters
+from app.metrics import registry as metrics_registry
+from app.pagination import PageRequest, InvalidCursor, paginate, apply_filters
+from app.pagination import USER_SORTS, USER_FILTERS, DEPARTMENT_SORTS, DEPARTMENT_FILTERS
 
 bp = Blueprint('admin', __name__)
 
+DEPARTMENT_COUNTERS = ('users.department', 'resources.department', 'facilities.department')
+
 def admin_required(role):
     def decorator(f):
         @wraps(f)
@@ -19,33 +29,78 @@ def admin_required(role):
 @login_required
 @admin_required(['MASTER_ADMIN', 'ORG_ADMIN'])
 def get_dashboard():
-    total_users = User.query.count()
-    total_departments = Department.query.count()
-    total_resources = Resource.query.count()
-    total_facilities = Facility.query.count()
+    # Served from maintained counters; see app.stats
+    scope = resolve_scope()
+    if scope.unrestricted:
+        stats = counters('users', 'departments', 'resources', 'facilities',
+                         'users.role', 'resources.status', 'facilities.status', *DEPARTMENT_COUNTERS)
+        return jsonify({
+            'statistics': {
+                'total_users': stats['users'].get('', 0),
+                'total_departments': stats['departments'].get('', 0),
+                'total_resources': stats['resources'].get('', 0),
+                'total_facilities': stats['facilities'].get('', 0)
+            },
+            'breakdowns': {
+                'users_by_role': stats['users.role'],
+                'users_by_department': stats['users.department'],
+                'resources_by_status': stats['resources.status'],
+                'resources_by_department': stats['resources.department'],
+                'facilities_by_status': stats['facilities.status'],
+                'facilities_by_department': stats['facilities.department']
+            }
+        }), 200
     
+    # Only the department breakdowns narrow to a scope, so other callers get those and totals summed from them
+    department_ids = scope.department_ids()
+    stats = counters(*DEPARTMENT_COUNTERS, keys=[str(d) for d in department_ids])
     return jsonify({
         'statistics': {
-            'total_users': total_users,
-            'total_departments': total_departments,
-            'total_resources': total_resources,
-            'total_facilities': total_facilities
+            'total_users': sum(stats['users.department'].values()),
+            'total_departments': len(department_ids),
+            'total_resources': sum(stats['resources.department'].values()),
+            'total_facilities': sum(stats['facilities.department'].values())
+        },
+        'breakdowns': {
+            'users_by_department': stats['users.department'],
+            'resources_by_department': stats['resources.department'],
+            'facilities_by_department': stats['facilities.department']
         }
     }), 200
 
+@bp.route('/api/admin/metrics', methods=['GET', 'DELETE'])
+@login_required
+@admin_required(['MASTER_ADMIN'])
+def request_metrics():
+    # Per-endpoint latency, query and render histograms; DELETE starts a new window
+    if request.method == 'DELETE':
+        metrics_registry.reset()
+        return jsonify({'message': 'Metrics reset'}), 200
+    return jsonify(metrics_registry.snapshot()), 200
+
 @bp.route('/api/admin/departments', methods=['GET', 'POST'])
 @login_required
 @admin_required(['MASTER_ADMIN', 'ORG_ADMIN'])
 def manage_departments():
     if request.method == 'GET':
-        departments = Department.query.all()
+        query = resolve_scope().apply(Department.query, Department)
+        query = apply_filters(query, request.args, DEPARTMENT_FILTERS)
+        try:
+            page = paginate(query, Department, PageRequest.from_args(request.args, DEPARTMENT_SORTS, 'name'))
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
         return jsonify({
-            'departments': [dept.to_dict() for dept in departments]
+            'departments': [dept.to_dict() for dept in page.items],
+            'page': page.meta()
         }), 200
     
     data = request.get_json()
     if not data or not data.get('name'):
         return jsonify({'error': 'Department name is required'}), 400
+    if data.get('parent_id') is not None and not resolve_scope().contains(data['parent_id']):
+        return jsonify({'error': 'Unauthorized to add a department there'}), 403
+    if key_in_use(Department, {'name': data['name'], 'parent_id': data.get('parent_id')}):
+        return jsonify({'error': 'A department with this name already exists under the same parent'}), 409
     
     department = Department(
         name=data['name'],
@@ -66,7 +121,7 @@ def manage_departments():
 @login_required
 @admin_required(['MASTER_ADMIN', 'ORG_ADMIN'])
 def manage_department(dept_id):
-    department = Department.query.get_or_404(dept_id)
+    department = resolve_scope().get_or_404(Department, dept_id)
     
     if request.method == 'DELETE':
         db.session.delete(department)
@@ -76,13 +131,22 @@ def manage_department(dept_id):
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No data provided'}), 400
+    if data.get('parent_id') is not None and not resolve_scope().contains(data['parent_id']):
+        return jsonify({'error': 'Unauthorized to move this department there'}), 403
+    key = {'name': data.get('name', department.name), 'parent_id': data.get('parent_id', department.parent_id)}
+    if key_in_use(Department, key, exclude_id=department.id):
+        return jsonify({'error': 'A department with this name already exists under the same parent'}), 409
     
     department.name = data.get('name', department.name)
     department.description = data.get('description', department.description)
     department.head_id = data.get('head_id', department.head_id)
     department.parent_id = data.get('parent_id', department.parent_id)
     
-    db.session.commit()
+    try:
+        db.session.commit()
+    except DepartmentCycleError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
         'message': 'Department updated successfully',
@@ -93,20 +157,23 @@ def manage_department(dept_id):
 @login_required
 @admin_required(['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN'])
 def get_users():
-    if current_user.role == 'DEPT_ADMIN':
-        users = User.query.filter_by(department_id=current_user.department_id).all()
-    else:
-        users = User.query.all()
+    query = resolve_scope().apply(User.query, User)
+    query = apply_filters(query, request.args, USER_FILTERS)
+    try:
+        page = paginate(query, User, PageRequest.from_args(request.args, USER_SORTS))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'users': [user.to_dict() for user in users]
+        'users': [user.to_dict() for user in page.items],
+        'page': page.meta()
     }), 200
 
 @bp.route('/api/admin/users/<int:user_id>', methods=['PUT', 'DELETE'])
 @login_required
 @admin_required(['MASTER_ADMIN', 'ORG_ADMIN'])
 def manage_user(user_id):
-    user = User.query.get_or_404(user_id)
+    user = resolve_scope().get_or_404(User, user_id)
     
     if request.method == 'DELETE':
         db.session.delete(user)
@@ -117,8 +184,10 @@ def manage_user(user_id):
     if not data:
         return jsonify({'error': 'No data provided'}), 400
     
-    if 'role' in data and data['role'] not in ['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN', 'USER']:
+    if 'role' in data and data['role'] not in ROLES:
         return jsonify({'error': 'Invalid role'}), 400
+    if data.get('department_id') is not None and not resolve_scope().contains(data['department_id']):
+        return jsonify({'error': 'Unauthorized to move this user to that department'}), 403
     
     for key, value in data.items():
         if hasattr(user, key):
@@ -1,20 +1,15 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify
 from flask_login import login_user, current_user, logout_user, login_required
-from werkzeug.security import generate_password_hash
-from datetime import datetime, timedelta
-import jwt
 from app.models import User, db
+from app.identity import Identity, identity_record
+from app.logins import LoginBusy, record_login, verify_password
+from app.refdata import ROLES
+from app.routes.admin import admin_required
+from app.scope import resolve_scope
+from app.tokens import ACCESS, REFRESH, InvalidToken, bearer_token, decode_token, issue_token_pair, revocations
 
 bp = Blueprint('auth', __name__)
 
-def generate_token(user_id):
-    """Generate JWT token for the user"""
-    payload = {
-        'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(days=1)
-    }
-    return jwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
-
 @bp.route('/api/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -24,13 +19,17 @@ def login():
     
     user = User.query.filter_by(email=data['email']).first()
     
-    if user and user.check_password(data['password']):
+    try:
+        valid = user is not None and verify_password(user, data['password'])
+    except LoginBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    
+    if valid:
         login_user(user, remember=data.get('remember', False))
-        user.last_login = datetime.utcnow()
-        db.session.commit()
+        record_login(user)
         
         return jsonify({
-            'token': generate_token(user.id),
+            **issue_token_pair(user),
             'user': user.to_dict()
         }), 200
     
@@ -39,15 +38,36 @@ def login():
 @bp.route('/api/auth/logout', methods=['POST'])
 @login_required
 def logout():
+    # Revoke the bearer token used for this call and, if given, its refresh token
+    tokens = [(bearer_token(), ACCESS), ((request.get_json(silent=True) or {}).get('refresh_token'), REFRESH)]
+    for token, kind in tokens:
+        if token:
+            try:
+                revocations.revoke(decode_token(token, kind))
+            except InvalidToken:
+                pass
     logout_user()
     return jsonify({'message': 'Successfully logged out'}), 200
 
 @bp.route('/api/auth/refresh-token', methods=['POST'])
-@login_required
 def refresh_token():
-    return jsonify({
-        'token': generate_token(current_user.id)
-    }), 200
+    """Exchange a refresh token (JSON refresh_token or bearer) for a new token pair"""
+    token = (request.get_json(silent=True) or {}).get('refresh_token') or bearer_token()
+    if token:
+        try:
+            claims = decode_token(token, REFRESH)
+        except InvalidToken as e:
+            return jsonify({'error': f'Invalid refresh token: {e}'}), 401
+        # Re-read role and department so the new tokens carry current claims
+        record = identity_record(int(claims['sub']))
+        if record is None or not record['is_active']:
+            return jsonify({'error': 'Account is no longer active'}), 401
+        # Refresh tokens are single use
+        revocations.revoke(claims)
+        return jsonify(issue_token_pair(Identity(record))), 200
+    if current_user.is_authenticated:
+        return jsonify(issue_token_pair(current_user)), 200
+    return jsonify({'error': 'Missing refresh token'}), 401
 
 @bp.route('/api/auth/user-profile', methods=['GET'])
 @login_required
@@ -55,11 +75,13 @@ def get_user_profile():
     return jsonify(current_user.to_dict()), 200
 
 @bp.route('/api/auth/register', methods=['POST'])
+@login_required
+@admin_required(['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN'])
 def register():
     data = request.get_json()
     
-    required_fields = ['username', 'email', 'password', 'role']
-    if not all(field in data for field in required_fields):
+    required_fields = ['username', 'email', 'password']
+    if not data or not all(field in data for field in required_fields):
         return jsonify({'error': 'Missing required fields'}), 400
     
     if User.query.filter_by(email=data['email']).first():
@@ -68,13 +90,25 @@ def register():
     if User.query.filter_by(username=data['username']).first():
         return jsonify({'error': 'Username already taken'}), 400
     
-    if data['role'] not in ['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN', 'USER']:
+    role = data.get('role', 'REGULAR_USER')
+    if role not in ROLES:
         return jsonify({'error': 'Invalid role'}), 400
+    # As on the add user page, only a master admin creates admins
+    if role != 'REGULAR_USER' and current_user.role != 'MASTER_ADMIN':
+        return jsonify({'error': 'Unauthorized to assign that role'}), 403
+    
+    scope = resolve_scope()
+    if not scope.contains(data.get('department_id')):
+        return jsonify({'error': 'Unauthorized to add a user to that department'}), 403
+    if data.get('manager_id') is not None:
+        manager = db.session.get(User, data['manager_id'])
+        if manager is None or not scope.contains(manager.department_id):
+            return jsonify({'error': 'Unauthorized to choose that manager'}), 403
     
     user = User(
         username=data['username'],
         email=data['email'],
-        role=data['role'],
+        role=role,
         department_id=data.get('department_id'),
         manager_id=data.get('manager_id')
     )
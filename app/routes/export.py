@@ -0,0 +1,25 @@
+from flask import Blueprint, request, jsonify
+from flask_login import login_required
+from app.export import EXPORTS, EXPORT_FORMATS, export_response
+from app.routes.admin import admin_required
+from app.scope import resolve_scope
+
+bp = Blueprint('export', __name__)
+
+@bp.route('/api/export/<kind>', methods=['GET'])
+@login_required
+@admin_required(['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN'])
+def export_records(kind):
+    if kind not in EXPORTS:
+        return jsonify({'error': f'Unknown export: {kind}'}), 404
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Format must be one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    
+    compress = request.args.get('compress', '')
+    if compress not in ('', 'gzip'):
+        return jsonify({'error': 'compress must be gzip'}), 400
+    
+    # Streamed: rows are read and sent a batch at a time, filtered like the listings
+    return export_response(kind, resolve_scope(), request.args, fmt=fmt, compress=compress == 'gzip')
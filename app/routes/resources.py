@@ -1,23 +1,27 @@
 from flask import Blueprint, request, jsonify
-from flask_login import login_required, current_user
-from app.models import Resource, Facility, Department, db
+from flask_login import login_required
+from app.models import Resource, Facility, db
 from app.routes.admin import admin_required
+from app.scope import resolve_scope
+from app.upsert import key_in_use
+from app.pagination import PageRequest, InvalidCursor, paginate, apply_filters
+from app.pagination import RESOURCE_SORTS, RESOURCE_FILTERS, FACILITY_SORTS, FACILITY_FILTERS
 
 bp = Blueprint('resources', __name__)
 
 @bp.route('/api/resources', methods=['GET'])
 @login_required
 def get_resources():
-    if current_user.role == 'MASTER_ADMIN':
-        resources = Resource.query.all()
-    elif current_user.role in ['ORG_ADMIN', 'DEPT_ADMIN']:
-        dept_ids = [dept.id for dept in Department.query.all()] if current_user.role == 'ORG_ADMIN' else [current_user.department_id]
-        resources = Resource.query.filter(Resource.department_id.in_(dept_ids)).all()
-    else:
-        resources = Resource.query.filter_by(department_id=current_user.department_id).all()
+    query = resolve_scope().apply(Resource.query, Resource)
+    query = apply_filters(query, request.args, RESOURCE_FILTERS)
+    try:
+        page = paginate(query, Resource, PageRequest.from_args(request.args, RESOURCE_SORTS))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'resources': [resource.to_dict() for resource in resources]
+        'resources': [resource.to_dict() for resource in page.items],
+        'page': page.meta()
     }), 200
 
 @bp.route('/api/resources', methods=['POST'])
@@ -30,8 +34,10 @@ def create_resource():
         return jsonify({'error': 'Missing required fields'}), 400
     
     # Check if user has permission for the department
-    if current_user.role == 'DEPT_ADMIN' and data['department_id'] != current_user.department_id:
+    if not resolve_scope().contains(data['department_id']):
         return jsonify({'error': 'Unauthorized to create resource for this department'}), 403
+    if key_in_use(Resource, data):
+        return jsonify({'error': 'A resource with this name already exists in the department'}), 409
     
     resource = Resource(
         name=data['name'],
@@ -55,12 +61,17 @@ def update_resource(resource_id):
     resource = Resource.query.get_or_404(resource_id)
     
     # Check permission
-    if current_user.role == 'DEPT_ADMIN' and resource.department_id != current_user.department_id:
+    if not resolve_scope().contains(resource.department_id):
         return jsonify({'error': 'Unauthorized to modify this resource'}), 403
     
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No data provided'}), 400
+    if 'department_id' in data and not resolve_scope().contains(data['department_id']):
+        return jsonify({'error': 'Unauthorized to move this resource to that department'}), 403
+    key = {'name': data.get('name', resource.name), 'department_id': data.get('department_id', resource.department_id)}
+    if key_in_use(Resource, key, exclude_id=resource.id):
+        return jsonify({'error': 'A resource with this name already exists in the department'}), 409
     
     for key, value in data.items():
         if hasattr(resource, key):
@@ -80,7 +91,7 @@ def delete_resource(resource_id):
     resource = Resource.query.get_or_404(resource_id)
     
     # Check permission
-    if current_user.role == 'DEPT_ADMIN' and resource.department_id != current_user.department_id:
+    if not resolve_scope().contains(resource.department_id):
         return jsonify({'error': 'Unauthorized to delete this resource'}), 403
     
     db.session.delete(resource)
@@ -91,16 +102,16 @@ def delete_resource(resource_id):
 @bp.route('/api/facilities', methods=['GET'])
 @login_required
 def get_facilities():
-    if current_user.role == 'MASTER_ADMIN':
-        facilities = Facility.query.all()
-    elif current_user.role in ['ORG_ADMIN', 'DEPT_ADMIN']:
-        dept_ids = [dept.id for dept in Department.query.all()] if current_user.role == 'ORG_ADMIN' else [current_user.department_id]
-        facilities = Facility.query.filter(Facility.department_id.in_(dept_ids)).all()
-    else:
-        facilities = Facility.query.filter_by(department_id=current_user.department_id).all()
+    query = resolve_scope().apply(Facility.query, Facility)
+    query = apply_filters(query, request.args, FACILITY_FILTERS)
+    try:
+        page = paginate(query, Facility, PageRequest.from_args(request.args, FACILITY_SORTS))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'facilities': [facility.to_dict() for facility in facilities]
+        'facilities': [facility.to_dict() for facility in page.items],
+        'page': page.meta()
     }), 200
 
 @bp.route('/api/facilities', methods=['POST'])
@@ -113,8 +124,10 @@ def create_facility():
         return jsonify({'error': 'Missing required fields'}), 400
     
     # Check if user has permission for the department
-    if current_user.role == 'DEPT_ADMIN' and data['department_id'] != current_user.department_id:
+    if not resolve_scope().contains(data['department_id']):
         return jsonify({'error': 'Unauthorized to create facility for this department'}), 403
+    if key_in_use(Facility, data):
+        return jsonify({'error': 'A facility with this name already exists in the department'}), 409
     
     facility = Facility(
         name=data['name'],
@@ -140,7 +153,7 @@ def manage_facility(facility_id):
     facility = Facility.query.get_or_404(facility_id)
     
     # Check permission
-    if current_user.role == 'DEPT_ADMIN' and facility.department_id != current_user.department_id:
+    if not resolve_scope().contains(facility.department_id):
         return jsonify({'error': 'Unauthorized to modify this facility'}), 403
     
     if request.method == 'DELETE':
@@ -151,6 +164,11 @@ def manage_facility(facility_id):
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No data provided'}), 400
+    if 'department_id' in data and not resolve_scope().contains(data['department_id']):
+        return jsonify({'error': 'Unauthorized to move this facility to that department'}), 403
+    key = {'name': data.get('name', facility.name), 'department_id': data.get('department_id', facility.department_id)}
+    if key_in_use(Facility, key, exclude_id=facility.id):
+        return jsonify({'error': 'A facility with this name already exists in the department'}), 409
     
     for key, value in data.items():
         if hasattr(facility, key):
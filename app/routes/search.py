@@ -0,0 +1,25 @@
+from flask import Blueprint, request, jsonify
+from flask_login import login_required
+from app.scope import resolve_scope
+from app.search import KINDS, search
+
+bp = Blueprint('search', __name__)
+
+@bp.route('/api/search', methods=['GET'])
+@login_required
+def search_records():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing search query (q)'}), 400
+    
+    kinds = [kind for kind in request.args.get('kind', '').split(',') if kind]
+    unknown = [kind for kind in kinds if kind not in KINDS]
+    if unknown:
+        return jsonify({'error': f"Unknown kind: {', '.join(unknown)}"}), 400
+    
+    result = search(query,
+                    kinds=kinds,
+                    page=request.args.get('page', 1, type=int),
+                    per_page=request.args.get('per_page', 20, type=int),
+                    **resolve_scope().search_filters())
+    return jsonify(result), 200
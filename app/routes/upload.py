@@ -1,250 +1,134 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, url_for, send_file
 from flask_login import login_required, current_user
-import pandas as pd
-import uuid
+from functools import partial
 import os
-from app.models import User, Department, Facility, db
+from app.bundle import BUNDLE_KINDS
+from app.importer import DEFAULT_CHUNK_SIZE, DEFAULT_PASSWORD, IMPORT_MODES
+from app.jobs import submit_import, submit_bundle, cancel_import, get_job, error_report_path, TooManyJobs
 from app.routes.admin import admin_required
+from app.upsert import upsert_unsupported
+from app.validation import read_validated_csv
 
 bp = Blueprint('upload', __name__)
 
-# Store upload jobs status
-upload_jobs = {}
+# Imported rows name their departments, parents and managers freely, so only a master admin may upload
 
-def validate_users_csv(df):
-    """Validate users CSV data"""
-    errors = []
-    
-    # Check required columns
-    required_columns = ['email', 'name', 'role', 'department_id']
-    missing_columns = [col for col in required_columns if col not in df.columns]
-    if missing_columns:
-        errors.append(f"Missing required columns: {', '.join(missing_columns)}")
-    
-    if not errors:
-        # Validate email format
-        invalid_emails = df[~df['email'].str.contains('@', na=False)]['email'].tolist()
-        if invalid_emails:
-            errors.append(f"Invalid email format: {', '.join(invalid_emails)}")
-        
-        # Validate roles
-        valid_roles = ['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN', 'USER']
-        invalid_roles = df[~df['role'].isin(valid_roles)]['role'].unique().tolist()
-        if invalid_roles:
-            errors.append(f"Invalid roles: {', '.join(invalid_roles)}")
-        
-        # Validate department IDs
-        existing_dept_ids = {dept.id for dept in Department.query.all()}
-        invalid_dept_ids = df[~df['department_id'].isin(existing_dept_ids)]['department_id'].unique().tolist()
-        if invalid_dept_ids:
-            errors.append(f"Invalid department IDs: {', '.join(map(str, invalid_dept_ids))}")
-    
-    return errors
-
-def validate_departments_csv(df):
-    """Validate departments CSV data"""
-    errors = []
-    
-    # Check required columns
-    required_columns = ['name', 'head_id', 'parent_department_id']
-    missing_columns = [col for col in required_columns if col not in df.columns]
-    if missing_columns:
-        errors.append(f"Missing required columns: {', '.join(missing_columns)}")
-    
-    if not errors:
-        # Check for duplicate department names
-        duplicates = df[df['name'].duplicated()]['name'].tolist()
-        if duplicates:
-            errors.append(f"Duplicate department names: {', '.join(duplicates)}")
-        
-        # Validate head_id references
-        existing_user_ids = {user.id for user in User.query.all()}
-        invalid_head_ids = df[~df['head_id'].isin(existing_user_ids)]['head_id'].unique().tolist()
-        if invalid_head_ids:
-            errors.append(f"Invalid head IDs: {', '.join(map(str, invalid_head_ids))}")
-        
-        # Validate parent_department_id references
-        existing_dept_ids = {dept.id for dept in Department.query.all()}
-        invalid_parent_ids = df[
-            (df['parent_department_id'].notna()) & 
-            (~df['parent_department_id'].isin(existing_dept_ids))
-        ]['parent_department_id'].unique().tolist()
-        if invalid_parent_ids:
-            errors.append(f"Invalid parent department IDs: {', '.join(map(str, invalid_parent_ids))}")
-    
-    return errors
-
-def validate_facilities_csv(df):
-    """Validate facilities CSV data"""
-    errors = []
-    
-    # Check required columns
-    required_columns = ['name', 'department_id', 'description']
-    missing_columns = [col for col in required_columns if col not in df.columns]
-    if missing_columns:
-        errors.append(f"Missing required columns: {', '.join(missing_columns)}")
-    
-    if not errors:
-        # Validate department_id references
-        existing_dept_ids = {dept.id for dept in Department.query.all()}
-        invalid_dept_ids = df[~df['department_id'].isin(existing_dept_ids)]['department_id'].unique().tolist()
-        if invalid_dept_ids:
-            errors.append(f"Invalid department IDs: {', '.join(map(str, invalid_dept_ids))}")
-    
-    return errors
-
-@bp.route('/api/upload/csv/users', methods=['POST'])
-@login_required
-@admin_required(['MASTER_ADMIN', 'ORG_ADMIN'])
-def upload_users():
+def _upload_file():
+    """Return the uploaded CSV file or an error response tuple"""
     if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
+        return None, (jsonify({'error': 'No file provided'}), 400)
     
     file = request.files['file']
     if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+        return None, (jsonify({'error': 'No file selected'}), 400)
     
     if not file.filename.endswith('.csv'):
-        return jsonify({'error': 'File must be a CSV'}), 400
+        return None, (jsonify({'error': 'File must be a CSV'}), 400)
     
+    return file, None
+
+def _run_upload(kind, password=DEFAULT_PASSWORD):
+    file, error = _upload_file()
+    if error:
+        return error
+    
+    # insert skips rows that already exist; upsert updates them where they differ
+    mode = request.form.get('mode') or request.args.get('mode', 'insert')
+    if mode not in IMPORT_MODES:
+        return jsonify({'error': f'Mode must be one of: {", ".join(IMPORT_MODES)}'}), 400
+    unsupported = upsert_unsupported() if mode == 'upsert' else None
+    if unsupported:
+        return jsonify({'error': unsupported}), 400
+    
+    chunk_size = current_app.config.get('IMPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
     try:
-        df = pd.read_csv(file)
-        
-        # Validate data
-        errors = validate_users_csv(df)
-        if errors:
-            return jsonify({'error': 'Validation failed', 'details': errors}), 400
-        
-        # Generate job ID
-        job_id = str(uuid.uuid4())
-        upload_jobs[job_id] = {'status': 'processing', 'progress': 0}
-        
-        # Process users
-        for _, row in df.iterrows():
-            user = User(
-                username=row['name'],
-                email=row['email'],
-                role=row['role'],
-                department_id=row['department_id']
-            )
-            user.set_password('temp_password')  # Set temporary password
-            db.session.add(user)
-        
-        db.session.commit()
-        upload_jobs[job_id]['status'] = 'completed'
-        
-        return jsonify({
-            'message': 'Users uploaded successfully',
-            'job_id': job_id
-        }), 201
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        job = submit_import(current_app._get_current_object(), kind, file,
+                            partial(read_validated_csv, kind=kind, chunk_size=chunk_size, mode=mode),
+                            password=password, created_by_id=current_user.id, mode=mode)
+    except TooManyJobs as e:
+        return jsonify({'error': str(e)}), 429
+    
+    return jsonify({
+        'message': f'{kind.capitalize()} upload queued',
+        'job_id': job.id,
+        'status_url': url_for('upload.get_upload_status', job_id=job.id)
+    }), 202
+
+@bp.route('/api/upload/csv/users', methods=['POST'])
+@login_required
+@admin_required(['MASTER_ADMIN'])
+def upload_users():
+    return _run_upload('users', password='temp_password')
 
 @bp.route('/api/upload/csv/departments', methods=['POST'])
 @login_required
-@admin_required(['MASTER_ADMIN', 'ORG_ADMIN'])
+@admin_required(['MASTER_ADMIN'])
 def upload_departments():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-    
-    if not file.filename.endswith('.csv'):
-        return jsonify({'error': 'File must be a CSV'}), 400
-    
-    try:
-        df = pd.read_csv(file)
-        
-        # Validate data
-        errors = validate_departments_csv(df)
-        if errors:
-            return jsonify({'error': 'Validation failed', 'details': errors}), 400
-        
-        # Generate job ID
-        job_id = str(uuid.uuid4())
-        upload_jobs[job_id] = {'status': 'processing', 'progress': 0}
-        
-        # Process departments
-        for _, row in df.iterrows():
-            department = Department(
-                name=row['name'],
-                description=row.get('description'),
-                head_id=row['head_id'],
-                parent_id=row['parent_department_id']
-            )
-            db.session.add(department)
-        
-        db.session.commit()
-        upload_jobs[job_id]['status'] = 'completed'
-        
-        return jsonify({
-            'message': 'Departments uploaded successfully',
-            'job_id': job_id
-        }), 201
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+    return _run_upload('departments')
 
 @bp.route('/api/upload/csv/facilities', methods=['POST'])
 @login_required
-@admin_required(['MASTER_ADMIN', 'ORG_ADMIN'])
+@admin_required(['MASTER_ADMIN'])
 def upload_facilities():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-    
-    if not file.filename.endswith('.csv'):
-        return jsonify({'error': 'File must be a CSV'}), 400
+    return _run_upload('facilities')
+
+@bp.route('/api/upload/bundle', methods=['POST'])
+@login_required
+@admin_required(['MASTER_ADMIN'])
+def upload_bundle():
+    # A zip as 'file', or one CSV part per kind: departments, users, resources, facilities
+    parts = {kind: request.files[kind] for kind in BUNDLE_KINDS if request.files.get(kind)}
+    if parts:
+        if not all(part.filename.endswith('.csv') for part in parts.values()):
+            return jsonify({'error': 'Bundle parts must be CSV files'}), 400
+        file = parts
+    else:
+        if not request.files.get('file'):
+            return jsonify({'error': f'Provide a zip as file, or CSV parts named {", ".join(BUNDLE_KINDS)}'}), 400
+        file = request.files['file']
+        if not file.filename.endswith('.zip'):
+            return jsonify({'error': 'File must be a zip of CSV files'}), 400
     
     try:
-        df = pd.read_csv(file)
-        
-        # Validate data
-        errors = validate_facilities_csv(df)
-        if errors:
-            return jsonify({'error': 'Validation failed', 'details': errors}), 400
-        
-        # Generate job ID
-        job_id = str(uuid.uuid4())
-        upload_jobs[job_id] = {'status': 'processing', 'progress': 0}
-        
-        # Process facilities
-        for _, row in df.iterrows():
-            facility = Facility(
-                name=row['name'],
-                description=row['description'],
-                department_id=row['department_id'],
-                type=row.get('type', 'OFFICE'),
-                capacity=row.get('capacity'),
-                location=row.get('location')
-            )
-            db.session.add(facility)
-        
-        db.session.commit()
-        upload_jobs[job_id]['status'] = 'completed'
-        
-        return jsonify({
-            'message': 'Facilities uploaded successfully',
-            'job_id': job_id
-        }), 201
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        job = submit_bundle(current_app._get_current_object(), file, password='temp_password',
+                            created_by_id=current_user.id)
+    except TooManyJobs as e:
+        return jsonify({'error': str(e)}), 429
+    
+    return jsonify({
+        'message': 'Bundle upload queued',
+        'job_id': job.id,
+        'status_url': url_for('upload.get_upload_status', job_id=job.id)
+    }), 202
 
 @bp.route('/api/upload/status/<job_id>', methods=['GET'])
 @login_required
 def get_upload_status(job_id):
-    job = upload_jobs.get(job_id)
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    status = job.to_dict()
+    if os.path.exists(error_report_path(job_id)):
+        status['error_report_url'] = url_for('upload.get_error_report', job_id=job_id)
+    return jsonify(status), 200
+
+@bp.route('/api/upload/status/<job_id>/errors.csv', methods=['GET'])
+@login_required
+def get_error_report(job_id):
+    # One row per problem: line, column, code, value
+    path = error_report_path(job_id)
+    if not get_job(job_id) or not os.path.exists(path):
+        return jsonify({'error': 'No error report for this job'}), 404
+    
+    return send_file(path, mimetype='text/csv', as_attachment=True, download_name=f'{job_id}-errors.csv')
+
+@bp.route('/api/upload/status/<job_id>/cancel', methods=['POST'])
+@login_required
+@admin_required(['MASTER_ADMIN'])
+def cancel_upload(job_id):
+    job = cancel_import(job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
     
-    return jsonify(job), 200
+    return jsonify(job.to_dict()), 200
@@ -2,11 +2,19 @@ from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 import os
-from app.models import User, Department, Resource, db
-from app.routes.admin import admin_required
+from app.models import User, Resource, Facility, db
+from app.loaders import USER_WITH_DEPARTMENT
+from app.hierarchy import manager_chain, report_counts, reports, DEFAULT_MAX_DEPTH
+from app.scope import resolve_scope
 
 bp = Blueprint('users', __name__)
 
+def _get_user_or_404(user_id):
+    # Admins reach other users only within their scope
+    if current_user.id == user_id:
+        return User.query.get_or_404(user_id)
+    return resolve_scope().get_or_404(User, user_id)
+
 @bp.route('/api/users/<int:user_id>/profile', methods=['GET'])
 @login_required
 def get_user_profile(user_id):
@@ -14,7 +22,7 @@ def get_user_profile(user_id):
     if current_user.id != user_id and current_user.role not in ['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN']:
         return jsonify({'error': 'Unauthorized access'}), 403
     
-    user = User.query.get_or_404(user_id)
+    user = _get_user_or_404(user_id)
     return jsonify(user.to_dict()), 200
 
 @bp.route('/api/users/<int:user_id>/profile', methods=['PUT'])
@@ -24,7 +32,7 @@ def update_user_profile(user_id):
     if current_user.id != user_id and current_user.role not in ['MASTER_ADMIN', 'ORG_ADMIN']:
         return jsonify({'error': 'Unauthorized access'}), 403
     
-    user = User.query.get_or_404(user_id)
+    user = _get_user_or_404(user_id)
     data = request.form.to_dict()
     
     # Handle profile image upload
@@ -40,6 +48,10 @@ def update_user_profile(user_id):
     if current_user.role in ['MASTER_ADMIN', 'ORG_ADMIN']:
         allowed_fields.extend(['role', 'department_id', 'manager_id'])
     
+    department_id = request.form.get('department_id', type=int)
+    if 'department_id' in allowed_fields and department_id is not None and not resolve_scope().contains(department_id):
+        return jsonify({'error': 'Unauthorized to move this user to that department'}), 403
+    
     for key, value in data.items():
         if key in allowed_fields and hasattr(user, key):
             setattr(user, key, value)
@@ -51,17 +63,18 @@ def update_user_profile(user_id):
         'user': user.to_dict()
     }), 200
 
+def _max_depth():
+    max_depth = request.args.get('max_depth', DEFAULT_MAX_DEPTH, type=int)
+    return max(1, min(max_depth, current_app.config.get('HIERARCHY_MAX_DEPTH', DEFAULT_MAX_DEPTH)))
+
 @bp.route('/api/users/<int:user_id>/hierarchy', methods=['GET'])
 @login_required
 def get_user_hierarchy(user_id):
-    user = User.query.get_or_404(user_id)
+    user = User.query.options(*USER_WITH_DEPARTMENT).get_or_404(user_id)
+    max_depth = _max_depth()
     
-    # Build the reporting chain
-    reporting_chain = []
-    current = user
-    while current.manager_id:
-        current = current.manager
-        reporting_chain.append(current.to_dict())
+    # Build the reporting chain with a single recursive query
+    reporting_chain = [manager.to_dict() for manager in manager_chain(user.id, max_depth)]
     
     # Get department information
     department = user.department
@@ -69,13 +82,40 @@ def get_user_hierarchy(user_id):
     
     # Get subordinates if user is a manager
     subordinates = [sub.to_dict() for sub in user.subordinates]
+    counts = report_counts(user.id, max_depth)
     
     return jsonify({
         'user': user.to_dict(),
         'reporting_chain': reporting_chain,
         'department': department.to_dict() if department else None,
         'department_head': department_head.to_dict() if department_head else None,
-        'subordinates': subordinates
+        'subordinates': subordinates,
+        'reports_by_level': counts,
+        'total_reports': sum(counts.values())
+    }), 200
+
+@bp.route('/api/users/<int:user_id>/reports', methods=['GET'])
+@login_required
+def get_user_reports(user_id):
+    # Users can see their own report tree; admins can see anyone's
+    if current_user.id != user_id and current_user.role not in ['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN']:
+        return jsonify({'error': 'Unauthorized access'}), 403
+    
+    user = _get_user_or_404(user_id)
+    max_depth = _max_depth()
+    limit = max(1, min(request.args.get('limit', 1000, type=int), 10000))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    
+    counts = report_counts(user.id, max_depth)
+    rows = reports(user.id, max_depth, limit=limit, offset=offset)
+    
+    return jsonify({
+        'user': user.to_dict(),
+        'reports_by_level': counts,
+        'total_reports': sum(counts.values()),
+        'reports': [dict(report.to_dict(), depth=depth) for report, depth in rows],
+        'limit': limit,
+        'offset': offset
     }), 200
 
 @bp.route('/api/users/<int:user_id>/resources', methods=['GET'])
@@ -84,14 +124,13 @@ def get_user_resources(user_id):
     if current_user.id != user_id and current_user.role not in ['MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN']:
         return jsonify({'error': 'Unauthorized access'}), 403
     
-    user = User.query.get_or_404(user_id)
+    user = _get_user_or_404(user_id)
     
     # Get assigned resources
-    resources = Resource.query.filter_by(assigned_user_id=user_id).all()
+    resources = Resource.query.filter_by(assigned_to_id=user_id).all()
     
     # Get department facilities
-    department = user.department
-    facilities = department.facilities if department else []
+    facilities = Facility.query.filter_by(department_id=user.department_id).all() if user.department_id else []
     
     return jsonify({
         'resources': [resource.to_dict() for resource in resources],
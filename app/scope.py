@@ -0,0 +1,140 @@
+"""Row visibility by role, resolved once and applied as SQL predicates.
+
+MASTER_ADMIN sees every row; ORG_ADMIN their department and everything
+under it; DEPT_ADMIN and regular users their own department; anyone without
+a department sees nothing that belongs to one. resolve_scope() turns a user
+into a Scope from the role and department they were loaded with: the
+identity record (see app.identity), or the claims of a bearer token. It is
+not memoized per user: a copy kept under the user's id would outlive a
+demotion committed by another process, whereas the identity record is
+reloaded after IDENTITY_CACHE_TTL seconds.
+
+Scope.where(Model) is a predicate on the model's department column: nothing,
+an equality, or an IN over the department_closure subquery. The subtree is
+resolved by the database from the closure primary key rather than fetched
+and passed back as a list of ids. The few callers that need the ids
+themselves (cache tags, counter breakdowns) get them from department_ids(),
+which is memoized until the department tree changes.
+"""
+from flask import abort
+from flask_login import current_user
+from sqlalchemy import false, select, true
+
+from app import db
+from app.cache import VersionedCache, register_cache
+from app.hierarchy import descendant_ids, is_descendant
+from app.models import User, Department, Resource, Facility
+
+ALL = 'all'
+SUBTREE = 'subtree'
+DEPARTMENT = 'department'
+NONE = 'none'
+
+# Model -> the column that places its rows in a department
+SCOPED_COLUMNS = {
+    User: User.department_id,
+    Department: Department.id,
+    Resource: Resource.department_id,
+    Facility: Facility.department_id
+}
+
+scope_cache = register_cache(VersionedCache(max_entries=4096, ttl=300))
+
+
+class Scope:
+    """The departments a user may see: ALL, the SUBTREE or DEPARTMENT at department_id, or NONE"""
+
+    __slots__ = ('kind', 'department_id')
+
+    def __init__(self, kind, department_id=None):
+        self.kind = kind
+        self.department_id = department_id
+
+    @property
+    def unrestricted(self):
+        return self.kind == ALL
+
+    def column_filter(self, column):
+        if self.kind == ALL:
+            return true()
+        if self.kind == SUBTREE:
+            return column.in_(descendant_ids(self.department_id))
+        if self.kind == DEPARTMENT:
+            return column == self.department_id
+        return false()
+
+    def where(self, model):
+        return self.column_filter(SCOPED_COLUMNS[model])
+
+    def apply(self, query, model):
+        """query (Query or Select) limited to the rows of model in scope"""
+        return query if self.unrestricted else query.filter(self.where(model))
+
+    def contains(self, dept_id):
+        if self.kind == ALL:
+            return True
+        if dept_id is None or self.kind == NONE:
+            return False
+        if self.kind == DEPARTMENT:
+            return dept_id == self.department_id
+        return dept_id == self.department_id or is_descendant(dept_id, self.department_id)
+
+    def get_or_404(self, model, id_, options=()):
+        """The row of model with id_, or 404 if it doesn't exist or is out of scope"""
+        query = select(model).options(*options).where(model.id == id_)
+        return db.first_or_404(self.apply(query, model))
+
+    def department_ids(self):
+        """frozenset of the department ids in scope; None when unrestricted"""
+        if self.kind == ALL:
+            return None
+        if self.kind == NONE:
+            return frozenset()
+        if self.kind == DEPARTMENT:
+            return frozenset((self.department_id,))
+        return scope_cache.get_or_set(
+            f'scope.subtree:{self.department_id}',
+            lambda: frozenset(db.session.scalars(descendant_ids(self.department_id))),
+            tags=('department',)
+        )
+
+    def search_filters(self):
+        """departments/subtree_of arguments for app.search.search()"""
+        if self.kind == ALL:
+            return {}
+        if self.kind == SUBTREE:
+            return {'subtree_of': self.department_id}
+        return {'departments': list(self.department_ids())}
+
+    def __eq__(self, other):
+        return isinstance(other, Scope) and (self.kind, self.department_id) == (other.kind, other.department_id)
+
+    def __hash__(self):
+        return hash((self.kind, self.department_id))
+
+    def __repr__(self):
+        return f'Scope({self.kind!r}, {self.department_id!r})'
+
+
+def scope_for(role, department_id):
+    if role == 'MASTER_ADMIN':
+        return Scope(ALL)
+    if department_id is None:
+        return Scope(NONE)
+    if role == 'ORG_ADMIN':
+        return Scope(SUBTREE, department_id)
+    return Scope(DEPARTMENT, department_id)
+
+
+def resolve_scope(user=None):
+    """The Scope of user (default: current_user)"""
+    user = user if user is not None else current_user
+    if not user.is_authenticated:
+        return Scope(NONE)
+    return scope_for(user.role, user.department_id)
+
+
+def require_in_scope(dept_id, user=None):
+    """abort(403) unless dept_id is in the user's scope"""
+    if not resolve_scope(user).contains(dept_id):
+        abort(403)
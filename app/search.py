@@ -0,0 +1,293 @@
+"""Full-text search over resources, facilities, users and departments.
+
+search_index is an SQLite FTS5 table with one row per searchable record: a
+title (name or username), a body (type, location, email or description) and
+a filters column of tokens the scope and kind filters match on: k<kind>,
+d<department> and a<ancestor> for the record's department and each
+department above it. Filtering therefore happens inside the full-text match:
+"everything under department 5" is the single term a5.
+
+The FTS rowid encodes the record's kind and id (id * 4 + kind), so keeping
+the index in sync is a primary-key delete and insert per changed row. ORM
+writes are indexed from the Session flush, in the same transaction. Moving a
+department reindexes everything under it. Bulk inserts call index_new_rows()
+(or index_rows() when they chose the ids) and the seeder rebuilds the whole
+index.
+
+Queries match every word as a prefix ("lap del" finds "Dell Laptop 12").
+Up to RANK_LIMIT matches are ranked with bm25, titles weighted above bodies;
+broader queries come back unranked (in index order) with ranked False,
+since scoring hundreds of thousands of matches takes a noticeable fraction
+of a second. On databases without FTS5 the index is a plain table searched
+with LIKE, which is unranked and slower.
+"""
+import re
+
+from sqlalchemy import DDL, column, event, exists, inspect, select, table, text
+from sqlalchemy.orm import Session
+
+from app import db
+from app.hierarchy import descendant_ids
+from app.models import User, Department, Resource, Facility, DepartmentClosure
+
+TABLE = 'search_index'
+_index = table(TABLE, column('rowid'))
+
+# Model -> (kind code in the rowid, kind name, title column, body columns)
+INDEXED = {
+    User: (0, 'user', 'username', ('email',)),
+    Department: (1, 'department', 'name', ('description',)),
+    Resource: (2, 'resource', 'name', ('type',)),
+    Facility: (3, 'facility', 'name', ('type', 'location'))
+}
+KINDS = {name: code for code, name, _, _ in INDEXED.values()}
+_KIND_NAMES = {code: name for name, code in KINDS.items()}
+_KIND_COUNT = 4
+
+MAX_PER_PAGE = 50
+RANK_LIMIT = 2000
+BATCH_SIZE = 10_000
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+_FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+    "title, body, filters, department_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+_PLAIN_DDL = (
+    f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+    "rowid BIGINT PRIMARY KEY, title VARCHAR(255), body TEXT, filters TEXT, department_id INTEGER)"
+)
+
+# Keep db.create_all()/drop_all() (tests, recreate-db) in step with the migration
+event.listen(db.metadata, 'after_create', DDL(_FTS_DDL).execute_if(dialect='sqlite'))
+event.listen(db.metadata, 'after_create',
+             DDL(_PLAIN_DDL).execute_if(callable_=lambda ddl, target, bind, **kw: bind.dialect.name != 'sqlite'))
+event.listen(db.metadata, 'before_drop', DDL(f'DROP TABLE IF EXISTS {TABLE}'))
+
+
+def _rowid(model, row_id):
+    return row_id * _KIND_COUNT + INDEXED[model][0]
+
+
+def _columns(model):
+    _, _, title, body = INDEXED[model]
+    names = ['id', title, *body] + ([] if model is Department else ['department_id'])
+    return [model.__table__.c[name] for name in names]
+
+
+class _Ancestors:
+    """department id -> ancestor ids (itself included), read from the closure table on demand"""
+
+    def __init__(self, connection, preload=False):
+        self.connection = connection
+        self._cache = {}
+        if preload:
+            closure = DepartmentClosure.__table__
+            for ancestor, descendant in connection.execute(select(closure.c.ancestor_id, closure.c.descendant_id)):
+                self._cache.setdefault(descendant, []).append(ancestor)
+
+    def __call__(self, dept_id):
+        if dept_id not in self._cache:
+            self._cache[dept_id] = list(self.connection.scalars(
+                select(DepartmentClosure.ancestor_id).where(DepartmentClosure.descendant_id == dept_id)
+            ))
+        return self._cache[dept_id]
+
+
+def _entry(model, values, ancestors):
+    _, kind, title, body = INDEXED[model]
+    dept_id = values['id'] if model is Department else values.get('department_id')
+    filters = [f'k{kind}']
+    if dept_id is not None:
+        filters.append(f'd{dept_id}')
+        filters.extend(f'a{a}' for a in ancestors(dept_id))
+    return {
+        'rowid': _rowid(model, values['id']),
+        'title': values.get(title) or '',
+        'body': ' '.join(str(values[column]) for column in body if values.get(column)),
+        'filters': ' ' + ' '.join(filters) + ' ',
+        'department_id': dept_id
+    }
+
+
+def _write(connection, deleted_rowids, entries):
+    if deleted_rowids:
+        connection.execute(text(f'DELETE FROM {TABLE} WHERE rowid = :rowid'), [{'rowid': r} for r in deleted_rowids])
+    if entries:
+        connection.execute(
+            text(f'INSERT INTO {TABLE} (rowid, title, body, filters, department_id) '
+                 'VALUES (:rowid, :title, :body, :filters, :department_id)'),
+            entries
+        )
+
+
+def _index_query(connection, model, query, ancestors, replace=False):
+    # Materialized first: some drivers can't write while a result set on the same connection is open
+    rows = connection.execute(query).mappings().all()
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = [_entry(model, row, ancestors) for row in rows[start:start + BATCH_SIZE]]
+        _write(connection, [e['rowid'] for e in batch] if replace else (), batch)
+    return len(rows)
+
+
+def index_new_rows(model, after_id, connection=None, preload=False):
+    """Index rows of model with id > after_id, e.g. just bulk-inserted; call in the inserting transaction
+
+    Rows already in the index are left alone: another import may have
+    committed (and indexed) rows above after_id before this one took the
+    write lock. preload=True reads the whole closure table up front, cheaper
+    than a lookup per department when the rows span most of them.
+    """
+    connection = connection or db.session.connection()
+    ids = model.__table__.c.id
+    indexed = exists().where(_index.c.rowid == ids * _KIND_COUNT + INDEXED[model][0])
+    query = select(*_columns(model)).where(ids > after_id, ~indexed)
+    return _index_query(connection, model, query, _Ancestors(connection, preload=preload))
+
+
+def index_rows(model, ids, connection=None, replace=False):
+    """Index the rows of model with these ids, e.g. bulk-inserted with explicit ids
+
+    replace=True re-indexes rows that are already in the index, e.g. after a bulk update.
+    """
+    connection = connection or db.session.connection()
+    query = select(*_columns(model)).where(model.__table__.c.id.in_(ids))
+    return _index_query(connection, model, query, _Ancestors(connection), replace=replace)
+
+
+def rebuild_search_index(connection=None):
+    """Recreate the index from the tables; returns the number of rows indexed"""
+    connection = connection or db.session.connection()
+    # Much faster than deleting every row of a large FTS table
+    connection.exec_driver_sql(f'DROP TABLE IF EXISTS {TABLE}')
+    connection.exec_driver_sql(_FTS_DDL if connection.dialect.name == 'sqlite' else _PLAIN_DDL)
+    ancestors = _Ancestors(connection, preload=True)
+    count = 0
+    for model in INDEXED:
+        table = model.__table__
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                select(*_columns(model)).where(table.c.id > last_id).order_by(table.c.id).limit(BATCH_SIZE)
+            ).mappings().all()
+            if not rows:
+                break
+            _write(connection, (), [_entry(model, row, ancestors) for row in rows])
+            count += len(rows)
+            last_id = rows[-1]['id']
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')"))
+    return count
+
+
+def _reindex_subtree(connection, dept_id, ancestors):
+    """Refresh the ancestor tokens of everything in and under a department that moved"""
+    subtree = descendant_ids(dept_id)
+    for model in INDEXED:
+        column = model.__table__.c.id if model is Department else model.__table__.c.department_id
+        _index_query(connection, model, select(*_columns(model)).where(column.in_(subtree)), ancestors, replace=True)
+
+
+def _values(obj):
+    return {column.key: getattr(obj, column.key) for column in _columns(type(obj))}
+
+
+def _changed(obj):
+    state = inspect(obj)
+    return any(state.attrs[column.key].history.has_changes() for column in _columns(type(obj))[1:])
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_flush(session, flush_context):
+    if not any(type(obj) in INDEXED for obj in (*session.new, *session.dirty, *session.deleted)):
+        return
+    connection = session.connection()
+    ancestors = _Ancestors(connection)
+    deleted, entries, moved = [], [], []
+    for obj in session.deleted:
+        if type(obj) in INDEXED:
+            deleted.append(_rowid(type(obj), obj.id))
+    for obj in session.dirty:
+        if type(obj) not in INDEXED:
+            continue
+        if type(obj) is Department and inspect(obj).attrs.parent_id.history.has_changes():
+            moved.append(obj.id)
+        elif _changed(obj):
+            deleted.append(_rowid(type(obj), obj.id))
+            entries.append(_entry(type(obj), _values(obj), ancestors))
+    for obj in session.new:
+        if type(obj) in INDEXED:
+            entries.append(_entry(type(obj), _values(obj), ancestors))
+    _write(connection, deleted, entries)
+    for dept_id in moved:
+        _reindex_subtree(connection, dept_id, ancestors)
+
+
+def _fts_match(words, filters):
+    match = '{title body} : (' + ' '.join(f'"{word}"*' for word in words) + ')'
+    for tokens in filters:
+        match += ' AND filters : (' + ' OR '.join(tokens) + ')'
+    return match
+
+
+def search(query, departments=None, subtree_of=None, kinds=None, page=1, per_page=20):
+    """Matches for query as {'results': [...], 'ranked': ..., 'has_next': ...}
+
+    departments limits results to records in those departments and subtree_of
+    to records in or under that department; with neither, everything is
+    searched. kinds limits the result to some of 'user', 'department',
+    'resource' and 'facility'.
+    """
+    page = max(1, page)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    result = {'results': [], 'page': page, 'per_page': per_page, 'has_next': False, 'ranked': True}
+    words = _WORD.findall(query)[:10]
+    if not words or (departments is not None and not departments):
+        return result
+
+    filters = []
+    if departments is not None:
+        filters.append([f'd{int(d)}' for d in departments])
+    if subtree_of is not None:
+        filters.append([f'a{int(subtree_of)}'])
+    if kinds:
+        filters.append([f'k{kind}' for kind in kinds if kind in KINDS])
+
+    connection = db.session.connection()
+    params = {'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    if connection.dialect.name == 'sqlite':
+        where = f'{TABLE} MATCH :match'
+        params['match'] = _fts_match(words, filters)
+        # Counting matches only walks the index; scoring them all is what gets slow
+        matches = connection.execute(
+            text(f'SELECT count(*) FROM (SELECT 1 FROM {TABLE} WHERE {where} LIMIT {RANK_LIMIT + 1})'), params
+        ).scalar()
+        result['ranked'] = matches <= RANK_LIMIT
+        order = f'bm25({TABLE}, 10.0, 1.0, 0.0)' if result['ranked'] else 'rowid'
+    else:
+        clauses = []
+        for i, word in enumerate(words):
+            clauses.append(f'(lower(title) LIKE :w{i} OR lower(body) LIKE :w{i})')
+            params[f'w{i}'] = f'%{word.lower()}%'
+        for i, tokens in enumerate(filters):
+            clauses.append('(' + ' OR '.join(f'filters LIKE :f{i}_{j}' for j in range(len(tokens))) + ')')
+            params.update({f'f{i}_{j}': f'% {token} %' for j, token in enumerate(tokens)})
+        where = ' AND '.join(clauses)
+        result['ranked'] = False
+        order = 'rowid'
+
+    rows = connection.execute(
+        text(f'SELECT rowid, title, body, department_id FROM {TABLE} WHERE {where} '
+             f'ORDER BY {order} LIMIT :limit OFFSET :offset'),
+        params
+    ).all()
+    result['results'] = [{
+        'kind': _KIND_NAMES[rowid % _KIND_COUNT],
+        'id': rowid // _KIND_COUNT,
+        'title': title,
+        'detail': body,
+        'department_id': department_id
+    } for rowid, title, body, department_id in rows[:per_page]]
+    result['has_next'] = len(rows) > per_page
+    return result
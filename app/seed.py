@@ -0,0 +1,251 @@
+"""Synthetic large-organization generator for scale testing.
+
+At scale 1.0 this builds 10k departments, 100k users, 500k resources and
+20k facilities. The department tree has the requested depth and its fan-out
+grows towards the leaves. Every department has a head who reports to the
+head of the parent department, and team leads sit between heads and
+everyone else, so manager chains run as deep as the tree. Statuses follow a
+fixed realistic mix.
+
+All rows are generated from one seeded RNG with ids assigned up front and
+written with batched multi-row INSERTs. Every account shares one
+precomputed password hash. The same seed therefore always produces the same
+database, and a full-scale run, search index included, finishes in under a
+minute on a laptop.
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, func, select, update
+
+from app import db
+from app.cache import invalidate
+from app.hierarchy import rebuild_department_tree
+from app.models import User, Department, Resource, Facility
+from app.passwords import hash_passwords
+from app.search import rebuild_search_index
+from app.stats import rebuild_counters
+from app.validation import RESOURCE_TYPES
+
+BASE_COUNTS = {
+    'departments': 10_000,
+    'users': 100_000,
+    'resources': 500_000,
+    'facilities': 20_000
+}
+DEFAULT_DEPTH = 6
+DEFAULT_SEED = 42
+DEFAULT_PASSWORD = 'password'
+BATCH_SIZE = 10_000
+
+# One team lead per this many regular members of a department
+TEAM_SIZE = 8
+
+RESOURCE_STATUSES = (('available', 55), ('in_use', 35), ('maintenance', 8), ('retired', 2))
+FACILITY_TYPES = ('MEETING_ROOM', 'OFFICE', 'LAB', 'WAREHOUSE')
+FACILITY_STATUSES = (('available', 80), ('in_use', 15), ('maintenance', 5))
+INACTIVE_USER_PERCENT = 3
+
+
+class SeedError(RuntimeError):
+    pass
+
+
+def scaled_counts(scale):
+    counts = {kind: max(1, round(count * scale)) for kind, count in BASE_COUNTS.items()}
+    # Every department needs a head, plus the master admin
+    counts['users'] = max(counts['users'], counts['departments'] + 1)
+    return counts
+
+
+def _weighted(rng, choices, k):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights, k=k)
+
+
+def _level_sizes(count, depth):
+    """Departments per level, growing geometrically from a handful of top-level organizations"""
+    depth = max(1, min(depth, count))
+    ratio = count ** (1 / depth)
+    weights = [ratio ** level for level in range(1, depth + 1)]
+    sizes = [max(1, round(count * w / sum(weights))) for w in weights]
+    sizes[-1] = max(1, sizes[-1] + count - sum(sizes))
+    return sizes
+
+
+def _departments(count, depth, rng):
+    """Return (rows, levels); ids are assigned level by level so parents precede children"""
+    rows, levels = [], []
+    next_id = 1
+    for level, size in enumerate(_level_sizes(count, depth)):
+        current = []
+        for _ in range(size):
+            parent_id = rng.choice(levels[-1]) if levels else None
+            kind = 'Organization' if parent_id is None else 'Department'
+            rows.append({
+                'id': next_id,
+                'name': f'{kind} {next_id}',
+                'description': f'Level {level + 1} {kind.lower()}',
+                'parent_id': parent_id
+            })
+            current.append(next_id)
+            next_id += 1
+        levels.append(current)
+    return rows, levels
+
+
+def _users(counts, departments, password, rng, now):
+    """Return (rows, heads, members): heads maps department -> head user id, members department -> user ids"""
+    parent_of = {d['id']: d['parent_id'] for d in departments}
+
+    def user(id_, username, role, department_id, manager_id):
+        return {
+            'id': id_,
+            'username': username,
+            'email': f'{username}@example.com',
+            'password': password,
+            'role': role,
+            'department_id': department_id,
+            'manager_id': manager_id,
+            'join_date': now - timedelta(days=rng.randint(0, 5 * 365), seconds=rng.randint(0, 86399)),
+            'is_active': rng.randrange(100) >= INACTIVE_USER_PERCENT
+        }
+
+    rows = [user(1, 'masteradmin', 'MASTER_ADMIN', None, None)]
+    rows[0]['email'] = 'master@example.com'
+    rows[0]['is_active'] = True
+
+    # Heads, in department order so every manager is inserted before their reports
+    heads = {}
+    for dept in departments:
+        id_ = len(rows) + 1
+        parent_id = parent_of[dept['id']]
+        if parent_id is None:
+            rows.append(user(id_, f'orgadmin{id_}', 'ORG_ADMIN', dept['id'], 1))
+        else:
+            rows.append(user(id_, f'deptadmin{id_}', 'DEPT_ADMIN', dept['id'], heads[parent_id]))
+        rows[-1]['is_active'] = True
+        heads[dept['id']] = id_
+
+    dept_ids = [d['id'] for d in departments]
+    assigned = sorted(rng.choices(dept_ids, k=counts['users'] - len(rows)))
+    members = {dept_id: [head_id] for dept_id, head_id in heads.items()}
+    position = 0
+    while position < len(assigned):
+        dept_id = assigned[position]
+        end = position
+        while end < len(assigned) and assigned[end] == dept_id:
+            end += 1
+        size = end - position
+        leads = []
+        for i in range(size):
+            id_ = len(rows) + 1
+            if i < size // (TEAM_SIZE + 1):
+                rows.append(user(id_, f'lead{id_}', 'REGULAR_USER', dept_id, heads[dept_id]))
+                leads.append(id_)
+            else:
+                rows.append(user(id_, f'user{id_}', 'REGULAR_USER', dept_id, rng.choice(leads) if leads else heads[dept_id]))
+            members[dept_id].append(id_)
+        position = end
+    return rows, heads, members
+
+
+def _resources(count, dept_ids, members, rng, now):
+    statuses = _weighted(rng, RESOURCE_STATUSES, count)
+    for i in range(count):
+        dept_id = rng.choice(dept_ids)
+        type_ = rng.choice(RESOURCE_TYPES)
+        yield {
+            'id': i + 1,
+            'name': f'{type_.title()} {i + 1:06d}',
+            'type': type_,
+            'status': statuses[i],
+            'department_id': dept_id,
+            'assigned_to_id': rng.choice(members[dept_id]) if statuses[i] == 'in_use' else None,
+            'created_at': now - timedelta(days=rng.randint(0, 3 * 365), seconds=rng.randint(0, 86399))
+        }
+
+
+def _facilities(count, dept_ids, rng, now):
+    statuses = _weighted(rng, FACILITY_STATUSES, count)
+    for i in range(count):
+        type_ = rng.choice(FACILITY_TYPES)
+        yield {
+            'id': i + 1,
+            'name': f'{type_.replace("_", " ").title()} {i + 1:05d}',
+            'type': type_,
+            'capacity': rng.choice((4, 6, 8, 12, 20, 50)) if type_ != 'WAREHOUSE' else None,
+            'location': f'Building {rng.randint(1, 40)}, Floor {rng.randint(0, 12)}',
+            'status': statuses[i],
+            'department_id': rng.choice(dept_ids),
+            'created_at': now - timedelta(days=rng.randint(0, 5 * 365))
+        }
+
+
+def _insert(model, rows):
+    # Core executemany on the table: no ORM bookkeeping per row
+    connection = db.session.connection()
+    statement = model.__table__.insert()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            connection.execute(statement, batch)
+            batch = []
+    if batch:
+        connection.execute(statement, batch)
+
+
+def seed_organization(scale=1.0, depth=DEFAULT_DEPTH, seed=DEFAULT_SEED, password=DEFAULT_PASSWORD, on_step=None):
+    """Fill an empty database with a synthetic organization; returns {kind: rows}
+
+    on_step, if given, is called with (step name, seconds) after each stage.
+    """
+    if db.session.scalar(select(func.count()).select_from(User)) or \
+            db.session.scalar(select(func.count()).select_from(Department)):
+        raise SeedError('The database already has users or departments; recreate it first')
+
+    rng = random.Random(seed)
+    counts = scaled_counts(scale)
+    # Fixed reference time so the same seed gives the same dates
+    now = datetime(2024, 1, 1)
+
+    def step(name, started):
+        if on_step:
+            on_step(name, time.perf_counter() - started)
+        return time.perf_counter()
+
+    started = time.perf_counter()
+    hashed = hash_passwords([password], rounds=current_app.config.get('BCRYPT_LOG_ROUNDS', 12))[0]
+    started = step('password hash', started)
+
+    departments, levels = _departments(counts['departments'], depth, rng)
+    _insert(Department, departments)
+    started = step('departments', started)
+
+    users, heads, members = _users(counts, departments, hashed, rng, now)
+    _insert(User, users)
+    db.session.execute(
+        update(Department.__table__).where(Department.__table__.c.id == bindparam('dept_id')).values(head_id=bindparam('new_head_id')),
+        [{'dept_id': dept_id, 'new_head_id': head_id} for dept_id, head_id in heads.items()]
+    )
+    started = step('users', started)
+
+    dept_ids = [d['id'] for d in departments]
+    _insert(Resource, _resources(counts['resources'], dept_ids, members, rng, now))
+    started = step('resources', started)
+    _insert(Facility, _facilities(counts['facilities'], dept_ids, rng, now))
+    started = step('facilities', started)
+
+    # Bulk inserts skip the mapper events and flush hooks, so build the derived tables here
+    rebuild_department_tree()
+    rebuild_counters()
+    rebuild_search_index()
+    db.session.commit()
+    invalidate('user', 'department', 'resource', 'facility')
+    step('department tree, counters and search index', started)
+
+    counts['depth'] = len(levels)
+    return counts
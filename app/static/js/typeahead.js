@@ -0,0 +1,25 @@
+// Autocomplete for the inputs rendered by TypeaheadField: suggestions come from
+// /typeahead/<kind>?q=..., the chosen id goes into the hidden input next to the box.
+document.querySelectorAll('input[data-typeahead]').forEach(input => {
+    const target = document.getElementById(input.dataset.target);
+    const options = document.getElementById(input.getAttribute('list'));
+    let ids = new Map();
+    let timer = null;
+
+    input.addEventListener('input', () => {
+        // Typed text only counts once it matches a suggestion; clearing the box clears the id
+        target.value = ids.get(input.value) || '';
+        clearTimeout(timer);
+        if (!input.value.trim() || ids.has(input.value)) {
+            return;
+        }
+        timer = setTimeout(() => {
+            fetch(input.dataset.typeahead + '?q=' + encodeURIComponent(input.value))
+                .then(response => response.json())
+                .then(data => {
+                    ids = new Map(data.results.map(result => [result.label, result.id]));
+                    options.replaceChildren(...data.results.map(result => new Option(result.label)));
+                });
+        }, 150);
+    });
+});
@@ -0,0 +1,191 @@
+"""Maintained counters for the admin dashboard.
+
+stat_counter holds one row per (dimension, value), e.g. ('resources.status',
+'available') -> 42, plus a '' key for each table's total. Counters are
+adjusted in the same transaction as the write that changes them: ORM writes
+from Session flush events, bulk imports through apply_rows(). Reading a
+breakdown is a primary-key range lookup instead of a table scan.
+rebuild_counters() and verify_counters() recompute everything from the
+tables for drift after writes that bypassed both paths.
+"""
+from collections import defaultdict
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import User, Department, Resource, Facility, StatCounter
+
+NO_DEPARTMENT = 'none'
+
+# Model -> (counter prefix, attributes broken down by)
+COUNTED = {
+    User: ('users', ('role', 'department_id')),
+    Department: ('departments', ()),
+    Resource: ('resources', ('status', 'department_id')),
+    Facility: ('facilities', ('status', 'department_id'))
+}
+
+_DIMENSION_NAMES = {'department_id': 'department'}
+
+
+def _counter_name(prefix, attr):
+    return f'{prefix}.{_DIMENSION_NAMES.get(attr, attr)}'
+
+
+def _key(value):
+    return NO_DEPARTMENT if value is None else str(value)
+
+
+def _row_deltas(model, values, sign, deltas):
+    """Add sign to the total and every breakdown for one row; values maps attr -> value"""
+    prefix, attrs = COUNTED[model]
+    deltas[(prefix, '')] += sign
+    for attr in attrs:
+        deltas[(_counter_name(prefix, attr), _key(values[attr]))] += sign
+
+
+def _current_values(obj, attrs):
+    return {attr: getattr(obj, attr) for attr in attrs}
+
+
+def _change_deltas(obj, deltas):
+    prefix, attrs = COUNTED[type(obj)]
+    state = inspect(obj)
+    for attr in attrs:
+        history = state.attrs[attr].history
+        if not history.has_changes():
+            continue
+        for old in history.deleted:
+            deltas[(_counter_name(prefix, attr), _key(old))] -= 1
+        for new in history.added:
+            deltas[(_counter_name(prefix, attr), _key(new))] += 1
+
+
+def _column_default(model, attr):
+    default = model.__table__.c[attr].default
+    return default.arg if default is not None and default.is_scalar else None
+
+
+def apply_rows(model, rows, connection=None, sign=1):
+    """Count rows written with a bulk INSERT (sign=-1 uncounts their old values); call in the writing transaction"""
+    if model not in COUNTED:
+        return
+    attrs = COUNTED[model][1]
+    defaults = {attr: _column_default(model, attr) for attr in attrs}
+    deltas = defaultdict(int)
+    for row in rows:
+        _row_deltas(model, {attr: row.get(attr, defaults[attr]) for attr in attrs}, sign, deltas)
+    apply_deltas(deltas, connection)
+
+
+def _upsert(dialect_name):
+    table = StatCounter.__table__
+    for dialect in (sqlite, postgresql):
+        if dialect_name == dialect.dialect.name:
+            stmt = dialect.insert(table)
+            return stmt.on_conflict_do_update(
+                index_elements=[table.c.name, table.c.key],
+                set_={'value': table.c.value + stmt.excluded.value}
+            )
+    return None
+
+
+def apply_deltas(deltas, connection=None):
+    connection = connection or db.session.connection()
+    rows = [{'name': name, 'key': key, 'value': delta} for (name, key), delta in deltas.items() if delta]
+    if not rows:
+        return
+    upsert = _upsert(connection.dialect.name)
+    if upsert is not None:
+        connection.execute(upsert, rows)
+        return
+    table = StatCounter.__table__
+    for row in rows:
+        updated = connection.execute(
+            update(table)
+            .where(table.c.name == row['name'], table.c.key == row['key'])
+            .values(value=table.c.value + row['value'])
+        ).rowcount
+        if not updated:
+            connection.execute(table.insert().values(**row))
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_deletes(session, flush_context, instances):
+    # Read deleted rows' values now; after the flush they can no longer be loaded
+    deltas = session.info.setdefault('stat_deltas', defaultdict(int))
+    for obj in session.deleted:
+        if type(obj) in COUNTED:
+            _row_deltas(type(obj), _current_values(obj, COUNTED[type(obj)][1]), -1, deltas)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_flush(session, flush_context):
+    deltas = session.info.pop('stat_deltas', None) or defaultdict(int)
+    for obj in session.new:
+        if type(obj) in COUNTED:
+            _row_deltas(type(obj), _current_values(obj, COUNTED[type(obj)][1]), 1, deltas)
+    for obj in session.dirty:
+        if type(obj) in COUNTED and session.is_modified(obj, include_collections=False):
+            _change_deltas(obj, deltas)
+    apply_deltas(deltas, session.connection())
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop('stat_deltas', None)
+
+
+def counters(*names, keys=None):
+    """Return {name: {key: value}} for the given counter names (all when none are given), limited to keys if given"""
+    query = select(StatCounter.name, StatCounter.key, StatCounter.value).where(StatCounter.value != 0)
+    if names:
+        query = query.where(StatCounter.name.in_(names))
+    if keys is not None:
+        query = query.where(StatCounter.key.in_(keys))
+    result = defaultdict(dict)
+    for name, key, value in db.session.execute(query):
+        result[name][key] = value
+    return result
+
+
+def compute_counters():
+    """Count everything from the tables: {(name, key): value}"""
+    expected = defaultdict(int)
+    for model, (prefix, attrs) in COUNTED.items():
+        expected[(prefix, '')] = db.session.scalar(select(func.count()).select_from(model)) or 0
+        for attr in attrs:
+            column = getattr(model, attr)
+            for value, count in db.session.execute(select(column, func.count()).group_by(column)):
+                expected[(_counter_name(prefix, attr), _key(value))] += count
+    return expected
+
+
+def _stored_counters():
+    return {(name, key): value for name, key, value in
+            db.session.execute(select(StatCounter.name, StatCounter.key, StatCounter.value))}
+
+
+def verify_counters():
+    """Return [(name, key, stored, actual)] for every counter that has drifted"""
+    expected = compute_counters()
+    stored = _stored_counters()
+    drift = []
+    for name, key in sorted(set(expected) | set(stored)):
+        actual, value = expected.get((name, key), 0), stored.get((name, key), 0)
+        if actual != value:
+            drift.append((name, key, value, actual))
+    return drift
+
+
+def rebuild_counters():
+    """Replace every counter with a fresh count; returns the number of counters written"""
+    expected = compute_counters()
+    connection = db.session.connection()
+    connection.execute(StatCounter.__table__.delete())
+    rows = [{'name': name, 'key': key, 'value': value} for (name, key), value in expected.items()]
+    if rows:
+        connection.execute(StatCounter.__table__.insert(), rows)
+    return len(rows)
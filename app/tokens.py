@@ -0,0 +1,194 @@
+"""Bearer tokens for the JSON API.
+
+Access tokens are short-lived HS256 JWTs carrying the user's id, role,
+department and manager. A request to /api/... with "Authorization: Bearer
+<token>" is authenticated from the token alone: signature, expiry and an
+in-memory revocation list are checked, and current_user becomes an Identity
+built from the claims, with no database access. Refresh tokens live longer,
+are only accepted by /api/auth/refresh-token, and are rotated on use.
+
+The revocation list holds revoked token ids until they expire, plus a
+per-user cutoff. Committing a change to a user's role, department, manager
+or active flag (or deleting the user) revokes every token issued to them
+before the commit; bulk writes that bypass the ORM call revoke_user_tokens(). The list is per process, so another process keeps
+accepting such tokens until they expire; keep JWT_ACCESS_TOKEN_TTL short.
+"""
+import threading
+import time
+import uuid
+
+import jwt
+from flask import current_app, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app import login_manager
+from app.identity import Identity
+from app.models import User
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+# Changes that make the claims in a user's outstanding tokens wrong
+_CLAIM_ATTRS = ('role', 'department_id', 'manager_id', 'is_active')
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class RevocationList:
+    def __init__(self):
+        self._tokens = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, claims):
+        with self._lock:
+            self._tokens[claims['jti']] = claims['exp']
+            self._prune()
+
+    def revoke_user(self, user_id, until):
+        """Reject tokens issued to user_id before now; the entry is kept until `until`"""
+        with self._lock:
+            self._users[user_id] = (time.time(), until)
+            self._prune()
+
+    def is_revoked(self, claims):
+        with self._lock:
+            if claims['jti'] in self._tokens:
+                return True
+            cutoff = self._users.get(int(claims['sub']))
+            return cutoff is not None and claims['iat'] <= cutoff[0]
+
+    def _prune(self):
+        now = time.time()
+        for jti in [jti for jti, exp in self._tokens.items() if exp < now]:
+            del self._tokens[jti]
+        for user_id in [u for u, (_, until) in self._users.items() if until < now]:
+            del self._users[user_id]
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+
+
+revocations = RevocationList()
+
+
+def issue_token(user, kind=ACCESS):
+    """Signed token for user (a User or Identity); returns (token, claims)"""
+    config = current_app.config
+    now = time.time()
+    claims = {
+        'sub': str(user.id),
+        'typ': kind,
+        'role': user.role,
+        'dept': user.department_id,
+        'mgr': user.manager_id,
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': int(now + config['JWT_REFRESH_TOKEN_TTL' if kind == REFRESH else 'JWT_ACCESS_TOKEN_TTL'])
+    }
+    return jwt.encode(claims, config['JWT_SECRET_KEY'], algorithm=config['JWT_ALGORITHM']), claims
+
+
+def issue_token_pair(user):
+    access, claims = issue_token(user, ACCESS)
+    refresh, _ = issue_token(user, REFRESH)
+    return {
+        'token': access,
+        'refresh_token': refresh,
+        'token_type': 'Bearer',
+        'expires_in': claims['exp'] - int(claims['iat'])
+    }
+
+
+def decode_token(token, kind=ACCESS):
+    """Verified claims of a token of the given kind; raises InvalidToken"""
+    config = current_app.config
+    try:
+        claims = jwt.decode(token, config['JWT_SECRET_KEY'], algorithms=[config['JWT_ALGORITHM']],
+                            leeway=config['JWT_LEEWAY'], options={'require': ['sub', 'typ', 'jti', 'iat', 'exp']})
+    except jwt.PyJWTError as e:
+        raise InvalidToken(str(e))
+    if claims['typ'] != kind:
+        raise InvalidToken(f'Expected a {kind} token')
+    if revocations.is_revoked(claims):
+        raise InvalidToken('Token has been revoked')
+    return claims
+
+
+def bearer_token():
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def identity_from_claims(claims):
+    return Identity({
+        'id': int(claims['sub']),
+        'role': claims['role'],
+        'department_id': claims['dept'],
+        'manager_id': claims['mgr'],
+        'is_active': True
+    })
+
+
+@login_manager.request_loader
+def load_user_from_request(request):
+    if not request.path.startswith('/api/'):
+        return None
+    token = bearer_token()
+    if token is None:
+        return None
+    try:
+        return identity_from_claims(decode_token(token))
+    except InvalidToken:
+        return None
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_revocations(session, flush_context):
+    pending = session.info.setdefault('revoke_user_tokens', set())
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in _CLAIM_ATTRS):
+                pending.add(obj.id)
+    pending.update(obj.id for obj in session.deleted if isinstance(obj, User))
+
+
+def claims_changed(old, new):
+    """Whether going from user row old to new (dicts) makes the claims in their tokens wrong"""
+    return any(old.get(name) != new.get(name) for name in _CLAIM_ATTRS)
+
+
+def revoke_user_tokens(user_ids):
+    """Reject every token issued so far to user_ids"""
+    until = time.time() + current_app.config['JWT_REFRESH_TOKEN_TTL']
+    for user_id in user_ids:
+        revocations.revoke_user(user_id, until)
+
+
+@event.listens_for(Session, 'after_commit')
+def _revoke_on_commit(session):
+    user_ids = session.info.pop('revoke_user_tokens', None)
+    if user_ids:
+        revoke_user_tokens(user_ids)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop('revoke_user_tokens', None)
+
+
+def init_app(app):
+    app.config.setdefault('JWT_SECRET_KEY', app.config['SECRET_KEY'])
+    app.config.setdefault('JWT_ALGORITHM', 'HS256')
+    app.config.setdefault('JWT_ACCESS_TOKEN_TTL', 15 * 60)
+    app.config.setdefault('JWT_REFRESH_TOKEN_TTL', 7 * 24 * 60 * 60)
+    app.config.setdefault('JWT_LEEWAY', 10)
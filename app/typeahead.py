@@ -0,0 +1,345 @@
+"""In-memory prefix index behind the autocomplete fields on the admin forms.
+
+The user and department pickers used to embed every row as an <option>, so
+with 150k users one edit page was several megabytes. Each process now keeps
+sorted (key, id) lists - usernames and emails of all users and of admins,
+department names - and answers a prefix with a bisect and a short scan.
+
+Committed ORM changes are applied to the lists in place. Bulk writes that
+bypass the ORM announce themselves through app.cache.invalidate() with table
+tags and no row tags; they make the next lookup start a rebuild in the
+background, as does an index older than TYPEAHEAD_MAX_AGE, which bounds
+staleness for writes made by other processes. Lookups are answered from the
+old lists until the new ones are swapped in. Ids missing from the index are
+checked against the database before a form rejects them.
+
+Each user is indexed with their department, so matches and submitted ids
+are limited to the caller's scope whatever the kind. Users and admins are
+also kept in one list per department: a scoped lookup merges the lists of
+the departments in scope instead of filtering every match of a short prefix.
+"""
+import heapq
+import logging
+import threading
+import time
+import weakref
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app import db
+from app.cache import register_cache
+from app.models import User, Department
+from app.refdata import ADMIN_ROLES
+
+KINDS = ('users', 'admins', 'departments')
+USER_KINDS = ('users', 'admins')
+MAX_LIMIT = 50
+
+# A user's entry: the keys and label come from the first two, the kinds from the role
+_USER_COLUMNS = (User.username, User.email, User.role, User.department_id)
+
+_indexes = weakref.WeakSet()
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixIndex:
+    """Sorted (key, id) pairs; keys are lower-cased"""
+
+    def __init__(self, pairs=()):
+        self._pairs = sorted(pairs)
+
+    def __len__(self):
+        return len(self._pairs)
+
+    def add(self, key, id_):
+        insort(self._pairs, (key, id_))
+
+    def remove(self, key, id_):
+        i = bisect_left(self._pairs, (key, id_))
+        if i < len(self._pairs) and self._pairs[i] == (key, id_):
+            del self._pairs[i]
+
+    def pairs(self, prefix):
+        """(key, id) pairs whose key starts with prefix, in key order"""
+        pairs = self._pairs
+        i = bisect_left(pairs, (prefix,))
+        while i < len(pairs) and pairs[i][0].startswith(prefix):
+            yield pairs[i]
+            i += 1
+
+    def ids(self, prefix):
+        """ids whose key starts with prefix, in key order; an id matching on two keys comes twice"""
+        for _, id_ in self.pairs(prefix):
+            yield id_
+
+
+def _user_keys(values):
+    username, email = values[:2]
+    return {key.lower() for key in (username, email) if key}
+
+
+def _user_kinds(values):
+    return ('users', 'admins') if values[2] in ADMIN_ROLES else ('users',)
+
+
+def _user_label(values):
+    username, email = values[:2]
+    return f'{username} ({email})'
+
+
+class TypeaheadIndex:
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._stale = False
+        # Changes committed while a rebuild is reading, replayed onto its result
+        self._replay = None
+        self._users = {}
+        self._departments = {}
+        self._prefixes = {kind: PrefixIndex() for kind in KINDS}
+        # kind -> department id -> PrefixIndex of that department's users
+        self._by_department = {kind: {} for kind in USER_KINDS}
+        _indexes.add(self)
+
+    def mark_stale(self):
+        self._stale = True
+
+    def rebuild(self):
+        """Reload every user and department; returns the number of entries indexed"""
+        with self._lock:
+            if self._replay is not None:
+                return 0
+            self._replay = {}
+            self._stale = False
+        try:
+            # Read without the lock so lookups keep being answered from the old lists
+            users = {
+                id_: tuple(values) for id_, *values
+                in db.session.execute(select(User.id, *_USER_COLUMNS))
+            }
+            departments = dict(db.session.execute(select(Department.id, Department.name)).all())
+            pairs = {kind: [] for kind in KINDS}
+            department_pairs = {kind: defaultdict(list) for kind in USER_KINDS}
+            for id_, values in users.items():
+                for kind in _user_kinds(values):
+                    keys = [(key, id_) for key in _user_keys(values)]
+                    pairs[kind].extend(keys)
+                    department_pairs[kind][values[3]].extend(keys)
+            pairs['departments'] = [(name.lower(), id_) for id_, name in departments.items() if name]
+            prefixes = {kind: PrefixIndex(pairs[kind]) for kind in KINDS}
+            by_department = {
+                kind: {dept_id: PrefixIndex(dept_pairs) for dept_id, dept_pairs in department_pairs[kind].items()}
+                for kind in USER_KINDS
+            }
+        except Exception:
+            with self._lock:
+                self._replay = None
+                self._stale = True
+            raise
+        with self._lock:
+            self._users, self._departments, self._prefixes = users, departments, prefixes
+            self._by_department = by_department
+            self._built_at = time.monotonic()
+            replay, self._replay = self._replay, None
+            self.apply(replay)
+        return len(users) + len(departments)
+
+    def _ensure(self):
+        if self._built_at is None:
+            with self._lock:
+                if self._built_at is None:
+                    self.rebuild()
+        elif (self._stale or time.monotonic() - self._built_at > self.max_age) and self._replay is None:
+            # Refreshes happen in the background; a rebuild takes about a second per 150k users
+            app = current_app._get_current_object()
+            threading.Thread(target=self._rebuild_in, args=(app,), name='typeahead-rebuild', daemon=True).start()
+
+    def _rebuild_in(self, app):
+        with app.app_context():
+            try:
+                self.rebuild()
+            except Exception:
+                logger.exception('Rebuilding the typeahead index failed')
+            finally:
+                db.session.remove()
+
+    def apply(self, changes):
+        """Apply {(model, id): values or None for deleted} from a committed session"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.update(changes)
+            if self._built_at is None:
+                return
+            for (model, id_), values in changes.items():
+                if model is User:
+                    self._put_user(id_, values)
+                else:
+                    self._put_department(id_, values)
+
+    def _put_user(self, user_id, values):
+        old = self._users.pop(user_id, None)
+        if old == values:
+            self._users[user_id] = values
+            return
+        if old is not None:
+            for kind in _user_kinds(old):
+                for key in _user_keys(old):
+                    self._prefixes[kind].remove(key, user_id)
+                    self._by_department[kind][old[3]].remove(key, user_id)
+        if values is not None:
+            self._users[user_id] = values
+            for kind in _user_kinds(values):
+                department = self._by_department[kind].setdefault(values[3], PrefixIndex())
+                for key in _user_keys(values):
+                    self._prefixes[kind].add(key, user_id)
+                    department.add(key, user_id)
+
+    def _put_department(self, dept_id, name):
+        old = self._departments.pop(dept_id, None)
+        if old:
+            self._prefixes['departments'].remove(old.lower(), dept_id)
+        if name is not None:
+            self._departments[dept_id] = name
+            if name:
+                self._prefixes['departments'].add(name.lower(), dept_id)
+
+    def _department(self, kind, id_):
+        if kind == 'departments':
+            return id_
+        values = self._users.get(id_)
+        return values[3] if values is not None else None
+
+    def _label(self, kind, id_):
+        if kind == 'departments':
+            return self._departments.get(id_)
+        values = self._users.get(id_)
+        if values is None or kind not in _user_kinds(values):
+            return None
+        return _user_label(values)
+
+    def match(self, kind, query, limit=10, departments=None):
+        """[(id, label)] for up to limit entries of kind starting with query, in alphabetical order
+
+        departments, if given, is a set of department ids: only those
+        departments, or the users in them, are matched.
+        """
+        prefix = query.strip().lower()
+        if not prefix:
+            return []
+        self._ensure()
+        results, seen = [], set()
+        with self._lock:
+            for id_ in self._candidates(kind, prefix, departments):
+                if id_ not in seen:
+                    seen.add(id_)
+                    results.append((id_, self._label(kind, id_)))
+                    if len(results) >= limit:
+                        break
+        return results
+
+    def _candidates(self, kind, prefix, departments):
+        """ids of kind starting with prefix in key order, only looking at the departments given"""
+        if departments is None:
+            return self._prefixes[kind].ids(prefix)
+        if kind == 'departments':
+            names = (((self._departments.get(d) or '').lower(), d) for d in departments)
+            return (d for _, d in sorted(pair for pair in names if pair[0].startswith(prefix)))
+        indexes = self._by_department[kind]
+        merged = heapq.merge(*(indexes[d].pairs(prefix) for d in departments if d in indexes))
+        return (id_ for _, id_ in merged)
+
+    def label(self, kind, id_):
+        """Display label for an id of kind, or None if there is no such entry"""
+        self._ensure()
+        with self._lock:
+            label = self._label(kind, id_)
+        return label if label is not None else _load_label(kind, id_)
+
+    def department(self, kind, id_):
+        """The department of a user, or a department's own id; None if it has none"""
+        self._ensure()
+        with self._lock:
+            if kind == 'departments' or id_ in self._users:
+                return self._department(kind, id_)
+        return db.session.scalar(select(User.department_id).where(User.id == id_))
+
+
+def _load_label(kind, id_):
+    # Rows committed by another process since the last rebuild
+    if kind == 'departments':
+        return db.session.scalar(select(Department.name).where(Department.id == id_))
+    row = db.session.execute(select(*_USER_COLUMNS).where(User.id == id_)).first()
+    if row is None or kind not in _user_kinds(tuple(row)):
+        return None
+    return _user_label(tuple(row))
+
+
+def typeahead_index():
+    return current_app.extensions['typeahead']
+
+
+def match(kind, query, limit=10, scope=None):
+    """Top matches for query, limited to the departments and users in scope (an app.scope.Scope) if given"""
+    departments = scope.department_ids() if scope is not None else None
+    return typeahead_index().match(kind, query, max(1, min(limit, MAX_LIMIT)), departments)
+
+
+def label(kind, id_):
+    return typeahead_index().label(kind, id_)
+
+
+def department(kind, id_):
+    return typeahead_index().department(kind, id_)
+
+
+class _BulkWrites:
+    """Registered like a cache: invalidate() with a table tag but no row tags means rows we never saw"""
+
+    TABLES = (User.__table__.name, Department.__table__.name)
+
+    def bump(self, *tags):
+        for table in self.TABLES:
+            if table in tags and not any(tag.startswith(table + ':') for tag in tags):
+                for index in list(_indexes):
+                    index.mark_stale()
+                return
+
+
+register_cache(_BulkWrites())
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if type(obj) is User:
+            values = None if obj in session.deleted else (obj.username, obj.email, obj.role, obj.department_id)
+        elif type(obj) is Department:
+            values = None if obj in session.deleted else obj.name
+        else:
+            continue
+        session.info.setdefault('typeahead_changes', {})[(type(obj), obj.id)] = values
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_on_commit(session):
+    changes = session.info.pop('typeahead_changes', None)
+    if changes and has_app_context():
+        index = current_app.extensions.get('typeahead')
+        if index is not None:
+            index.apply(changes)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop('typeahead_changes', None)
+
+
+def init_app(app):
+    app.config.setdefault('TYPEAHEAD_MAX_AGE', 300)
+    app.extensions['typeahead'] = TypeaheadIndex(app.config['TYPEAHEAD_MAX_AGE'])
@@ -0,0 +1,145 @@
+"""Idempotent imports keyed on natural keys.
+
+NATURAL_KEYS names the columns that identify a row outside the database:
+email for users, name and parent for departments, name and department for
+resources and facilities. Each is backed by a unique index (migration 0005),
+so re-sending a whole roster can be left to the database: a chunk is copied
+into a temporary staging table, classified with two indexed joins and
+written by one INSERT ... SELECT ... ON CONFLICT DO UPDATE whose WHERE
+clause skips rows that are already identical. A resync that changes a
+hundred rows writes a hundred rows.
+
+The same keys guard the ORM write paths through key_in_use(), so forms and
+the API report a clash instead of failing on the index.
+"""
+from sqlalchemy import Column, Integer, MetaData, Table, and_, bindparam, func, literal_column, or_, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.models import User, Department, Resource, Facility
+
+NATURAL_KEYS = {
+    User: ('email',),
+    Department: ('name', 'parent_id'),
+    Resource: ('name', 'department_id'),
+    Facility: ('name', 'department_id')
+}
+
+# Top-level departments have no parent; their index compares COALESCE(parent_id, 0)
+_COALESCED = {(Department, 'parent_id')}
+
+_POSITION = '_position'
+
+
+def _key_expressions(model, table):
+    return [
+        func.coalesce(table.c[name], literal_column('0')) if (model, name) in _COALESCED else table.c[name]
+        for name in NATURAL_KEYS[model]
+    ]
+
+
+def key_in_use(model, values, exclude_id=None):
+    """Whether another row of model already has the natural key in values (a dict of key columns)"""
+    table = model.__table__
+    conditions = [
+        expression == (values.get(name) if (model, name) not in _COALESCED else values.get(name) or 0)
+        for name, expression in zip(NATURAL_KEYS[model], _key_expressions(model, table))
+    ]
+    query = select(table.c.id).where(*conditions)
+    if exclude_id is not None:
+        query = query.where(table.c.id != exclude_id)
+    return db.session.scalar(query.limit(1)) is not None
+
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE ... WHERE; MySQL's ON DUPLICATE KEY UPDATE can't skip unchanged rows
+_UPSERT_DIALECTS = (sqlite, postgresql)
+
+
+def upsert_unsupported():
+    """Why upsert imports can't run on the configured database, or None if they can"""
+    name = db.engine.dialect.name
+    if any(name == dialect.dialect.name for dialect in _UPSERT_DIALECTS):
+        return None
+    return f'Updating existing rows needs SQLite or PostgreSQL; this database is {name}.'
+
+
+def _insert(connection):
+    for dialect in _UPSERT_DIALECTS:
+        if connection.dialect.name == dialect.dialect.name:
+            return dialect.insert
+    raise NotImplementedError(f'Upsert imports need SQLite or PostgreSQL, not {connection.dialect.name}')
+
+
+def _staging_table(model, columns):
+    table = model.__table__
+    return Table(
+        f'import_staging_{table.name}', MetaData(),
+        Column(_POSITION, Integer, primary_key=True),
+        *(Column(name, table.c[name].type) for name in columns),
+        prefixes=['TEMPORARY']
+    )
+
+
+def upsert_rows(model, rows, update_columns, prepare_new=None, connection=None):
+    """Insert rows of model whose natural key is new and update those whose content changed
+
+    update_columns are the columns an existing row takes from its import row.
+    prepare_new, if given, is called with the rows about to be inserted and
+    may fill in further columns (e.g. passwords); they must be keys of every
+    row already, so the staging table has a place for them.
+
+    Returns (inserted rows, [(id, old row, import row)] for the updated ones,
+    the old row holding every column as it was); every other row was
+    unchanged. Call in the importing transaction.
+    """
+    connection = connection or db.session.connection()
+    insert = _insert(connection)
+    target = model.__table__
+    columns = list(rows[0])
+    staging = _staging_table(model, columns)
+    # Temporary tables belong to a connection, so each chunk makes its own
+    staging.create(connection, checkfirst=True)
+    connection.execute(staging.delete())
+    connection.execute(staging.insert(), [{_POSITION: i, **row} for i, row in enumerate(rows)])
+
+    matches = [a == b for a, b in zip(_key_expressions(model, target), _key_expressions(model, staging))]
+    new = list(connection.scalars(
+        select(staging.c[_POSITION]).where(~select(target.c.id).where(*matches).exists())
+    ))
+    updated = []
+    if update_columns:
+        differs = or_(*(target.c[name].is_distinct_from(staging.c[name]) for name in update_columns))
+        query = select(target, staging.c[_POSITION]).select_from(staging).join(target, and_(*matches)).where(differs)
+        updated = [
+            (row['id'], {column.name: row[column.name] for column in target.c}, rows[row[_POSITION]])
+            for row in connection.execute(query).mappings()
+        ]
+
+    inserted = [rows[i] for i in new]
+    if inserted and prepare_new:
+        prepare_new(inserted)
+        connection.execute(
+            staging.update()
+            .where(staging.c[_POSITION] == bindparam('_staged'))
+            .values({name: bindparam(f'_new_{name}') for name in columns}),
+            [{'_staged': i, **{f'_new_{name}': rows[i][name] for name in columns}} for i in new]
+        )
+
+    if inserted or updated:
+        # The WHERE keeps SQLite from reading ON CONFLICT as a join constraint
+        statement = insert(target).from_select(
+            columns, select(*(staging.c[name] for name in columns)).where(true()).order_by(staging.c[_POSITION])
+        )
+        keys = _key_expressions(model, target)
+        if update_columns:
+            excluded = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=keys,
+                set_={name: excluded[name] for name in update_columns},
+                where=or_(*(target.c[name].is_distinct_from(excluded[name]) for name in update_columns))
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=keys)
+        connection.execute(statement)
+    staging.drop(connection)
+    return inserted, updated
@@ -0,0 +1,550 @@
+"""Whole-file validation for CSV imports, vectorized with pandas.
+
+validate_file() checks every row of an upload, a chunk at a time, before
+anything is written: required columns and values, formats (emails, integers, roles,
+statuses, resource types, lengths), references to existing departments and users, duplicates
+inside the file and, for departments, parent cycles. References are checked
+with one indexed `id IN (...)` query per batch of distinct ids rather than by
+loading whole tables.
+
+Problems come back as a ValidationReport: a compact table with one row per
+problem (line, column, error code, offending value) plus counts per code,
+which can be written out as CSV for download. Nothing is rejected by message
+text, so a million bad rows is a CSV of codes, not megabytes of sentences.
+
+Checks that span chunks carry compact state from one to the next: 64-bit
+hashes of the keys seen so far for duplicates and, for a departments file
+with ids, the ids and parents of its rows for references and cycles.
+
+A departments file may carry an id column giving each row's id; parents can
+then refer to other rows of the same file, in any order. Such files are
+checked for parent cycles and streamed to the importer parents first.
+Upsert imports (see app.upsert) match rows by natural key instead, so they
+take no id column, and a user row may not take a username held by another
+account.
+
+validate_bundle() checks the files of a bundle import (see app.bundle)
+together: rows name rows of the other files through their key column, so
+each reference is checked against the referenced file as well as the
+database, and manager chains are checked for cycles like parent chains.
+"""
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from app import db
+from app.importer import ImportValidationError, DEFAULT_CHUNK_SIZE
+from app.models import User, Department, Resource, Facility
+from app.refdata import ROLES
+
+ID_BATCH_SIZE = 10_000
+# Rows per chunk read by validate_file()
+VALIDATION_CHUNK_SIZE = 100_000
+MAX_VALUE_LENGTH = 100
+REPORT_COLUMNS = ['line', 'column', 'code', 'value']
+
+# Bundle columns naming a row of a file by its key -> (id column they stand in for, kind of that file)
+KEY_REFERENCES = {
+    'departments': {'parent_key': ('parent_id', 'departments'), 'head_key': ('head_id', 'users')},
+    'users': {'department_key': ('department_id', 'departments'), 'manager_key': ('manager_id', 'users')},
+    'resources': {'department_key': ('department_id', 'departments'), 'assigned_to_key': ('assigned_to_id', 'users')},
+    'facilities': {'department_key': ('department_id', 'departments')}
+}
+
+RESOURCE_STATUSES = ('available', 'in_use', 'maintenance', 'retired')
+# As offered by ResourceForm
+RESOURCE_TYPES = ('HARDWARE', 'SOFTWARE', 'FACILITY', 'OTHER')
+
+_EMAIL = r'[^@\s]+@[^@\s]+\.[^@\s]+'
+
+
+class ValidationReport:
+    def __init__(self, rows_checked, errors):
+        self.rows_checked = rows_checked
+        # Bundle reports say which file each problem is in
+        self.columns = (['file'] if 'file' in errors.columns else []) + REPORT_COLUMNS
+        self.row_columns = self.columns[:self.columns.index('line') + 1]
+        self.errors = errors.sort_values(self.row_columns + ['column'], kind='stable').reset_index(drop=True)
+
+    def __bool__(self):
+        return not self.errors.empty
+
+    @property
+    def counts(self):
+        return {code: int(n) for code, n in self.errors['code'].value_counts().sort_index().items()}
+
+    @property
+    def rows_with_errors(self):
+        return len(self.errors.loc[self.errors['line'] > 1, self.row_columns].drop_duplicates())
+
+    def summary(self):
+        """Short lines for a job's error message"""
+        lines = [f'{self.rows_with_errors} of {self.rows_checked} rows failed validation']
+        lines.extend(f'{code}: {n}' for code, n in self.counts.items())
+        return lines
+
+    def to_dict(self, sample=20):
+        return {
+            'rows_checked': self.rows_checked,
+            'rows_with_errors': self.rows_with_errors,
+            'counts': self.counts,
+            'sample': self.errors.head(sample).to_dict('records')
+        }
+
+    def write_csv(self, path):
+        self.errors.to_csv(path, index=False, columns=self.columns, quoting=csv.QUOTE_MINIMAL)
+
+    @classmethod
+    def combine(cls, reports):
+        """One report for a bundle from {file name: report}"""
+        errors = [report.errors.assign(file=name) for name, report in reports.items()]
+        return cls(sum(report.rows_checked for report in reports.values()),
+                   pd.concat(errors, ignore_index=True)[['file'] + REPORT_COLUMNS])
+
+
+class _Checker:
+    """Accumulates problems for one file, fed to it as frames in file order
+
+    Every check is a whole-column operation on the current frame; checks
+    that span frames keep what they need of earlier frames and finish() settles
+    the rest once the whole file has been seen.
+    """
+
+    def __init__(self, mode='insert', kind=None, keys=None):
+        self.df = None
+        # Rows of the file before the current frame
+        self.offset = 0
+        self.mode = mode
+        self.kind = kind
+        # For a bundle file, {kind: pd.Index of the keys of that kind's file}
+        self.keys = keys
+        self.found = []
+        # duplicates() key -> sorted hashes of the keys of earlier frames
+        self.seen = {}
+        # Per frame (ids, parents, parent not in the database) of a departments file with ids
+        self.tree = []
+        self.tree_column = None
+        # Depth of each row of a departments file with ids, once finished
+        self.depths = None
+
+    def start(self, df):
+        """Move on to the next frame of the file"""
+        if self.df is not None:
+            self.offset += len(self.df)
+        self.df = df
+
+    @property
+    def rows(self):
+        return self.offset + (0 if self.df is None else len(self.df))
+
+    def add(self, mask, column, code, values=None):
+        mask = np.asarray(mask, dtype=bool)
+        if mask.any():
+            values = self.df[column] if values is None else values
+            self._found(np.flatnonzero(mask), self.offset, column, code, values)
+
+    def _found(self, positions, offset, column, code, values):
+        self.found.append(pd.DataFrame({
+            # Line 1 is the header
+            'line': positions + offset + 2,
+            'column': column,
+            'code': code,
+            'value': values.iloc[positions].astype(str).str.slice(0, MAX_VALUE_LENGTH).to_numpy()
+        }))
+
+    def column(self, *names):
+        """The first of names present in the frame, or None"""
+        return next((name for name in names if name in self.df.columns), None)
+
+    def require_columns(self, *groups):
+        """Each group is a column name or a tuple of alternatives; False if any is missing"""
+        missing = [
+            group if isinstance(group, str) else '|'.join(group)
+            for group in groups
+            if self.column(*((group,) if isinstance(group, str) else group)) is None
+        ]
+        for name in missing:
+            self.header(name, 'missing_column')
+        return not missing
+
+    def either(self, column, key_column):
+        """column for require_columns(), or column or key_column in a bundle"""
+        return column if self.keys is None else (column, key_column)
+
+    def header(self, column, code):
+        if self.offset:
+            # Reported with the first frame
+            return
+        self.found.append(pd.DataFrame({'line': [1], 'column': [column], 'code': [code], 'value': ['']}))
+
+    def required(self, column):
+        self.add(self.df[column] == '', column, 'required')
+
+    def max_length(self, column, length):
+        self.add(self.df[column].str.len() > length, column, 'too_long')
+
+    def choice(self, column, allowed):
+        values = self.df[column]
+        self.add((values != '') & ~values.isin(allowed), column, 'invalid_choice')
+
+    def email(self, column):
+        values = self.df[column]
+        self.add((values != '') & ~values.str.fullmatch(_EMAIL), column, 'invalid_email')
+
+    def integers(self, column):
+        """Nullable integer Series for column; non-integers are reported and come back empty"""
+        values = self.df[column]
+        numbers = pd.to_numeric(values.where(values != ''), errors='coerce')
+        bad = (values != '') & (numbers.isna() | (numbers % 1 != 0))
+        self.add(bad, column, 'not_an_integer')
+        return numbers.where(~bad).astype('Int64')
+
+    def references(self, column, ids, model, code, also=(), report=True):
+        """Report ids that are neither rows of model nor in also; the mask of them without report"""
+        wanted = pd.Index(ids.dropna().unique()).difference(pd.Index(also))
+        found = _existing_ids(model, wanted)
+        unknown = ids.notna() & ~ids.isin(found) & ~ids.isin(also)
+        if not report:
+            return unknown
+        self.add(unknown, column, code)
+
+    def reference(self, column, key_column, model, code, required=False, also=()):
+        """Check the ids in column against model and, in a bundle, key_column against the referenced file
+
+        Either column may be missing from the frame. Returns the nullable
+        integer ids; a row may give an id or a key, not both.
+        """
+        blank = pd.Series('', index=self.df.index)
+        keys = blank
+        if self.keys is not None and key_column in self.df.columns:
+            keys = self.df[key_column]
+            known = self.keys.get(KEY_REFERENCES[self.kind][key_column][1], pd.Index([]))
+            self.add((keys != '') & ~keys.isin(known), key_column, 'unknown_key')
+        ids = pd.Series(pd.NA, index=self.df.index, dtype='Int64')
+        values = blank
+        if column in self.df.columns:
+            values = self.df[column]
+            ids = self.integers(column)
+            self.references(column, ids, model, code, also=also)
+        self.add((values != '') & (keys != ''), key_column, 'conflicting_reference')
+        if required:
+            self.add((values == '') & (keys == ''), column if column in self.df.columns else key_column, 'required')
+        return ids
+
+    def present(self, *columns):
+        """Those of columns in the frame, *_key columns only in a bundle"""
+        return [
+            column for column in columns
+            if column in self.df.columns and (self.keys is not None or not column.endswith('_key'))
+        ]
+
+    def taken(self, model, column, keys):
+        """Report rows whose natural key, a frame of model columns, is already in the database"""
+        self.add(_existing_keys(model, keys), column, 'already_exists')
+
+    def duplicates(self, column, *key_columns):
+        """Report every repeat of a key after its first row; blank keys are skipped"""
+        keys = self.df[list(key_columns or (column,))]
+        if column == 'email' or 'email' in key_columns:
+            keys = keys.apply(lambda values: values.str.lower())
+        blank = (self.df[column] == '').to_numpy()
+        self.add(self.repeated((column,) + key_columns, keys) & ~blank, column, 'duplicate_in_file')
+
+    def repeated(self, name, keys):
+        """Mask of the rows of keys (a Series or frame) that repeat a row before them in the file
+
+        Earlier frames are remembered under name by the 64-bit hashes of
+        their keys, not the keys themselves.
+        """
+        hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+        seen = self.seen.get(name, np.empty(0, dtype=np.uint64))
+        repeats = keys.duplicated(keep='first').to_numpy()
+        if len(seen):
+            repeats |= seen[np.minimum(np.searchsorted(seen, hashes), len(seen) - 1)] == hashes
+        # seen is sorted, so the stable sort only has to merge the new hashes in
+        self.seen[name] = np.sort(np.concatenate([seen, np.unique(hashes)]), kind='stable')
+        return repeats
+
+    def hold_tree(self, column, ids, parents, unknown):
+        """Keep a frame's ids and parents, and which parents aren't in the database, for finish()"""
+        self.tree_column = column
+        self.tree.append((ids.reset_index(drop=True), parents.reset_index(drop=True),
+                          pd.Series(np.asarray(unknown, dtype=bool))))
+
+    def finish(self):
+        """Check parents against the ids of the whole file, and for cycles"""
+        if not self.tree:
+            return
+        ids, parents, unknown = (pd.concat(parts, ignore_index=True) for parts in zip(*self.tree))
+        self.tree = []
+        column = self.tree_column
+        unknown &= ~parents.isin(ids.dropna().unique())
+        self._found(np.flatnonzero(unknown), 0, column, 'unknown_department', parents)
+        self.depths = parent_depths(ids, parents)
+        self._found(np.flatnonzero(self.depths < 0), 0, column, 'parent_cycle', parents)
+
+    def report(self):
+        errors = pd.concat(self.found, ignore_index=True) if self.found else pd.DataFrame(columns=REPORT_COLUMNS)
+        return ValidationReport(self.rows, errors)
+
+
+def _existing_ids(model, ids):
+    """Those of ids that exist in model's table, one indexed query per batch
+
+    A batch of ids that are dense in their range is looked up as a primary
+    key range scan instead of binding ten thousand parameters.
+    """
+    ids = sorted(int(i) for i in ids)
+    existing = set()
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[start:start + ID_BATCH_SIZE]
+        if batch[-1] - batch[0] < 4 * len(batch):
+            found = db.session.scalars(select(model.id).where(model.id.between(batch[0], batch[-1])))
+            existing.update(set(found).intersection(batch))
+        else:
+            existing.update(db.session.scalars(select(model.id).where(model.id.in_(batch))))
+    return existing
+
+
+def _existing_keys(model, keys):
+    """Mask of the rows of keys (a frame named after columns of model) that match a row of model
+
+    Looked up by the first column, one indexed IN query per batch of distinct
+    values; blank (NA) values match NULL.
+    """
+    first = keys.columns[0]
+    wanted = list(keys[first].dropna().unique())
+    found = []
+    for start in range(0, len(wanted), ID_BATCH_SIZE):
+        found.extend(db.session.execute(
+            select(*(model.__table__.c[name] for name in keys.columns))
+            .where(model.__table__.c[first].in_(wanted[start:start + ID_BATCH_SIZE]))
+        ).all())
+    found = pd.DataFrame(found, columns=keys.columns).astype(keys.dtypes.to_dict()).drop_duplicates()
+    return (keys.merge(found, how='left', indicator=True)['_merge'] == 'both').to_numpy()
+
+
+def _usernames_taken(usernames, emails):
+    """Mask of rows whose username belongs to an existing account with another email"""
+    owners = {}
+    wanted = list(usernames[usernames != ''].unique())
+    for start in range(0, len(wanted), ID_BATCH_SIZE):
+        owners.update(db.session.execute(
+            select(User.username, User.email).where(User.username.in_(wanted[start:start + ID_BATCH_SIZE]))
+        ).all())
+    owner = usernames.map(owners)
+    return owner.notna() & (owner != emails)
+
+
+def parent_depths(ids, parents):
+    """Depth of each row below the rows of the file, or -1 for rows in or under a parent cycle
+
+    ids and parents are Series of ids or keys, missing as NA; a parent that
+    isn't one of ids is outside the file (depth 0). Uses pointer jumping: after k rounds
+    every row points 2**k levels up, so log2(n) rounds settle every chain.
+    """
+    n = len(ids)
+    positions = pd.Series(np.arange(n), index=ids.astype(object))
+    positions = positions[positions.index.notna() & ~positions.index.duplicated()]
+    up = parents.astype(object).map(positions).fillna(-1).to_numpy(dtype=np.int64)
+    depth = (up >= 0).astype(np.int64)
+    for _ in range(max(1, int(np.ceil(np.log2(max(n, 2))))) + 1):
+        linked = np.flatnonzero(up >= 0)
+        if not len(linked):
+            break
+        above = up[linked]
+        depth[linked] += depth[above]
+        up[linked] = up[above]
+    return np.where(up >= 0, -1, depth)
+
+
+def _keys(df, column):
+    """A bundle file's keys in column, missing as NA"""
+    if column not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype=object)
+    return df[column].where(df[column] != '')
+
+
+def _validate_users(check):
+    if not check.require_columns('email', ('username', 'name'), 'role', check.either('department_id', 'department_key')):
+        return
+    username = check.column('username', 'name')
+    for column, length in (('email', 120), (username, 50)):
+        check.required(column)
+        check.max_length(column, length)
+        check.duplicates(column)
+    check.email('email')
+    if check.mode == 'upsert':
+        check.add(_usernames_taken(check.df[username], check.df['email']), username, 'username_taken')
+    if check.keys is not None:
+        # A bundle refers to its rows by key, so none of them may be skipped as existing
+        check.taken(User, 'email', check.df[['email']])
+        check.taken(User, username, check.df[[username]].set_axis(['username'], axis=1))
+    check.choice('role', ROLES)
+    check.reference('department_id', 'department_key', Department, 'unknown_department', required=True)
+    check.reference('manager_id', 'manager_key', User, 'unknown_user')
+    if check.keys is not None:
+        depths = parent_depths(_keys(check.df, 'key'), _keys(check.df, 'manager_key'))
+        check.add(depths < 0, 'manager_key', 'manager_cycle')
+        check.df['_depth'] = depths
+
+
+def _validate_departments(check):
+    if not check.require_columns('name'):
+        return
+    check.required('name')
+    check.max_length('name', 100)
+    if 'description' in check.df.columns:
+        check.max_length('description', 500)
+    check.reference('head_id', 'head_key', User, 'unknown_user')
+
+    parent = check.column('parent_id', 'parent_department_id') or 'parent_id'
+    if 'id' in check.df.columns and (check.mode == 'upsert' or check.keys is not None):
+        check.header('id', 'unexpected_column')
+    if 'id' in check.df.columns and check.mode != 'upsert' and check.keys is None:
+        check.required('id')
+        ids = check.integers('id')
+        check.add(check.repeated('id', ids) & ids.notna(), 'id', 'duplicate_in_file')
+        check.add(ids.isin(_existing_ids(Department, ids.dropna().unique())), 'id', 'id_exists')
+        # A parent may be a row anywhere in the file, so finish() checks the rest and looks for cycles
+        parents = pd.Series(pd.NA, index=check.df.index, dtype='Int64')
+        unknown = np.zeros(len(check.df), dtype=bool)
+        if parent in check.df.columns:
+            parents = check.integers(parent)
+            unknown = check.references(parent, parents, Department, 'unknown_department',
+                                       also=ids.dropna().unique(), report=False)
+        check.hold_tree(parent, ids, parents, unknown)
+    else:
+        parents = check.reference(parent, 'parent_key', Department, 'unknown_department')
+    check.duplicates('name', *check.present('name', parent, 'parent_key'))
+    if check.keys is not None:
+        parent_keys = _keys(check.df, 'parent_key')
+        # Rows under a parent of the bundle are new by definition
+        check.taken(Department, 'name', pd.DataFrame({
+            'name': check.df['name'].where(parent_keys.isna()), 'parent_id': parents
+        }))
+        depths = parent_depths(_keys(check.df, 'key'), parent_keys)
+        check.add(depths < 0, 'parent_key', 'parent_cycle')
+        check.df['_depth'] = depths
+
+
+def _validate_named(model, statuses=None, types=None):
+    """Validator for resources or facilities; types, if given, makes type a required choice"""
+    required = ('name', 'type') if types else ('name',)
+
+    def validate(check):
+        if not check.require_columns(*required, check.either('department_id', 'department_key')):
+            return
+        for column in required:
+            check.required(column)
+        check.max_length('name', 100)
+        departments = check.reference('department_id', 'department_key', Department, 'unknown_department',
+                                      required=True)
+        check.duplicates('name', *check.present('name', 'department_id', 'department_key'))
+        if check.keys is not None:
+            check.taken(model, 'name', pd.DataFrame({
+                'name': check.df['name'].where(_keys(check.df, 'department_key').isna()),
+                'department_id': departments
+            }))
+        if types:
+            check.choice('type', types)
+        elif 'type' in check.df.columns:
+            check.max_length('type', 50)
+        if statuses and 'status' in check.df.columns:
+            check.choice('status', statuses)
+        if 'capacity' in check.df.columns:
+            check.integers('capacity')
+        check.reference('assigned_to_id', 'assigned_to_key', User, 'unknown_user')
+    return validate
+
+
+VALIDATORS = {
+    'users': _validate_users,
+    'departments': _validate_departments,
+    'resources': _validate_named(Resource, RESOURCE_STATUSES, RESOURCE_TYPES),
+    'facilities': _validate_named(Facility)
+}
+
+
+def _check(kind, frames, mode='insert', keys=None):
+    """The finished _Checker for a file read as frames, in file order"""
+    check = _Checker(mode, kind, keys)
+    for df in frames:
+        check.start(df)
+        if keys is not None and 'key' in df.columns:
+            check.max_length('key', MAX_VALUE_LENGTH)
+            check.duplicates('key')
+        VALIDATORS[kind](check)
+    check.finish()
+    return check
+
+
+def validate_frame(kind, df, mode='insert', keys=None):
+    """ValidationReport for a frame read with read_frame(); empty (falsy) when every row is valid
+
+    keys is given for the files of a bundle; see validate_bundle().
+    """
+    return _check(kind, [df], mode, keys).report()
+
+
+def validate_file(source, kind, mode='insert', chunk_size=VALIDATION_CHUNK_SIZE):
+    """ValidationReport for a CSV read chunk_size rows at a time, and the depth of each row
+
+    The depths are None unless the file is of departments with ids; then
+    rows of depth 0 have no parent in the file.
+    """
+    with read_frame(source, chunk_size) as frames:
+        check = _check(kind, frames, mode)
+    return check.report(), check.depths
+
+
+def validate_bundle(frames):
+    """ValidationReport over the files of a bundle, {kind: frame}, whose rows may refer to each other by key"""
+    keys = {kind: pd.Index(_keys(df, 'key').dropna().unique()) for kind, df in frames.items()}
+    return ValidationReport.combine({
+        f'{kind}.csv': validate_frame(kind, df, keys=keys) for kind, df in frames.items()
+    })
+
+
+def read_frame(source, chunk_size=None):
+    """Every column as text, blanks as empty strings; with chunk_size, an iterator of frames"""
+    return pd.read_csv(source, dtype=str, keep_default_na=False, na_filter=False, skipinitialspace=True,
+                       chunksize=chunk_size)
+
+
+def report_path(path):
+    """Where the error report for a spooled upload is written"""
+    return os.path.splitext(path)[0] + '.errors.csv'
+
+
+def read_validated_csv(path, kind, chunk_size=DEFAULT_CHUNK_SIZE, mode='insert'):
+    """Validate a spooled CSV as a whole, then yield its rows in chunks for run_import
+
+    On any problem the report is written next to the file (see report_path)
+    and ImportValidationError is raised before the first chunk. The file is
+    read a chunk at a time, once to validate it and once to import it, so
+    memory is bounded by the chunk size plus what validation carries between
+    chunks. A departments file whose rows have parents among its own rows is
+    imported a level of nesting at a time, parents first, reading the file
+    once per level.
+    """
+    report, depths = validate_file(path, kind, mode)
+    if report:
+        report.write_csv(report_path(path))
+        raise ImportValidationError(report.summary())
+    levels = [None]
+    if depths is not None and len(depths) and depths.max() > 0:
+        levels = range(int(depths.max()) + 1)
+    for level in levels:
+        offset = 0
+        with read_frame(path, chunk_size) as frames:
+            for df in frames:
+                rows = len(df)
+                if level is not None:
+                    df = df[depths[offset:offset + rows] == level]
+                offset += rows
+                if len(df):
+                    yield df.to_dict('records')
@@ -0,0 +1,89 @@
+"""Benchmark loading a whole organization as one bundle import.
+
+Writes a bundle zip with a --departments department tree, --users users (a
+head per department, everyone else reporting to their head), --resources
+resources and --facilities facilities, every file shuffled so children and
+reports mostly come before their parents and managers. Times reading and
+validating the bundle and loading it in one transaction into an empty
+scratch database, then checks the stored tree and reporting lines.
+
+Usage: python -m benchmarks.bundle_import [--users 100000] [--departments 5000]
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+import zipfile
+
+from sqlalchemy import func, select
+
+from app import create_app, db
+from app.bundle import load_bundle, read_validated_bundle
+from app.migrate import upgrade_database
+from app.models import User, Department
+from app.stats import verify_counters
+
+
+def _csv(header, rows):
+    text = io.StringIO()
+    text.write(header + '\n')
+    text.writelines(','.join(map(str, row)) + '\n' for row in rows)
+    return text.getvalue()
+
+
+def _write_bundle(path, args, rng):
+    departments = [(f'd{i}', f'Department {i}', f'd{rng.randrange(i)}' if i else '', f'u{i}')
+                   for i in range(args.departments)]
+    users = [(f'u{i}', f'user{i}@example.com', f'user{i}', 'DEPT_ADMIN', f'd{i}',
+              f'u{int(departments[i][2][1:])}' if departments[i][2] else '')
+             for i in range(args.departments)]
+    for i in range(args.departments, args.users):
+        dept = rng.randrange(args.departments)
+        users.append((f'u{i}', f'user{i}@example.com', f'user{i}', 'REGULAR_USER', f'd{dept}', f'u{dept}'))
+    resources = [(f'Resource {i}', 'HARDWARE', f'd{rng.randrange(args.departments)}', f'u{rng.randrange(args.users)}')
+                 for i in range(args.resources)]
+    facilities = [(f'Facility {i}', f'd{rng.randrange(args.departments)}', rng.choice((8, 20, 50)))
+                  for i in range(args.facilities)]
+    for rows in (departments, users, resources, facilities):
+        rng.shuffle(rows)
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('departments.csv', _csv('key,name,parent_key,head_key', departments))
+        archive.writestr('users.csv', _csv('key,email,username,role,department_key,manager_key', users))
+        archive.writestr('resources.csv', _csv('name,type,department_key,assigned_to_key', resources))
+        archive.writestr('facilities.csv', _csv('name,department_key,capacity', facilities))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--departments', type=int, default=5000)
+    parser.add_argument('--resources', type=int, default=200_000)
+    parser.add_argument('--facilities', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='bench_bundle_')
+    path = os.path.join(workdir, 'org.zip')
+    _write_bundle(path, args, rng)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bundle.db'),
+                      'METRICS_ENABLED': False, 'IMPORT_PASSWORD_MODE': 'token', 'BCRYPT_LOG_ROUNDS': 4})
+    with app.app_context():
+        upgrade_database()
+        started = time.perf_counter()
+        frames = read_validated_bundle(path)
+        validated = time.perf_counter() - started
+        stats = load_bundle(frames)
+        print(f'read + validate {validated:6.2f}s')
+        print(f'load            {stats.elapsed:6.2f}s  {stats.inserted} rows  {stats.rows_per_sec:,.0f} rows/s')
+
+        headless = db.session.scalar(select(func.count(Department.id)).where(Department.head_id.is_(None)))
+        unmanaged = db.session.scalar(select(func.count(User.id)).where(User.manager_id.is_(None)))
+        print(f'departments without a head {headless}, users without a manager {unmanaged} (expected 0, 1)')
+        print(f'counter drift {verify_counters()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark whole-file validation of large CSV uploads.
+
+Writes a --rows users CSV into a scratch directory, with --bad-percent of the
+rows broken in one of several ways (bad email, unknown role, unknown or
+non-numeric department, duplicate email), and times validating it chunk by chunk
+against a database of --departments departments. Also validates a departments
+file of the same size whose rows refer to each other through the id column,
+which exercises the parent cycle check.
+
+Usage: python -m benchmarks.csv_validation [--rows 1000000] [--bad-percent 1]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.migrate import upgrade_database
+from app.models import Department
+from app.validation import validate_file
+
+
+def _write_users(path, rows, departments, bad_percent, rng):
+    breakages = (
+        lambda i, dept: f'user{i}.example.com,user{i},REGULAR_USER,{dept}',
+        lambda i, dept: f'user{i}@example.com,user{i},BOSS,{dept}',
+        lambda i, dept: f'user{i}@example.com,user{i},REGULAR_USER,{departments + 1000}',
+        lambda i, dept: f'user{i}@example.com,user{i},REGULAR_USER,x{dept}',
+        lambda i, dept: f'USER{i - 1}@example.com,user{i},REGULAR_USER,{dept}',
+    )
+    with open(path, 'w') as f:
+        f.write('email,username,role,department_id\n')
+        for i in range(rows):
+            dept = rng.randint(1, departments)
+            if rng.random() * 100 < bad_percent:
+                f.write(rng.choice(breakages)(i, dept) + '\n')
+            else:
+                f.write(f'user{i}@example.com,user{i},REGULAR_USER,{dept}\n')
+
+
+def _write_departments(path, rows, first_id, rng):
+    with open(path, 'w') as f:
+        f.write('id,name,parent_id\n')
+        ids = list(range(first_id, first_id + rows))
+        rng.shuffle(ids)
+        for position, id_ in enumerate(ids):
+            # Each row hangs under a row seen earlier in id order, so the file is a forest
+            parent = rng.randint(first_id, id_ - 1) if id_ > first_id and position % 20 else ''
+            f.write(f'{id_},Department {id_},{parent}\n')
+
+
+def _time(kind, path):
+    started = time.perf_counter()
+    report, _ = validate_file(path, kind)
+    checked = time.perf_counter() - started
+    print(f'{kind:<12} {report.rows_checked:>9} rows  read and validate {checked:6.2f}s  '
+          f'{report.rows_with_errors} bad rows {report.counts}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--departments', type=int, default=5000)
+    parser.add_argument('--bad-percent', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='bench_csv_validation_')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'validation.db'),
+                      'METRICS_ENABLED': False})
+    with app.app_context():
+        upgrade_database()
+        db.session.execute(insert(Department), [{'name': f'Department {i}'} for i in range(args.departments)])
+        db.session.commit()
+
+        users = os.path.join(workdir, 'users.csv')
+        _write_users(users, args.rows, args.departments, args.bad_percent, rng)
+        _time('users', users)
+
+        departments = os.path.join(workdir, 'departments.csv')
+        _write_departments(departments, args.rows, args.departments + 1, rng)
+        _time('departments', departments)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Benchmark concurrent reads and writes against each database engine profile.
+
+Runs reader threads (scoped resource listings and counts, as on the
+dashboard) alongside writer threads (resource status updates) for a fixed
+time and reports throughput, p50/p95 latency and "database is locked"
+errors for an untuned SQLite file, the tuned sqlite profile, and optionally a
+server database given with --url.
+
+Usage: python -m benchmarks.db_concurrency [--readers 8] [--writers 2] [--seconds 5] [--url postgresql://...]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, db
+from app.migrate import upgrade_database
+from app.models import Department, Resource
+
+# Pragmas as SQLite ships them, i.e. what the app ran with before the profiles existed
+UNTUNED_SQLITE = {
+    'SQLITE_JOURNAL_MODE': 'DELETE',
+    'SQLITE_BUSY_TIMEOUT_MS': None,
+    'SQLITE_SYNCHRONOUS': 'FULL',
+    'SQLITE_MMAP_SIZE': None,
+    'SQLITE_CACHE_SIZE_KB': None
+}
+
+
+def _seed(departments, resources, seed):
+    rng = random.Random(seed)
+    db.session.execute(insert(Department), [{'name': f'Department {i}'} for i in range(departments)])
+    db.session.execute(insert(Resource), [{
+        'name': f'Resource {i}',
+        'type': rng.choice(('HARDWARE', 'SOFTWARE', 'VEHICLE')),
+        'status': rng.choice(('available', 'in_use', 'maintenance')),
+        'department_id': rng.randint(1, departments)
+    } for i in range(resources)])
+    db.session.commit()
+
+
+def _worker(app, kind, departments, resources, stop, results, seed):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    with app.app_context():
+        while not stop.is_set():
+            dept_id = rng.randint(1, departments)
+            start = time.perf_counter()
+            try:
+                if kind == 'read':
+                    db.session.execute(
+                        select(Resource.id, Resource.name)
+                        .where(Resource.department_id == dept_id, Resource.status == 'available')
+                        .order_by(Resource.name).limit(50)
+                    ).all()
+                    db.session.scalar(select(func.count()).select_from(Resource).where(Resource.department_id == dept_id))
+                    db.session.rollback()
+                else:
+                    db.session.execute(
+                        update(Resource).where(Resource.id == rng.randint(1, resources))
+                        .values(status=rng.choice(('available', 'in_use', 'maintenance')))
+                    )
+                    db.session.commit()
+                latencies.append(time.perf_counter() - start)
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+        db.session.remove()
+    results.append((kind, latencies, errors))
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    return statistics.quantiles(values, n=100)[pct - 1] if len(values) > 1 else values[0]
+
+
+def run_profile(name, config, args):
+    app = create_app(config)
+    with app.app_context():
+        upgrade_database()
+        if not db.session.scalar(select(func.count()).select_from(Resource)):
+            _seed(args.departments, args.resources, args.seed)
+        db.session.remove()
+
+    stop = threading.Event()
+    results = []
+    threads = [
+        threading.Thread(target=_worker, args=(app, kind, args.departments, args.resources, stop, results, args.seed + i))
+        for i, kind in enumerate(['read'] * args.readers + ['write'] * args.writers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        db.engine.dispose()
+
+    for kind in ('read', 'write'):
+        latencies = [t for k, lat, _ in results if k == kind for t in lat]
+        errors = sum(e for k, _, e in results if k == kind)
+        print(f'{name:<16} {kind:<6} {len(latencies) / args.seconds:>9.1f} '
+              f'{_percentile(latencies, 50) * 1000:>8.2f} {_percentile(latencies, 95) * 1000:>8.2f} {errors:>7}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--departments', type=int, default=200)
+    parser.add_argument('--resources', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--url', help='also benchmark this server database with the pooled profile')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_db_')
+    profiles = [
+        ('sqlite-untuned', dict(UNTUNED_SQLITE, SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(workdir, 'untuned.db'))),
+        ('sqlite-tuned', {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'tuned.db')})
+    ]
+    if args.url:
+        profiles.append(('server-pooled', {'SQLALCHEMY_DATABASE_URI': args.url, 'DB_ENGINE_PROFILE': 'server'}))
+
+    print(f'{args.readers} readers, {args.writers} writers, {args.seconds:g}s per profile')
+    print(f'{"profile":<16} {"op":<6} {"ops/sec":>9} {"p50 ms":>8} {"p95 ms":>8} {"errors":>7}')
+    for name, config in profiles:
+        run_profile(name, config, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark the department closure index on a generated org tree.
+
+Builds a tree of --departments departments, --depth levels deep, in a scratch
+SQLite database and compares descendant lookups through department_closure
+against walking parent_id one level (one query) at a time.
+
+Usage: python -m benchmarks.department_tree [--departments 10000] [--depth 8]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import func, insert, select
+
+from app import create_app, db
+from app.hierarchy import descendant_ids, rebuild_department_tree, sync_department_tree
+from app.models import Department, DepartmentClosure
+
+
+def build_tree(count, depth, rng):
+    """Return department rows with ids assigned level by level, fan-out growing geometrically"""
+    ratio = count ** (1 / (depth - 1))
+    weights = [ratio ** level for level in range(1, depth)]
+    sizes = [max(1, round((count - 1) * w / sum(weights))) for w in weights]
+    sizes[-1] += count - 1 - sum(sizes)
+
+    rows = [{'id': 1, 'name': 'Department 1', 'parent_id': None}]
+    levels = [[1]]
+    next_id = 2
+    for size in sizes:
+        current = []
+        for _ in range(size):
+            rows.append({'id': next_id, 'name': f'Department {next_id}', 'parent_id': rng.choice(levels[-1])})
+            current.append(next_id)
+            next_id += 1
+        levels.append(current)
+    return rows, levels
+
+
+def walk_parent_ids(dept_id):
+    """The pre-index approach: one query per tree level"""
+    found = [dept_id]
+    frontier = [dept_id]
+    while frontier:
+        frontier = list(db.session.scalars(select(Department.id).where(Department.parent_id.in_(frontier))))
+        found.extend(frontier)
+    return found
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--departments', type=int, default=10000)
+    parser.add_argument('--depth', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db')})
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        db.create_all()
+        rows, levels = build_tree(args.departments, args.depth, rng)
+
+        start = time.perf_counter()
+        db.session.execute(insert(Department), rows)
+        sync_department_tree()
+        db.session.commit()
+        build_ms = (time.perf_counter() - start) * 1000
+        pairs = db.session.scalar(select(func.count()).select_from(DepartmentClosure))
+        print(f'Indexed {len(rows)} departments ({pairs} closure rows) in {build_ms:.0f} ms')
+
+        print(f'{"start level":>11} {"subtree":>8} {"closure ms":>11} {"walk ms":>9} {"walk queries":>13}')
+        for level in (0, 1, args.depth // 2, args.depth - 2):
+            dept_id = levels[level][0]
+            closure_ms, found = timed(lambda: list(db.session.scalars(descendant_ids(dept_id))), args.repeat)
+            walk_ms, walked = timed(lambda: walk_parent_ids(dept_id), args.repeat)
+            assert sorted(found) == sorted(walked)
+            print(f'{level:>11} {len(found):>8} {closure_ms:>11.2f} {walk_ms:>9.2f} {args.depth - level:>13}')
+
+        # Maintenance costs of ORM writes
+        parent = db.session.get(Department, levels[1][0])
+        start = time.perf_counter()
+        dept = Department(name='New department', parent_id=levels[-2][0])
+        db.session.add(dept)
+        db.session.commit()
+        insert_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        moved = db.session.get(Department, levels[2][0])
+        moved.parent_id = levels[1][-1] if levels[1][-1] != moved.parent_id else parent.id
+        db.session.commit()
+        move_ms = (time.perf_counter() - start) * 1000
+        print(f'Insert leaf: {insert_ms:.2f} ms, move level-2 subtree: {move_ms:.2f} ms')
+
+        # The incrementally maintained index must match a full rebuild
+        maintained = set(db.session.execute(select(DepartmentClosure.ancestor_id, DepartmentClosure.descendant_id, DepartmentClosure.depth)))
+        rebuild_department_tree()
+        rebuilt = set(db.session.execute(select(DepartmentClosure.ancestor_id, DepartmentClosure.descendant_id, DepartmentClosure.depth)))
+        print('Index consistent with rebuild:', maintained == rebuilt)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark streaming exports against loading the whole listing.
+
+Fills a scratch database with --users users, then exports them all as CSV
+(and NDJSON, and gzipped CSV) through app.export, timing the first chunk and
+the whole stream and measuring peak Python memory with tracemalloc. With
+--compare it also builds the list the JSON list endpoints build
+(`.all()` then `to_dict()` per row) for the same rows.
+
+Usage: python -m benchmarks.export_stream [--users 1000000] [--compare]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from werkzeug.datastructures import MultiDict
+
+from app import create_app, db
+from app.export import export_query, iter_export
+from app.migrate import upgrade_database
+from app.models import User, Department
+from app.scope import Scope, ALL
+
+BATCH_SIZE = 10_000
+
+
+def _fill(users, departments):
+    connection = db.session.connection()
+    connection.execute(Department.__table__.insert(), [{'name': f'Department {i}'} for i in range(departments)])
+    now = datetime.utcnow()
+    statement = User.__table__.insert()
+    for start in range(0, users, BATCH_SIZE):
+        connection.execute(statement, [{
+            'username': f'user{i}', 'email': f'user{i}@example.com', 'password': '!', 'role': 'REGULAR_USER',
+            'department_id': i % departments + 1, 'join_date': now, 'is_active': True
+        } for i in range(start, min(start + BATCH_SIZE, users))])
+    db.session.commit()
+
+
+def _measure(label, run):
+    started = time.perf_counter()
+    first, size = run()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    first_text = f'{first * 1000:7.1f}ms' if first is not None else '      -  '
+    print(f'{label:<16} first chunk {first_text}  total {elapsed:6.2f}s  {size / 1e6:7.1f} MB  '
+          f'peak memory {peak / 1e6:7.1f} MB')
+
+
+def _stream(fmt, compress):
+    def run():
+        query = export_query('users', Scope(ALL), MultiDict())
+        started = time.perf_counter()
+        first, size = None, 0
+        for chunk in iter_export(query, fmt, compress):
+            if first is None:
+                first = time.perf_counter() - started
+            size += len(chunk)
+        return first, size
+    return run
+
+
+def _listing():
+    body = json.dumps({'users': [user.to_dict() for user in User.query.all()]})
+    db.session.expunge_all()
+    return None, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--departments', type=int, default=1000)
+    parser.add_argument('--compare', action='store_true')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='bench_export_'), 'export.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path, 'METRICS_ENABLED': False})
+    with app.app_context():
+        upgrade_database()
+        _fill(args.users, args.departments)
+        _measure('csv', _stream('csv', False))
+        _measure('ndjson', _stream('ndjson', False))
+        _measure('csv, gzip', _stream('csv', True))
+        if args.compare:
+            _measure('.all() + to_dict', _listing)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,465 @@
+"""End-to-end load test: replay request logs or run scenarios against the app.
+
+Requests run on --concurrency worker threads, either in-process through the
+Flask test client (against a scratch database seeded with app.seed) or
+against a running server given with --url. Each worker logs in once per role
+it needs; logins are not timed. Results are grouped per endpoint (method plus
+path with ids replaced by <id>) with throughput and p50/p95/p99 latency, and
+can be saved as JSON and compared with an earlier run to flag regressions.
+
+A request log is JSON lines of {"method": "GET", "path": "/dashboard",
+"role": "ORG_ADMIN", "body": {...}, "json": false}; role and body are
+optional and body is sent form-encoded unless "json" is true.
+
+Scenarios:
+  dashboard-storm  every worker reloads /dashboard as a different user, mixed roles
+  admin-paging     admins walk the user and resource listings page by page
+  bulk-import      every worker uploads a facilities CSV and polls its import job to the end
+
+Usage:
+  python -m benchmarks.loadtest replay requests.log.jsonl [--repeat 3]
+  python -m benchmarks.loadtest scenario dashboard-storm [--concurrency 16] [--output run.json]
+  python -m benchmarks.loadtest scenario admin-paging --compare baseline.json
+"""
+import argparse
+import http.cookiejar
+import io
+import itertools
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROLES = ('MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN', 'REGULAR_USER')
+
+_CSRF = re.compile(rb'name="csrf_token"[^>]*value="([^"]+)"')
+_NEXT_PAGE = re.compile(rb'href="([^"]*(?:\?|&amp;)after=[^"]*)"')
+_ID_SEGMENT = re.compile(r'/(?:\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(?=/|$)')
+
+
+def endpoint_key(method, path):
+    path = urllib.parse.urlsplit(path).path
+    return f'{method.upper()} {_ID_SEGMENT.sub("/<id>", path)}'
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: text/csv\r\n\r\n'.encode())
+        body.write(content)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class InProcessSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, json_body=None, files=None):
+        if files:
+            data = dict(data or {})
+            data.update({name: (io.BytesIO(content), filename) for name, (filename, content) in files.items()})
+        response = self.client.open(path, method=method, data=data, json=json_body)
+        return response.status_code, response.get_data()
+
+
+class HttpSession:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method, path, data=None, json_body=None, files=None):
+        headers = {}
+        body = None
+        if files:
+            body, headers['Content-Type'] = _multipart(data or {}, files)
+        elif json_body is not None:
+            body, headers['Content-Type'] = json.dumps(json_body).encode(), 'application/json'
+        elif data is not None:
+            body, headers['Content-Type'] = urllib.parse.urlencode(data).encode(), 'application/x-www-form-urlencoded'
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Time the view itself, like the test client does, rather than the page it redirects to
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class InProcessTarget:
+    """The app in this process, on a scratch database seeded with app.seed unless --database is given"""
+
+    def __init__(self, args):
+        from app import create_app, db
+        from app.migrate import upgrade_database
+        from app.models import User
+        from app.seed import seed_organization
+        from sqlalchemy import func, select
+
+        self.password = args.password
+        uri = args.database or 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='loadtest_'), 'loadtest.db')
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': uri,
+            'WTF_CSRF_ENABLED': False,
+            'BCRYPT_LOG_ROUNDS': args.bcrypt_rounds
+        })
+        with self.app.app_context():
+            upgrade_database()
+            if not db.session.scalar(select(func.count()).select_from(User)):
+                print(f'Seeding a scale {args.scale} organization into {uri} ...', file=sys.stderr)
+                seed_organization(scale=args.scale, seed=args.seed, password=args.password)
+            self.emails = {
+                role: list(db.session.scalars(
+                    select(User.email).where(User.role == role, User.is_active.is_(True)).order_by(User.id).limit(256)
+                ))
+                for role in ROLES
+            }
+            db.session.remove()
+
+    def session(self):
+        return InProcessSession(self.app)
+
+    def email_for(self, role, index):
+        emails = self.emails.get(role)
+        if not emails:
+            raise SystemExit(f'No active {role} users in the database')
+        return emails[index % len(emails)]
+
+
+class HttpTarget:
+    """A running server; --user ROLE=email gives the account used for each role"""
+
+    def __init__(self, args):
+        self.base_url = args.url
+        self.password = args.password
+        self.emails = {}
+        for spec in args.user or ():
+            role, _, email = spec.partition('=')
+            self.emails.setdefault(role.upper(), []).append(email)
+
+    def session(self):
+        return HttpSession(self.base_url)
+
+    def email_for(self, role, index):
+        emails = self.emails.get(role)
+        if not emails:
+            raise SystemExit(f'Pass --user {role}=email to log in as {role} against a server')
+        return emails[index % len(emails)]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, seconds, status):
+        with self._lock:
+            self.samples.setdefault(key, []).append((seconds, status))
+
+
+class Worker:
+    def __init__(self, index, target, recorder):
+        self.index = index
+        self.target = target
+        self.recorder = recorder
+        self._sessions = {}
+
+    def session(self, role):
+        session = self._sessions.get(role)
+        if session is None:
+            session = self._sessions[role] = self.target.session()
+            if role:
+                self._login(session, role)
+        return session
+
+    def _login(self, session, role):
+        email = self.target.email_for(role, self.index)
+        status, page = session.request('GET', '/login')
+        data = {'email': email, 'password': self.target.password}
+        token = _CSRF.search(page)
+        if token:
+            data['csrf_token'] = token.group(1).decode()
+        status, _ = session.request('POST', '/login', data=data)
+        if status != 302:
+            raise SystemExit(f'Login as {email} ({role}) failed with status {status}')
+
+    def request(self, method, path, role=None, data=None, json_body=None, files=None, key=None):
+        session = self.session(role)
+        started = time.perf_counter()
+        try:
+            status, body = session.request(method, path, data=data, json_body=json_body, files=files)
+        except OSError:
+            status, body = 599, b''
+        self.recorder.add(key or endpoint_key(method, path), time.perf_counter() - started, status)
+        return status, body
+
+
+def load_request_log(path):
+    entries, skipped = [], 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if not isinstance(entry, dict) or 'method' not in entry or 'path' not in entry:
+                skipped += 1
+                continue
+            entries.append(entry)
+    if not entries:
+        raise SystemExit(f'{path} has no replayable requests (need "method" and "path" on each line)')
+    if skipped:
+        print(f'Skipped {skipped} lines without method/path', file=sys.stderr)
+    return entries
+
+
+def replay(entries, repeat):
+    queue = itertools.chain.from_iterable(itertools.repeat(entries, repeat))
+    lock = threading.Lock()
+
+    def run(worker, args):
+        while True:
+            with lock:
+                entry = next(queue, None)
+            if entry is None:
+                return
+            body = entry.get('body')
+            as_json = entry.get('json', False)
+            worker.request(entry['method'].upper(), entry['path'], role=entry.get('role'),
+                           data=None if as_json else body, json_body=body if as_json else None)
+    return run
+
+
+def _storm_role(index):
+    return ROLES[index % len(ROLES)]
+
+
+def _paging_role(index):
+    return ('MASTER_ADMIN', 'ORG_ADMIN', 'DEPT_ADMIN')[index % 3]
+
+
+def dashboard_storm(worker, args):
+    role = _storm_role(worker.index)
+    for _ in range(args.iterations):
+        worker.request('GET', '/dashboard', role=role)
+
+
+def admin_paging(worker, args):
+    role = _paging_role(worker.index)
+    for _ in range(args.iterations):
+        for listing in ('/manage/users', '/manage/resources'):
+            path = f'{listing}?limit={args.page_size}'
+            for _ in range(args.pages):
+                status, body = worker.request('GET', path, role=role, key=f'GET {listing} (page)')
+                match = _NEXT_PAGE.search(body) if status == 200 else None
+                if not match:
+                    break
+                path = match.group(1).decode().replace('&amp;', '&')
+
+
+def _wait_for_import(worker, job_id, timeout):
+    """Poll the job's status endpoint (untimed) until it finishes; returns its final status"""
+    session = worker.session('MASTER_ADMIN')
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, body = session.request('GET', f'/api/upload/status/{job_id}')
+        if status != 200:
+            return f'http {status}'
+        job_status = json.loads(body)['status']
+        if job_status in ('completed', 'failed', 'cancelled'):
+            return job_status
+        time.sleep(0.05)
+    return 'timeout'
+
+
+def bulk_import(worker, args):
+    for iteration in range(args.iterations):
+        filename = f'loadtest_{worker.index}_{iteration}_{uuid.uuid4().hex[:8]}.csv'
+        # Department 1 is the root of every seeded organization
+        lines = ['name,type,status,department_id'] + [f'{filename[:-4]}_{i},MEETING_ROOM,available,1' for i in range(args.rows)]
+        started = time.perf_counter()
+        status, body = worker.request('POST', '/api/upload/csv/facilities', role='MASTER_ADMIN',
+                                      files={'file': (filename, '\n'.join(lines).encode())})
+        if status != 202:
+            continue
+        outcome = _wait_for_import(worker, json.loads(body)['job_id'], timeout=args.import_timeout)
+        worker.recorder.add('IMPORT facilities (end to end)', time.perf_counter() - started,
+                            200 if outcome == 'completed' else 500)
+
+
+# name -> (worker function, role each worker logs in as before timing starts)
+SCENARIOS = {
+    'dashboard-storm': (dashboard_storm, _storm_role),
+    'admin-paging': (admin_paging, _paging_role),
+    'bulk-import': (bulk_import, lambda index: 'MASTER_ADMIN')
+}
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    last = len(ordered) - 1
+    return ordered[min(last, int(round(pct / 100 * last)))]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(seconds * 1000 for seconds, _ in samples)
+    statuses = [status for _, status in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for s in statuses if s >= 500),
+        'client_errors': sum(1 for s in statuses if 400 <= s < 500),
+        'throughput': round(len(samples) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else None,
+        **{f'p{p}_ms': round(_percentile(latencies, p), 2) if latencies else None for p in (50, 95, 99)}
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(name, worker_fn, roles, target, args):
+    recorder = Recorder()
+    workers = [Worker(i, target, recorder) for i in range(args.concurrency)]
+    # Log everyone in before the clock starts
+    for worker in workers:
+        for role in roles(worker.index):
+            worker.session(role)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for future in [pool.submit(worker_fn, worker, args) for worker in workers]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    all_samples = [sample for samples in recorder.samples.values() for sample in samples]
+    return {
+        'meta': {
+            'name': name,
+            'target': args.url or 'in-process',
+            'concurrency': args.concurrency,
+            'elapsed_seconds': round(elapsed, 3),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'scale': None if args.url else args.scale,
+            'seed': None if args.url else args.seed
+        },
+        'endpoints': {key: summarize(samples, elapsed) for key, samples in sorted(recorder.samples.items())},
+        'total': summarize(all_samples, elapsed)
+    }
+
+
+def print_results(results):
+    meta = results['meta']
+    print(f"{meta['name']}: {meta['target']}, concurrency {meta['concurrency']}, {meta['elapsed_seconds']}s, "
+          f"revision {meta['revision'] or 'unknown'}")
+    print(f'{"endpoint":<44} {"reqs":>6} {"err":>4} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    rows = list(results['endpoints'].items()) + [('TOTAL', results['total'])]
+    for key, stats in rows:
+        print(f'{key[:44]:<44} {stats["requests"]:>6} {stats["errors"]:>4} {stats["throughput"] or 0:>8.1f} '
+              f'{stats["p50_ms"] or 0:>8.2f} {stats["p95_ms"] or 0:>8.2f} {stats["p99_ms"] or 0:>8.2f}')
+
+
+def compare(results, baseline, threshold):
+    """Print p95/throughput changes against a baseline run; returns the endpoints that regressed"""
+    regressions = []
+    print(f'\nAgainst {baseline["meta"].get("revision") or "baseline"} ({baseline["meta"].get("started_at")}):')
+    print(f'{"endpoint":<44} {"p95 ms":>17} {"change":>8} {"req/s change":>13}')
+    for key, stats in list(results['endpoints'].items()) + [('TOTAL', results['total'])]:
+        before = baseline['total'] if key == 'TOTAL' else baseline['endpoints'].get(key)
+        if not before or not before.get('p95_ms') or not stats.get('p95_ms'):
+            continue
+        change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        tput_change = ((stats['throughput'] - before['throughput']) / before['throughput'] * 100
+                       if before.get('throughput') else 0.0)
+        flag = ''
+        if change > threshold:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print(f'{key[:44]:<44} {before["p95_ms"]:>8.2f}->{stats["p95_ms"]:<8.2f} {change:>+7.1f}% '
+              f'{tput_change:>+12.1f}%{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    replay_parser = sub.add_parser('replay', help='replay a JSON-lines request log')
+    replay_parser.add_argument('log')
+    replay_parser.add_argument('--repeat', type=int, default=1)
+    scenario_parser = sub.add_parser('scenario', help='run a built-in scenario')
+    scenario_parser.add_argument('name', choices=sorted(SCENARIOS))
+    scenario_parser.add_argument('--iterations', type=int, default=50, help='repetitions per worker')
+    scenario_parser.add_argument('--pages', type=int, default=10, help='admin-paging: pages per listing walk')
+    scenario_parser.add_argument('--page-size', type=int, default=50)
+    scenario_parser.add_argument('--rows', type=int, default=2000, help='bulk-import: rows per uploaded file')
+    scenario_parser.add_argument('--import-timeout', type=float, default=120)
+
+    for p in (replay_parser, scenario_parser):
+        p.add_argument('--concurrency', type=int, default=8)
+        p.add_argument('--url', help='run against this server instead of in-process')
+        p.add_argument('--user', action='append', metavar='ROLE=EMAIL', help='account per role for --url')
+        p.add_argument('--password', default='password')
+        p.add_argument('--database', help='in-process: use this database URI instead of a seeded scratch one')
+        p.add_argument('--scale', type=float, default=0.02, help='in-process: seed-org scale for the scratch database')
+        p.add_argument('--seed', type=int, default=42)
+        p.add_argument('--bcrypt-rounds', type=int, default=4, help='in-process: keeps logins out of the way')
+        p.add_argument('--output', help='write results as JSON')
+        p.add_argument('--compare', help='compare with a results JSON from an earlier run')
+        p.add_argument('--threshold', type=float, default=20, help='p95 increase (%%) counted as a regression')
+    args = parser.parse_args()
+
+    target = HttpTarget(args) if args.url else InProcessTarget(args)
+    if args.command == 'replay':
+        entries = load_request_log(args.log)
+        roles = sorted({e.get('role') for e in entries if e.get('role')})
+        results = run(f'replay {os.path.basename(args.log)}', replay(entries, args.repeat), lambda index: roles,
+                      target, args)
+    else:
+        worker_fn, roles = SCENARIOS[args.name]
+        results = run(args.name, worker_fn, lambda index: (roles(index),), target, args)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Benchmark a burst of concurrent logins with and without the login pipeline.
+
+Creates --users accounts, then has --concurrency threads each log a share of
+them in through POST /login at once, as at the start of a shift. Runs twice:
+"inline" checks the password on the request thread and commits last_login on
+every login (the old behaviour); "pipeline" uses the bounded verification
+pool and the batched last_login flush. Reports logins/sec, p50/p95 latency,
+rejected (busy) logins and how many UPDATE statements hit the user table.
+
+Usage: python -m benchmarks.login_storm [--users 400] [--concurrency 32] [--rounds 10] [--workers N]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import bcrypt
+from sqlalchemy import event, func, insert, select
+
+from app import create_app, db
+from app.logins import flush_last_logins
+from app.migrate import upgrade_database
+from app.models import User
+
+PASSWORD = 'password'
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    return statistics.quantiles(values, n=100)[pct - 1] if len(values) > 1 else values[0]
+
+
+def _worker(app, emails, latencies, statuses):
+    for email in emails:
+        # Fresh client per login so nobody is already signed in
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.post('/login', data={'email': email, 'password': PASSWORD})
+        latencies.append(time.perf_counter() - started)
+        statuses.append(response.status_code)
+
+
+def run_profile(name, config, args, hashed):
+    app = create_app(config)
+    with app.app_context():
+        upgrade_database()
+        if not db.session.scalar(select(func.count()).select_from(User)):
+            db.session.execute(insert(User), [{
+                'username': f'user{i}', 'email': f'user{i}@example.com', 'password': hashed, 'role': 'REGULAR_USER'
+            } for i in range(args.users)])
+            db.session.commit()
+        engine = db.engine
+        db.session.remove()
+
+    updates = [0]
+
+    def count_updates(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('UPDATE USER'):
+            updates[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', count_updates)
+    emails = [f'user{i}@example.com' for i in range(args.users)]
+    latencies, statuses = [], []
+    threads = [
+        threading.Thread(target=_worker, args=(app, emails[i::args.concurrency], latencies, statuses))
+        for i in range(args.concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    with app.app_context():
+        flush_last_logins()
+    event.remove(engine, 'before_cursor_execute', count_updates)
+
+    ok = statuses.count(302)
+    busy = statuses.count(503)
+    print(f'{name:<10} {ok / elapsed:>9.1f} {_percentile(latencies, 50) * 1000:>9.1f} '
+          f'{_percentile(latencies, 95) * 1000:>9.1f} {busy:>6} {len(statuses) - ok - busy:>7} {updates[0]:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=10, help='bcrypt work factor of the stored hashes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='pipeline verification threads')
+    args = parser.parse_args()
+
+    hashed = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(args.rounds)).decode('utf-8')
+    workdir = tempfile.mkdtemp(prefix='bench_login_')
+    common = {'WTF_CSRF_ENABLED': False, 'BCRYPT_LOG_ROUNDS': args.rounds, 'METRICS_ENABLED': False}
+    profiles = [
+        ('inline', dict(common, LOGIN_HASH_WORKERS=0, LAST_LOGIN_FLUSH_INTERVAL=0,
+                        SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(workdir, 'inline.db'))),
+        ('pipeline', dict(common, LOGIN_HASH_WORKERS=args.workers, LOGIN_MAX_PENDING=args.users,
+                          SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(workdir, 'pipeline.db')))
+    ]
+
+    print(f'{args.users} logins, {args.concurrency} threads, bcrypt rounds {args.rounds}, {args.workers} verify workers')
+    print(f'{"profile":<10} {"logins/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"busy":>6} {"failed":>7} {"updates":>8}')
+    for name, config in profiles:
+        run_profile(name, config, args, hashed)
+
+
+if __name__ == '__main__':
+    main()
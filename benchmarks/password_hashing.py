@@ -0,0 +1,44 @@
+"""Benchmark bulk password hashing throughput against worker count.
+
+Usage: python -m benchmarks.password_hashing [--users 200] [--rounds 12]
+"""
+import argparse
+import os
+import time
+
+from app.passwords import hash_passwords
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200, help='accounts to hash per run')
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt log rounds')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    workers = 1
+    counts = []
+    while workers < args.max_workers:
+        counts.append(workers)
+        workers *= 2
+    counts.append(args.max_workers)
+
+    passwords = ['defaultpassword'] * args.users
+
+    print(f'{"mode":<8} {"workers":>7} {"users":>7} {"seconds":>9} {"users/sec":>10}')
+    for workers in counts:
+        # Warm the pool up so process start-up isn't counted
+        hash_passwords(passwords[:workers * 2], rounds=4, workers=workers)
+        start = time.perf_counter()
+        hash_passwords(passwords, rounds=args.rounds, workers=workers)
+        elapsed = time.perf_counter() - start
+        print(f'{"hash":<8} {workers:>7} {args.users:>7} {elapsed:>9.2f} {args.users / elapsed:>10.1f}')
+
+    start = time.perf_counter()
+    hash_passwords(passwords, rounds=args.rounds, dedupe=True)
+    elapsed = time.perf_counter() - start
+    print(f'{"shared":<8} {1:>7} {args.users:>7} {elapsed:>9.2f} {args.users / elapsed:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark typeahead lookups against a large user and department table.
+
+Bulk-inserts --users users (a tenth of them admins) spread over --departments
+departments into a scratch database, builds the in-memory prefix index and
+times --lookups random prefix queries of one to six characters per kind, plus
+applying single committed changes. Scoped lookups are timed too, for a
+department admin (one department) and an organization admin (--subtree
+departments). Lookups are expected to stay well under 5 ms at p99.
+
+Usage: python -m benchmarks.typeahead [--users 150000] [--departments 10000] [--subtree 500] [--lookups 2000]
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import tempfile
+import time
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.migrate import upgrade_database
+from app.models import User, Department
+from app.typeahead import KINDS, typeahead_index
+
+
+def _percentile(values, pct):
+    return statistics.quantiles(values, n=100)[pct - 1] if len(values) > 1 else values[0]
+
+
+def _name(rng):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=150_000)
+    parser.add_argument('--departments', type=int, default=10_000)
+    parser.add_argument('--subtree', type=int, default=500)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    path = os.path.join(tempfile.mkdtemp(prefix='bench_typeahead_'), 'typeahead.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path, 'METRICS_ENABLED': False})
+    with app.app_context():
+        upgrade_database()
+        db.session.execute(insert(Department), [
+            {'name': f'{_name(rng).title()} {i}'} for i in range(args.departments)
+        ])
+        db.session.execute(insert(User), [{
+            'username': f'{_name(rng)}{i}', 'email': f'{_name(rng)}.{i}@example.com', 'password': '!',
+            'role': 'DEPT_ADMIN' if i % 10 == 0 else 'REGULAR_USER', 'department_id': rng.randint(1, args.departments)
+        } for i in range(args.users)])
+        db.session.commit()
+
+        index = typeahead_index()
+        started = time.perf_counter()
+        entries = index.rebuild()
+        print(f'indexed {entries} users and departments in {time.perf_counter() - started:.2f}s')
+
+        scopes = {
+            '': None,
+            ' 1 dept': frozenset((1,)),
+            f' {args.subtree} depts': frozenset(rng.sample(range(1, args.departments + 1), args.subtree))
+        }
+        print(f'{"kind":<20} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+        for kind in KINDS:
+            for label, departments in scopes.items():
+                latencies = []
+                for _ in range(args.lookups):
+                    prefix = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(1, 6)))
+                    started = time.perf_counter()
+                    index.match(kind, prefix, 10, departments)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                name = kind + label
+                print(f'{name:<20} {_percentile(latencies, 50):>8.3f} {_percentile(latencies, 99):>8.3f} {max(latencies):>8.3f}')
+
+        latencies = []
+        for i in range(200):
+            started = time.perf_counter()
+            index.apply({(User, args.users + i + 1): (f'new{i}', f'new{i}@example.com', 'REGULAR_USER', None)})
+            latencies.append((time.perf_counter() - started) * 1000)
+        print(f'{"apply":<20} {_percentile(latencies, 50):>8.3f} {_percentile(latencies, 99):>8.3f} {max(latencies):>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark re-importing a full user roster in upsert mode.
+
+Loads --users users into a scratch database with a plain insert import, then
+re-sends the whole roster in upsert mode three times: unchanged, with
+--changed-percent of the rows edited (role or department) plus as many new
+accounts, and unchanged again. Only the changed rows should be written, so
+the second pass should cost little more than the first and the resyncs far
+less than the initial load.
+
+Usage: python -m benchmarks.upsert_import [--users 150000] [--changed-percent 1]
+"""
+import argparse
+import os
+import random
+import tempfile
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.importer import DEFAULT_CHUNK_SIZE, run_import
+from app.migrate import upgrade_database
+from app.models import Department
+
+ROLES = ('REGULAR_USER', 'DEPT_ADMIN')
+
+
+def _chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _report(label, stats):
+    print(f'{label:<22} {stats.elapsed:>7.2f}s  inserted {stats.inserted:>7}  updated {stats.updated:>6}  '
+          f'unchanged {stats.unchanged:>7}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=150_000)
+    parser.add_argument('--departments', type=int, default=500)
+    parser.add_argument('--changed-percent', type=float, default=1.0)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    path = os.path.join(tempfile.mkdtemp(prefix='bench_upsert_'), 'upsert.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path, 'METRICS_ENABLED': False,
+                      'IMPORT_PASSWORD_MODE': 'token', 'BCRYPT_LOG_ROUNDS': 4})
+    with app.app_context():
+        upgrade_database()
+        db.session.execute(insert(Department), [{'name': f'Department {i}'} for i in range(args.departments)])
+        db.session.commit()
+
+        roster = [{
+            'email': f'user{i}@example.com', 'username': f'user{i}', 'role': 'REGULAR_USER',
+            'department_id': str(rng.randint(1, args.departments))
+        } for i in range(args.users)]
+        _report('initial insert', run_import('users', _chunks(roster, args.chunk_size)))
+        _report('resync, no changes', run_import('users', _chunks(roster, args.chunk_size), mode='upsert'))
+
+        changes = int(args.users * args.changed_percent / 100)
+        for row in rng.sample(roster, changes):
+            if rng.random() < 0.5:
+                row['role'] = rng.choice(ROLES)
+            else:
+                row['department_id'] = str(rng.randint(1, args.departments))
+        roster.extend({
+            'email': f'new{i}@example.com', 'username': f'new{i}', 'role': 'REGULAR_USER', 'department_id': '1'
+        } for i in range(changes))
+        _report(f'resync, {changes} edits', run_import('users', _chunks(roster, args.chunk_size), mode='upsert'))
+        _report('resync, no changes', run_import('users', _chunks(roster, args.chunk_size), mode='upsert'))
+
+
+if __name__ == '__main__':
+    main()
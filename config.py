@@ -1,15 +1,49 @@
 import os
 
 class Config:
-    SECRET_KEY = 'your-secret-key-here'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///service_platform.db'
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///site.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # 'hash' or 'token' ('shared' is for tests only) - see app.passwords.assign_passwords
+    IMPORT_PASSWORD_MODE = os.environ.get('IMPORT_PASSWORD_MODE', 'hash')
+    # 'off', 'log' or 'raise' - see app.nplusone
+    NPLUSONE_MODE = os.environ.get('NPLUSONE_MODE', 'off')
+
+    # Log any request slower than this many milliseconds - see app.metrics
+    METRICS_SLOW_REQUEST_MS = float(os.environ['METRICS_SLOW_REQUEST_MS']) if os.environ.get('METRICS_SLOW_REQUEST_MS') else None
+
+    # Engine profile - see app.engine. 'sqlite' or 'server'; chosen from the URI when unset
+    DB_ENGINE_PROFILE = os.environ.get('DB_ENGINE_PROFILE')
+
+    # sqlite profile: applied to every new connection
+    SQLITE_JOURNAL_MODE = 'WAL'
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+    SQLITE_CACHE_SIZE_KB = 64 * 1024
+
+    # server profile: connection pool for a client/server database
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_PRE_PING = True
+
 class DevelopmentConfig(Config):
     DEBUG = True
+    NPLUSONE_MODE = os.environ.get('NPLUSONE_MODE', 'log')
 
 class ProductionConfig(Config):
     DEBUG = False
 
 class TestingConfig(Config):
-    TESTING = True
\ No newline at end of file
+    TESTING = True
+    NPLUSONE_MODE = 'raise'
+
+config_by_name = {
+    'default': Config,
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig
+}
@@ -0,0 +1,26 @@
+"""Alembic environment; runs against the app's own engine and metadata."""
+from alembic import context
+from flask import current_app, has_app_context
+
+from app import create_app, db
+
+
+def run_migrations():
+    if has_app_context():
+        app = current_app._get_current_object()
+    else:
+        app = create_app()
+    with app.app_context():
+        with db.engine.connect() as connection:
+            context.configure(
+                connection=connection,
+                target_metadata=db.metadata,
+                # SQLite can't ALTER most constraints in place; batch mode rebuilds the table
+                render_as_batch=connection.dialect.name == 'sqlite',
+                compare_type=True
+            )
+            with context.begin_transaction():
+                context.run_migrations()
+
+
+run_migrations()
@@ -0,0 +1,85 @@
+"""Baseline schema: users, departments, resources and facilities
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # user and department reference each other, so the cross-table keys are added after both exist
+    op.create_table(
+        'user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=50), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('password', sa.String(length=60), nullable=False),
+        sa.Column('role', sa.String(length=20), nullable=False),
+        sa.Column('department_id', sa.Integer(), nullable=True),
+        sa.Column('manager_id', sa.Integer(), nullable=True),
+        sa.Column('profile_image', sa.String(length=20), nullable=True),
+        sa.Column('join_date', sa.DateTime(), nullable=False),
+        sa.Column('last_login', sa.DateTime(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username'),
+        sa.UniqueConstraint('email'),
+        sa.ForeignKeyConstraint(['manager_id'], ['user.id'], name='fk_user_manager')
+    )
+    op.create_table(
+        'department',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('description', sa.String(length=500), nullable=True),
+        sa.Column('head_id', sa.Integer(), nullable=True),
+        sa.Column('parent_id', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.ForeignKeyConstraint(['head_id'], ['user.id'], name='fk_department_head'),
+        sa.ForeignKeyConstraint(['parent_id'], ['department.id'], name='fk_department_parent')
+    )
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.create_foreign_key('fk_user_department', 'department', ['department_id'], ['id'])
+
+    op.create_table(
+        'resource',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('type', sa.String(length=50), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('department_id', sa.Integer(), nullable=True),
+        sa.Column('assigned_to_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.ForeignKeyConstraint(['department_id'], ['department.id']),
+        sa.ForeignKeyConstraint(['assigned_to_id'], ['user.id'])
+    )
+    op.create_table(
+        'facility',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('type', sa.String(length=50), nullable=False),
+        sa.Column('capacity', sa.Integer(), nullable=True),
+        sa.Column('location', sa.String(length=200), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('department_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.ForeignKeyConstraint(['department_id'], ['department.id'])
+    )
+
+
+def downgrade():
+    op.drop_table('facility')
+    op.drop_table('resource')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_constraint('fk_user_department', type_='foreignkey')
+    op.drop_table('department')
+    op.drop_table('user')
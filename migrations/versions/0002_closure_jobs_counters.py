@@ -0,0 +1,136 @@
+"""Set-password tokens, department closure, import jobs, stat counters and listing indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# Same level-by-level fill as app.hierarchy.sync_department_tree, inlined so
+# this revision keeps working as the application code moves on
+_LINK_PENDING = """
+    INSERT INTO department_closure (ancestor_id, descendant_id, depth)
+    SELECT c.ancestor_id, d.id, c.depth + 1
+    FROM department d
+    JOIN department_closure c ON c.descendant_id = d.parent_id
+    WHERE NOT EXISTS (SELECT 1 FROM department_closure s WHERE s.descendant_id = d.id AND s.depth = 0)
+"""
+
+_ADD_SELF_ROWS = """
+    INSERT INTO department_closure (ancestor_id, descendant_id, depth)
+    SELECT d.id, d.id, 0
+    FROM department d
+    WHERE NOT EXISTS (SELECT 1 FROM department_closure s WHERE s.descendant_id = d.id AND s.depth = 0)
+      AND (d.parent_id IS NULL
+           OR NOT EXISTS (SELECT 1 FROM department p WHERE p.id = d.parent_id)
+           OR EXISTS (SELECT 1 FROM department_closure s WHERE s.descendant_id = d.parent_id AND s.depth = 0))
+"""
+
+# (counter name, table, grouping column or None for the total); see app.stats
+_COUNTERS = (
+    ('users', 'user', None),
+    ('users.role', 'user', 'role'),
+    ('users.department', 'user', 'department_id'),
+    ('departments', 'department', None),
+    ('resources', 'resource', None),
+    ('resources.status', 'resource', 'status'),
+    ('resources.department', 'resource', 'department_id'),
+    ('facilities', 'facility', None),
+    ('facilities.status', 'facility', 'status'),
+    ('facilities.department', 'facility', 'department_id'),
+)
+
+
+def _fill_counters(connection):
+    for name, table, column in _COUNTERS:
+        if column is None:
+            sql = f"SELECT '{name}', '', COUNT(*) FROM \"{table}\""
+        else:
+            key = f"COALESCE(CAST({column} AS VARCHAR(100)), 'none')" if column == 'department_id' else column
+            sql = f"SELECT '{name}', {key}, COUNT(*) FROM \"{table}\" GROUP BY {column}"
+        connection.execute(sa.text(f"INSERT INTO stat_counter (name, key, value) {sql}"))
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('password_token', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_user_password_token', ['password_token'], unique=True)
+        batch_op.create_index('ix_user_join_date', ['join_date'])
+    op.create_index('ix_department_name', 'department', ['name'])
+    op.create_index('ix_resource_name', 'resource', ['name'])
+    op.create_index('ix_resource_created_at', 'resource', ['created_at'])
+    op.create_index('ix_facility_name', 'facility', ['name'])
+    op.create_index('ix_facility_created_at', 'facility', ['created_at'])
+
+    op.create_table(
+        'department_closure',
+        sa.Column('ancestor_id', sa.Integer(), nullable=False),
+        sa.Column('descendant_id', sa.Integer(), nullable=False),
+        sa.Column('depth', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id'),
+        sa.ForeignKeyConstraint(['ancestor_id'], ['department.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['descendant_id'], ['department.id'], ondelete='CASCADE')
+    )
+    op.create_index('ix_department_closure_descendant_id', 'department_closure', ['descendant_id'])
+
+    op.create_table(
+        'import_job',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=True),
+        sa.Column('created_by_id', sa.Integer(), nullable=True),
+        sa.Column('rows_total', sa.Integer(), nullable=True),
+        sa.Column('rows_processed', sa.Integer(), nullable=False),
+        sa.Column('rows_inserted', sa.Integer(), nullable=False),
+        sa.Column('rows_duplicate', sa.Integer(), nullable=False),
+        sa.Column('rows_failed', sa.Integer(), nullable=False),
+        sa.Column('throughput', sa.Float(), nullable=False),
+        sa.Column('eta_seconds', sa.Float(), nullable=True),
+        sa.Column('cancel_requested', sa.Boolean(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.ForeignKeyConstraint(['created_by_id'], ['user.id'])
+    )
+    op.create_index('ix_import_job_status', 'import_job', ['status'])
+
+    op.create_table(
+        'stat_counter',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('key', sa.String(length=100), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name', 'key')
+    )
+
+    connection = op.get_bind()
+    while connection.execute(sa.text(_LINK_PENDING)).rowcount + connection.execute(sa.text(_ADD_SELF_ROWS)).rowcount:
+        pass
+    _fill_counters(connection)
+
+
+def downgrade():
+    op.drop_table('stat_counter')
+    op.drop_index('ix_import_job_status', table_name='import_job')
+    op.drop_table('import_job')
+    op.drop_index('ix_department_closure_descendant_id', table_name='department_closure')
+    op.drop_table('department_closure')
+    op.drop_index('ix_facility_created_at', table_name='facility')
+    op.drop_index('ix_facility_name', table_name='facility')
+    op.drop_index('ix_resource_created_at', table_name='resource')
+    op.drop_index('ix_resource_name', table_name='resource')
+    op.drop_index('ix_department_name', table_name='department')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_index('ix_user_join_date')
+        batch_op.drop_index('ix_user_password_token')
+        batch_op.drop_column('password_token')
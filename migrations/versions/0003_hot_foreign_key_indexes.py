@@ -0,0 +1,38 @@
+"""Indexes for the foreign keys and filters every scoped query uses
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+app/queryplan.py checks that the hot queries actually use these.
+"""
+from alembic import op
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+# (index, table, columns); composites lead with the equality column so the
+# single-column lookup on it is covered too
+INDEXES = (
+    ('ix_user_department_id_username', 'user', ['department_id', 'username']),
+    ('ix_user_manager_id', 'user', ['manager_id']),
+    ('ix_department_parent_id', 'department', ['parent_id']),
+    ('ix_department_head_id', 'department', ['head_id']),
+    ('ix_resource_department_id_status', 'resource', ['department_id', 'status']),
+    ('ix_resource_status_name', 'resource', ['status', 'name']),
+    ('ix_resource_assigned_to_id', 'resource', ['assigned_to_id']),
+    ('ix_facility_department_id_status', 'facility', ['department_id', 'status']),
+)
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,59 @@
+"""Full-text search index
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+See app/search.py. The table and the backfill are inlined so this revision
+keeps working as the application code moves on.
+"""
+from alembic import op
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+_FTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "title, body, filters, department_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+_PLAIN = (
+    "CREATE TABLE IF NOT EXISTS search_index ("
+    "rowid BIGINT PRIMARY KEY, title VARCHAR(255), body TEXT, filters TEXT, department_id INTEGER)"
+)
+
+# rowid = record id * 4 + kind; filters = ' k<kind> d<department> a<ancestor> ... '
+_BACKFILL = """
+    INSERT INTO search_index (rowid, title, body, filters, department_id)
+    SELECT x.id * 4 + {code}, x.{title}, {body},
+           ' k{kind}' || COALESCE(
+               ' d' || {department} || ' ' ||
+               (SELECT {aggregate}('a' || c.ancestor_id, ' ') FROM department_closure c WHERE c.descendant_id = {department}),
+               ''
+           ) || ' ',
+           {department}
+    FROM {table} x
+"""
+
+_SOURCES = (
+    dict(table='"user"', code=0, kind='user', title='username', body="COALESCE(x.email, '')", department='x.department_id'),
+    dict(table='department', code=1, kind='department', title='name', body="COALESCE(x.description, '')", department='x.id'),
+    dict(table='resource', code=2, kind='resource', title='name', body="COALESCE(x.type, '')", department='x.department_id'),
+    dict(table='facility', code=3, kind='facility', title='name',
+         body="TRIM(COALESCE(x.type, '') || ' ' || COALESCE(x.location, ''))", department='x.department_id'),
+)
+
+
+def upgrade():
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    op.execute(_FTS if sqlite else _PLAIN)
+    # Start empty in case the table was already there
+    op.execute('DELETE FROM search_index')
+    for source in _SOURCES:
+        op.execute(_BACKFILL.format(aggregate='group_concat' if sqlite else 'string_agg', **source))
+
+
+def downgrade():
+    op.execute('DROP TABLE IF EXISTS search_index')
@@ -0,0 +1,55 @@
+"""Unique natural keys for upsert imports, and upsert counters on import jobs
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+See app/upsert.py. Existing duplicates would make the unique indexes fail
+half way, so they are looked for first and reported by name.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+# (index, table, key expressions); users are already unique on email
+INDEXES = (
+    ('uq_department_name_parent_id', 'department', ['name', 'coalesce(parent_id, 0)']),
+    ('uq_resource_name_department_id', 'resource', ['name', 'department_id']),
+    ('uq_facility_name_department_id', 'facility', ['name', 'department_id']),
+)
+
+
+def _check_duplicates(connection):
+    problems = []
+    for _, table, keys in INDEXES:
+        key = ', '.join(keys)
+        duplicates = connection.execute(sa.text(
+            f'SELECT {key}, COUNT(*) FROM {table} GROUP BY {key} HAVING COUNT(*) > 1 LIMIT 5'
+        )).all()
+        problems.extend(f'{table} {tuple(row[:-1])} x{row[-1]}' for row in duplicates)
+    if problems:
+        raise RuntimeError('Rename or remove duplicate rows before upgrading: ' + '; '.join(problems))
+
+
+def upgrade():
+    _check_duplicates(op.get_bind())
+    for name, table, keys in INDEXES:
+        op.create_index(name, table, [sa.text(key) if '(' in key else key for key in keys], unique=True)
+    with op.batch_alter_table('import_job') as batch_op:
+        batch_op.add_column(sa.Column('mode', sa.String(length=10), nullable=False, server_default='insert'))
+        batch_op.add_column(sa.Column('rows_updated', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('rows_unchanged', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('import_job') as batch_op:
+        batch_op.drop_column('rows_unchanged')
+        batch_op.drop_column('rows_updated')
+        batch_op.drop_column('mode')
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
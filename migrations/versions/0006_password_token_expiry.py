@@ -0,0 +1,35 @@
+"""Expiry for set-password tokens
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+See app/passwords.py. Links handed out before this revision had no expiry;
+they are given a week from the upgrade.
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('password_token_expires_at', sa.DateTime(), nullable=True))
+    user = sa.table('user', sa.column('password_token', sa.String), sa.column('password_token_expires_at', sa.DateTime))
+    op.execute(
+        user.update()
+        .where(user.c.password_token.isnot(None))
+        .values(password_token_expires_at=datetime.utcnow() + timedelta(days=7))
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('password_token_expires_at')
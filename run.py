@@ -1,13 +1,13 @@
-from app import create_app, db
-import os
+from app import create_app
+from app.jobs import fail_orphaned_jobs
+from app.migrate import upgrade_database
 
 app = create_app()
 
 if __name__ == '__main__':
     with app.app_context():
-        # Create database only if it doesn't exist
-        db_path = 'service_platform.db'
-        if not os.path.exists(db_path):
-            db.create_all()
-            print("Database created.")
+        # Create the database or apply any pending migrations
+        upgrade_database()
+        # Imports run in this process, so any left active died with the last one
+        fail_orphaned_jobs()
     app.run(debug=True,port=8001)
@@ -0,0 +1,109 @@
+import time
+
+import pytest
+from flask import g
+
+from app import create_app, db, bcrypt
+from app.cache import _caches
+from app.migrate import upgrade_database
+from app.models import User, Department
+from app.tokens import revocations
+
+PASSWORD = 'password'
+
+
+@pytest.fixture
+def app_config():
+    """Config overrides for the app under test; override in a test module to change them"""
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, app_config):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+        'WTF_CSRF_ENABLED': False,
+        'BCRYPT_LOG_ROUNDS': 4,
+        'IMPORT_PASSWORD_MODE': 'shared',
+        'IMPORT_SPOOL_DIR': str(tmp_path / 'imports'),
+        'LAST_LOGIN_FLUSH_INTERVAL': 0,
+        'LOGIN_HASH_WORKERS': 1,
+        'METRICS_ENABLED': False,
+        **app_config
+    }, config_name='testing')
+
+    # Requests share the app context the test holds, and with it g (where flask_login caches the
+    # user) and the session. Start each one afresh, as a server would: nothing cached, and the
+    # database as last committed rather than the test's snapshot of it.
+    def fresh_request():
+        g.__dict__.clear()
+        db.session.rollback()
+    app.before_request_funcs.setdefault(None, []).insert(0, fresh_request)
+    with app.app_context():
+        upgrade_database()
+        yield app
+        db.session.remove()
+    app.extensions['import_executor'].shutdown(wait=True)
+    # Module-level caches outlive the app; don't let one test's rows leak into the next
+    for cache in _caches:
+        if hasattr(cache, 'clear'):
+            cache.clear()
+    revocations.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_department():
+    def make(name, parent=None):
+        department = Department(name=name, parent_id=parent.id if parent else None)
+        db.session.add(department)
+        db.session.commit()
+        return department
+    return make
+
+
+@pytest.fixture
+def make_user():
+    def make(username, role='REGULAR_USER', department=None, password=PASSWORD, **values):
+        user = User(username=username, email=f'{username}@example.com', role=role,
+                    password=bcrypt.generate_password_hash(password).decode('utf-8'),
+                    department_id=department.id if department else None, **values)
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make
+
+
+@pytest.fixture
+def login(client):
+    def login(user, password=PASSWORD):
+        response = client.post('/login', data={'email': user.email, 'password': password})
+        assert response.status_code == 302
+        return response
+    return login
+
+
+@pytest.fixture
+def admin(make_user, login):
+    """A logged in master admin"""
+    user = make_user('master', role='MASTER_ADMIN')
+    login(user)
+    return user
+
+
+@pytest.fixture
+def wait_for_job(client):
+    def wait(job_id, timeout=10):
+        """The job's status once it has finished, polled through the API"""
+        deadline = time.monotonic() + timeout
+        while True:
+            response = client.get(f'/api/upload/status/{job_id}')
+            assert response.status_code == 200
+            if response.json['status'] not in ('queued', 'running') or time.monotonic() > deadline:
+                return response.json
+            time.sleep(0.02)
+    return wait
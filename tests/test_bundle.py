@@ -0,0 +1,57 @@
+import io
+import zipfile
+
+from sqlalchemy import select
+
+from app import db
+from app.models import User, Department, Resource
+
+DEPARTMENTS = 'key,name,parent_key,head_key\neng,Engineering,,ada\nweb,Web,eng,bob\n'
+USERS = ('key,email,username,role,department_key,manager_key\n'
+         'bob,bob@example.com,bob,DEPT_ADMIN,web,ada\n'
+         'ada,ada@example.com,ada,ORG_ADMIN,eng,\n')
+RESOURCES = 'name,type,department_key,assigned_to_key\nLaptop,HARDWARE,web,bob\n'
+
+
+def _zip(**files):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as archive:
+        for kind, text in files.items():
+            archive.writestr(f'org/{kind}.csv', text)
+    data.seek(0)
+    return data
+
+
+def test_bundle_loads_related_files_in_one_pass(app, client, admin, wait_for_job):
+    response = client.post('/api/upload/bundle', data={
+        'file': (_zip(departments=DEPARTMENTS, users=USERS, resources=RESOURCES), 'org.zip')
+    })
+    assert response.status_code == 202
+    assert wait_for_job(response.json['job_id'])['status'] == 'completed'
+
+    web = db.session.scalar(select(Department).where(Department.name == 'Web'))
+    bob = db.session.scalar(select(User).where(User.username == 'bob'))
+    ada = db.session.scalar(select(User).where(User.username == 'ada'))
+    assert (web.parent.name, web.head_id) == ('Engineering', bob.id)
+    assert (bob.department_id, bob.manager_id) == (web.id, ada.id)
+    assert db.session.scalar(select(Resource.assigned_to_id).where(Resource.name == 'Laptop')) == bob.id
+
+
+def test_bundle_parts_are_validated_together(app, client, admin, wait_for_job):
+    response = client.post('/api/upload/bundle', data={
+        'departments': (io.BytesIO(DEPARTMENTS.encode()), 'departments.csv'),
+        # bob's manager is missing from the users file
+        'users': (io.BytesIO(USERS.splitlines()[0].encode() + b'\n' + USERS.splitlines()[1].encode()), 'users.csv')
+    })
+    assert response.status_code == 202
+    status = wait_for_job(response.json['job_id'])
+
+    assert status['status'] == 'failed'
+    report = client.get(status['error_report_url'])
+    assert b'users.csv' in report.data
+    assert db.session.scalar(select(Department.id)) is None
+
+
+def test_bundle_needs_a_zip(app, client, admin):
+    response = client.post('/api/upload/bundle', data={'file': (io.BytesIO(b'name\n'), 'org.csv')})
+    assert response.status_code == 400
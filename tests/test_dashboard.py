@@ -0,0 +1,43 @@
+from app import db
+from app.models import Resource
+
+
+def test_dashboard_totals_follow_writes(app, client, admin, make_department, make_user):
+    sales = make_department('Sales')
+    make_user('ann', department=sales)
+    db.session.add(Resource(name='Laptop', type='HARDWARE', status='in_use', department_id=sales.id))
+    db.session.commit()
+
+    response = client.get('/api/admin/dashboard')
+    assert response.status_code == 200
+    statistics, breakdowns = response.json['statistics'], response.json['breakdowns']
+    assert (statistics['total_users'], statistics['total_departments'], statistics['total_resources']) == (2, 1, 1)
+    assert breakdowns['users_by_role'] == {'MASTER_ADMIN': 1, 'REGULAR_USER': 1}
+    assert breakdowns['resources_by_status'] == {'in_use': 1}
+
+
+def test_org_admin_sees_only_their_departments(app, client, make_department, make_user, login):
+    root = make_department('Root')
+    child = make_department('Child', parent=root)
+    other = make_department('Other')
+    make_user('ann', department=child)
+    make_user('bo', department=other)
+    login(make_user('org', role='ORG_ADMIN', department=root))
+
+    db.session.add(Resource(name='Desk', type='OTHER', status='available', department_id=other.id))
+    db.session.commit()
+
+    dashboard = client.get('/api/admin/dashboard').json
+    assert dashboard['breakdowns'] == {
+        'users_by_department': {str(root.id): 1, str(child.id): 1},
+        'resources_by_department': {},
+        'facilities_by_department': {}
+    }
+    assert dashboard['statistics'] == {
+        'total_users': 2, 'total_departments': 2, 'total_resources': 0, 'total_facilities': 0
+    }
+
+
+def test_dashboard_is_for_admins(app, client, make_user, login):
+    login(make_user('dept', role='DEPT_ADMIN'))
+    assert client.get('/api/admin/dashboard').status_code == 403
@@ -0,0 +1,37 @@
+import gzip
+import json
+
+
+def test_export_link_keeps_only_the_listing_filters(app, client, admin, make_user):
+    response = client.get('/manage/users?role=REGULAR_USER&kind=departments&sort=email')
+    assert response.status_code == 200
+    assert 'href="/manage/users/export?role=REGULAR_USER"' in response.get_data(as_text=True)
+
+
+def test_export_streams_the_filtered_listing(app, client, admin, make_user):
+    make_user('ann')
+    response = client.get('/manage/users/export?role=REGULAR_USER')
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == 'id,username,email,role,department_id,manager_id,join_date,last_login,is_active'
+    assert [line.split(',')[1] for line in lines[1:]] == ['ann']
+
+
+def test_api_export_formats(app, client, admin, make_user):
+    make_user('ann')
+    rows = client.get('/api/export/users?format=ndjson').get_data(as_text=True).splitlines()
+    assert [json.loads(row)['username'] for row in rows] == ['master', 'ann']
+
+    response = client.get('/api/export/users?compress=gzip')
+    assert response.headers['Content-Disposition'] == 'attachment; filename=users.csv.gz'
+    assert gzip.decompress(response.data).decode().count('\n') == 3
+
+
+def test_export_is_scoped(app, client, make_department, make_user, login):
+    sales, other = make_department('Sales'), make_department('Other')
+    make_user('ann', department=sales)
+    make_user('bo', department=other)
+    login(make_user('lead', role='DEPT_ADMIN', department=sales))
+
+    lines = client.get('/api/export/users').get_data(as_text=True).splitlines()[1:]
+    assert sorted(line.split(',')[1] for line in lines) == ['ann', 'lead']
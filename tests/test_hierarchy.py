@@ -0,0 +1,72 @@
+import io
+
+import pytest
+from sqlalchemy import select
+
+from app import db
+from app.hierarchy import DepartmentCycleError, rebuild_department_tree
+from app.importer import iter_csv_chunks, run_import
+from app.models import DepartmentClosure
+
+
+def _closure():
+    return set(db.session.execute(
+        select(DepartmentClosure.ancestor_id, DepartmentClosure.descendant_id, DepartmentClosure.depth)
+    ).all())
+
+
+def assert_matches_rebuild():
+    maintained = _closure()
+    rebuild_department_tree()
+    assert maintained == _closure()
+
+
+@pytest.fixture
+def tree(make_department):
+    """root > a > a1 > a11, root > b"""
+    root = make_department('Root')
+    a = make_department('A', parent=root)
+    a1 = make_department('A1', parent=a)
+    a11 = make_department('A11', parent=a1)
+    b = make_department('B', parent=root)
+    return root, a, a1, a11, b
+
+
+def test_move_keeps_the_closure_table_exact(app, tree):
+    root, a, a1, a11, b = tree
+    a1.parent_id = b.id
+    db.session.commit()
+    assert_matches_rebuild()
+
+    a.parent_id = None
+    db.session.commit()
+    assert_matches_rebuild()
+
+
+def test_delete_keeps_the_closure_table_exact(app, tree):
+    root, a, a1, a11, b = tree
+    db.session.delete(a11)
+    db.session.commit()
+    assert_matches_rebuild()
+
+    # Its child is detached and becomes a root
+    db.session.delete(a)
+    db.session.commit()
+    assert a1.parent_id is None
+    assert_matches_rebuild()
+
+
+def test_bulk_sync_matches_a_rebuild(app, tree):
+    root = tree[0]
+    rows = f'id,name,parent_id\n100,X,{root.id}\n101,Y,100\n102,Z,101\n103,W,\n'
+    run_import('departments', iter_csv_chunks(io.BytesIO(rows.encode('utf-8')), 2))
+    assert_matches_rebuild()
+
+
+def test_moving_under_own_descendant_is_rejected(app, tree):
+    root, a, a1, a11, b = tree
+    a.parent_id = a11.id
+    with pytest.raises(DepartmentCycleError):
+        db.session.commit()
+    db.session.rollback()
+    assert_matches_rebuild()
@@ -0,0 +1,28 @@
+import pytest
+
+from app import db
+from app.identity import load_user
+
+
+@pytest.mark.parametrize('attr', ['role', 'department_id'])
+def test_committed_change_reaches_the_cached_identity(app, make_department, make_user, attr):
+    sales, other = make_department('Sales'), make_department('Other')
+    user = make_user('ann', role='DEPT_ADMIN', department=sales)
+    assert load_user(user.id).role == 'DEPT_ADMIN'  # cached from here on
+
+    value = {'role': 'REGULAR_USER', 'department_id': other.id}[attr]
+    setattr(user, attr, value)
+    db.session.commit()
+    assert getattr(load_user(user.id), attr) == value
+
+
+def test_deactivation_logs_out_the_session_user(app, client, make_user, login):
+    user = make_user('ann')
+    login(user)
+    assert client.get('/api/auth/user-profile').status_code == 200
+
+    user.is_active = False
+    db.session.commit()
+    assert load_user(user.id) is None
+    assert client.get('/api/auth/user-profile').status_code == 401
+    assert client.get('/dashboard').headers['Location'].startswith('/login')
@@ -0,0 +1,53 @@
+import io
+
+from sqlalchemy import func, select
+
+from app import db
+from app.importer import iter_csv_chunks, run_import
+from app.models import User, Department
+
+
+def _chunks(text, chunk_size=2):
+    return iter_csv_chunks(io.BytesIO(text.encode('utf-8')), chunk_size)
+
+
+def test_csv_chunks_are_bounded():
+    chunks = list(_chunks('name\na\nb\nc\n'))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert chunks[1] == [{'name': 'c'}]
+
+
+def test_import_users_in_chunks(app, make_department):
+    sales = make_department('Sales')
+    rows = ''.join(f'user{i}@example.com,user{i},{sales.id}\n' for i in range(5))
+    stats = run_import('users', _chunks('email,username,department_id\n' + rows))
+
+    assert (stats.rows_read, stats.inserted, stats.chunks) == (5, 5, 3)
+    assert db.session.scalar(select(func.count(User.id)).where(User.department_id == sales.id)) == 5
+
+
+def test_import_skips_existing_and_repeated_rows(app, make_user):
+    make_user('taken')
+    stats = run_import('users', _chunks(
+        'email,username\ntaken@example.com,taken\nnew@example.com,new\nnew@example.com,new\n', chunk_size=10))
+
+    assert (stats.inserted, stats.duplicates) == (1, 2)
+    assert db.session.scalar(select(func.count(User.id))) == 2
+
+
+def test_import_departments_builds_tree(app):
+    run_import('departments', _chunks('id,name,parent_id\n1,Root,\n2,Child,1\n'))
+
+    child = db.session.scalar(select(Department).where(Department.name == 'Child'))
+    assert child.parent_id == 1
+
+
+def test_department_names_repeat_under_different_parents(app, make_department):
+    emea, apac = make_department('EMEA'), make_department('APAC')
+    make_department('Sales', parent=emea)
+    stats = run_import('departments', _chunks(
+        f'name,parent_id\nSales,{emea.id}\nSales,{apac.id}\nSales,\nSales,\n', chunk_size=10))
+
+    assert (stats.inserted, stats.duplicates) == (2, 2)
+    parents = db.session.scalars(select(Department.parent_id).where(Department.name == 'Sales'))
+    assert sorted(parents, key=lambda p: p or 0) == [None, emea.id, apac.id]
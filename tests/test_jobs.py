@@ -0,0 +1,91 @@
+import io
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from app import db
+from app.jobs import active_job_count, fail_orphaned_jobs, get_job
+from app.models import ImportJob
+
+
+@pytest.fixture
+def app_config():
+    return {'IMPORT_WORKERS': 1, 'IMPORT_JOB_STALE_SECONDS': 60}
+
+
+def _job(job_id, status, age=0, kind='users'):
+    updated_at = datetime.utcnow() - timedelta(seconds=age)
+    job = ImportJob(id=job_id, kind=kind, status=status, updated_at=updated_at)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def _age(job_id, seconds):
+    db.session.execute(update(ImportJob).where(ImportJob.id == job_id)
+                       .values(updated_at=datetime.utcnow() - timedelta(seconds=seconds)))
+    db.session.commit()
+
+
+def test_stale_jobs_do_not_count_as_active(app):
+    _job('fresh-queued', 'queued')
+    _job('fresh-running', 'running')
+    _job('stale-queued', 'queued', age=120)
+    _job('stale-running', 'running', age=120)
+    _job('done', 'completed', age=120)
+
+    assert active_job_count() == 2
+
+
+def test_stale_job_of_another_process_fails_when_read(app):
+    _job('stale-queued', 'queued', age=120)
+
+    job = get_job('stale-queued')
+    assert (job.status, job.error) == ('failed', 'Import worker stopped responding')
+
+
+def test_running_bundle_is_never_stale(app):
+    _job('bundle', 'running', age=120, kind='bundle')
+
+    assert get_job('bundle').status == 'running'
+    assert active_job_count() == 1
+
+
+def test_queued_job_this_process_holds_waits_its_turn(app, client, admin, make_department, wait_for_job):
+    hq = make_department('HQ')
+    release = threading.Event()
+    app.extensions['import_executor'].submit(release.wait)  # a long import ahead in the queue
+    response = client.post('/api/upload/csv/facilities', data={
+        'file': (io.BytesIO(f'name,department_id\nRoom,{hq.id}\n'.encode('utf-8')), 'rooms.csv')
+    })
+    job_id = response.json['job_id']
+    _age(job_id, 120)
+
+    assert client.get(f'/api/upload/status/{job_id}').json['status'] == 'queued'
+    assert active_job_count() == 1
+    release.set()
+    assert wait_for_job(job_id)['status'] == 'completed'
+
+
+def test_heartbeat_refreshes_held_jobs(app):
+    _job('held', 'queued', age=120)
+    _job('other', 'queued', age=120)
+    heartbeat = app.extensions['import_heartbeat']
+    heartbeat.job_ids.add('held')
+
+    heartbeat.beat()
+    heartbeat.job_ids.discard('held')
+    assert get_job('held').status == 'queued'
+    assert get_job('other').status == 'failed'
+
+
+def test_fail_orphaned_jobs_at_startup(app):
+    _job('queued', 'queued')
+    _job('running', 'running')
+    _job('done', 'completed')
+
+    assert fail_orphaned_jobs() == 2
+    assert active_job_count() == 0
+    assert db.session.get(ImportJob, 'done').status == 'completed'
@@ -0,0 +1,31 @@
+import bcrypt
+import pytest
+
+from app import db
+from app.logins import hash_rounds, verify_password
+
+from conftest import PASSWORD
+
+
+def _hashed(rounds):
+    return bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+@pytest.mark.parametrize('stored, expected', [(4, 5), (5, 5), (6, 6)])
+def test_hashes_are_upgraded_never_downgraded(app, make_user, stored, expected):
+    app.config['BCRYPT_LOG_ROUNDS'] = 5
+    user = make_user('ann')
+    user.password = _hashed(stored)
+    db.session.commit()
+
+    assert verify_password(user, PASSWORD)
+    assert hash_rounds(user.password) == expected
+
+
+def test_wrong_password_leaves_the_hash_alone(app, make_user):
+    app.config['BCRYPT_LOG_ROUNDS'] = 5
+    user = make_user('ann')
+    before = user.password
+
+    assert not verify_password(user, 'wrong')
+    assert user.password == before
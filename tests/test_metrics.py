@@ -0,0 +1,37 @@
+import pytest
+
+from app.metrics import registry
+
+
+@pytest.fixture
+def app_config():
+    return {'METRICS_ENABLED': True}
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    registry.reset()
+    yield
+    registry.reset()
+
+
+def test_metrics_are_recorded_per_endpoint(app, client, admin):
+    client.get('/dashboard')
+    client.get('/dashboard')
+
+    response = client.get('/api/admin/metrics')
+    assert response.status_code == 200
+    dashboard = response.json['endpoints']['main.dashboard']
+    assert dashboard['count'] == 2
+    assert dashboard['template_ms']['p50'] > 0
+
+
+def test_metrics_reset(app, client, admin):
+    client.get('/dashboard')
+    assert client.delete('/api/admin/metrics').status_code == 200
+    assert 'main.dashboard' not in client.get('/api/admin/metrics').json['endpoints']
+
+
+def test_metrics_are_for_master_admins(app, client, make_user, login):
+    login(make_user('org', role='ORG_ADMIN'))
+    assert client.get('/api/admin/metrics').status_code == 403
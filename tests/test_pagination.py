@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def users(admin, make_user):
+    """Seven users besides the master admin; join dates repeat so sorts on them have ties"""
+    start = datetime(2024, 1, 1, 9, 30)
+    return [make_user(f'user{i}', join_date=start + timedelta(days=i // 3)) for i in range(7)]
+
+
+def _page(client, **args):
+    response = client.get('/api/admin/users', query_string={'limit': 3, **args})
+    assert response.status_code == 200
+    return [user['username'] for user in response.json['users']], response.json['page']
+
+
+def _walk(client, **args):
+    """Every page from the first on, following next_cursor"""
+    pages = []
+    names, page = _page(client, **args)
+    pages.append(names)
+    while page['next_cursor']:
+        names, page = _page(client, after=page['next_cursor'], **args)
+        pages.append(names)
+    return pages, page
+
+
+def test_after_and_before_cursors_walk_the_same_pages(app, client, users):
+    pages, last = _walk(client, sort='username')
+    assert [name for page in pages for name in page] == ['master'] + [f'user{i}' for i in range(7)]
+    assert [len(page) for page in pages] == [3, 3, 2]
+
+    # Back from the last page, following prev_cursor
+    back, page = [], last
+    while page['prev_cursor']:
+        names, page = _page(client, sort='username', before=page['prev_cursor'])
+        back.append(names)
+    assert back == pages[-2::-1]
+
+
+def test_descending_sort(app, client, users):
+    pages, _ = _walk(client, sort='-username')
+    assert [name for page in pages for name in page] == [f'user{i}' for i in reversed(range(7))] + ['master']
+
+
+@pytest.mark.parametrize('sort', ['join_date', '-join_date'])
+def test_datetime_cursors_with_ties(app, client, users, sort):
+    pages, _ = _walk(client, sort=sort)
+    names = [name for page in pages for name in page]
+    by_date = sorted(users, key=lambda user: (user.join_date, user.id), reverse=sort.startswith('-'))
+    assert [name for name in names if name != 'master'] == [user.username for user in by_date]
+    assert len(names) == len(set(names)) == 8
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', 'NQ', 'W10'])
+def test_malformed_cursor_is_a_bad_request(app, client, users, cursor):
+    response = client.get('/api/admin/users', query_string={'after': cursor})
+    assert response.status_code == 400
+    assert response.json['error'] == 'Invalid page cursor'
@@ -0,0 +1,64 @@
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.importer import iter_csv_chunks, run_import
+from app.models import User
+from app.passwords import UNUSABLE_PASSWORD
+
+
+def _import(password_mode, text='email,username\nnew@example.com,new\n'):
+    return run_import('users', iter_csv_chunks(io.BytesIO(text.encode('utf-8')), 10), password_mode=password_mode)
+
+
+def _new_user():
+    return User.query.filter_by(username='new').one()
+
+
+def _set_password(client, token, password='new-password'):
+    return client.post(f'/set-password/{token}', data={'password': password, 'confirm_password': password})
+
+
+def test_shared_hashes_are_for_tests_only(app):
+    app.testing = False
+    with pytest.raises(ValueError, match='only allowed under TESTING'):
+        _import('shared')
+    assert User.query.count() == 0
+
+
+def test_token_import_issues_an_expiring_link(app):
+    app.config['PASSWORD_TOKEN_TTL'] = 3600
+    _import('token')
+
+    user = _new_user()
+    assert user.password == UNUSABLE_PASSWORD and user.password_token
+    assert timedelta(minutes=59) < user.password_token_expires_at - datetime.utcnow() <= timedelta(hours=1)
+
+
+def test_set_password_link_works_once(app, client):
+    _import('token')
+    token = _new_user().password_token
+    assert client.get(f'/set-password/{token}').status_code == 200
+
+    assert _set_password(client, token).headers['Location'].endswith('/login')
+    user = _new_user()
+    assert user.password_token is None and user.check_password('new-password')
+
+    _set_password(client, token, 'another-password')
+    db.session.expire_all()
+    assert _new_user().check_password('new-password')
+
+
+def test_expired_set_password_link_is_refused(app, client):
+    _import('token')
+    user = _new_user()
+    user.password_token_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+    response = client.get(f'/set-password/{user.password_token}', follow_redirects=True)
+    assert 'That password link has expired.' in response.get_data(as_text=True)
+    _set_password(client, user.password_token)
+    db.session.expire_all()
+    assert _new_user().password == UNUSABLE_PASSWORD
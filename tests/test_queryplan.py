@@ -0,0 +1,19 @@
+from sqlalchemy import text
+
+from app import db
+from app.queryplan import check_query_plans
+
+
+def _failures():
+    return {description: plan for description, _, plan, ok in check_query_plans() if not ok}
+
+
+def test_hot_queries_use_their_indexes(app):
+    assert _failures() == {}
+
+
+def test_full_scan_is_reported(app):
+    db.session.execute(text('DROP INDEX ix_user_manager_id'))
+
+    assert list(_failures()) == ['direct reports']
+    assert 'SCAN user' in _failures()['direct reports']
@@ -0,0 +1,37 @@
+def _chain(make_user, department):
+    """boss <- mid <- (a, b)"""
+    boss = make_user('boss', department=department)
+    mid = make_user('mid', department=department, manager_id=boss.id)
+    make_user('a', department=department, manager_id=mid.id)
+    make_user('b', department=department, manager_id=mid.id)
+    return boss
+
+
+def test_reports_walk_the_whole_tree(app, client, make_department, make_user, login):
+    boss = _chain(make_user, make_department('Sales'))
+    login(boss)
+
+    response = client.get(f'/api/users/{boss.id}/reports')
+    assert response.status_code == 200
+    assert response.json['reports_by_level'] == {'1': 1, '2': 2}
+    assert [(r['username'], r['depth']) for r in response.json['reports']] == [('mid', 1), ('a', 2), ('b', 2)]
+
+
+def test_reports_respect_depth_and_paging(app, client, make_department, make_user, login):
+    boss = _chain(make_user, make_department('Sales'))
+    login(boss)
+
+    assert client.get(f'/api/users/{boss.id}/reports?max_depth=1').json['total_reports'] == 1
+    page = client.get(f'/api/users/{boss.id}/reports?limit=1&offset=1').json
+    assert [r['username'] for r in page['reports']] == ['a']
+
+
+def test_reports_of_others_need_an_admin_in_scope(app, client, make_department, make_user, login):
+    sales = make_department('Sales')
+    boss = _chain(make_user, sales)
+    login(make_user('outsider'))
+    assert client.get(f'/api/users/{boss.id}/reports').status_code == 403
+
+    client.get('/logout')
+    login(make_user('elsewhere', role='DEPT_ADMIN', department=make_department('Other')))
+    assert client.get(f'/api/users/{boss.id}/reports').status_code == 404
@@ -0,0 +1,19 @@
+from sqlalchemy import update
+
+from app import db
+from app.identity import identity_cache, load_user
+from app.models import User
+from app.scope import DEPARTMENT, SUBTREE, Scope, resolve_scope
+
+
+def test_scope_follows_a_demotion_made_by_another_process(app, make_department, make_user):
+    root = make_department('Root')
+    user = make_user('org', role='ORG_ADMIN', department=root)
+    assert resolve_scope(load_user(user.id)) == Scope(SUBTREE, root.id)
+
+    # Another process commits the demotion; nothing is invalidated in this one
+    with db.engine.begin() as connection:
+        connection.execute(update(User).where(User.id == user.id).values(role='REGULAR_USER'))
+    identity_cache.clear()  # as IDENTITY_CACHE_TTL would
+
+    assert resolve_scope(load_user(user.id)) == Scope(DEPARTMENT, root.id)
@@ -0,0 +1,52 @@
+from sqlalchemy import insert, text
+
+from app import db
+from app.models import Facility, Resource
+from app.search import index_new_rows
+
+
+def _indexed_count():
+    return db.session.scalar(text('SELECT count(*) FROM search_index'))
+
+
+def test_index_new_rows_skips_rows_another_import_indexed(app, make_department):
+    hq = make_department('HQ')
+    before = _indexed_count()
+    # Another job committed and indexed its rows after this one read the last id
+    db.session.execute(insert(Facility), [{'name': 'Theirs', 'type': 'OFFICE', 'department_id': hq.id}])
+    index_new_rows(Facility, 0)
+    db.session.commit()
+    db.session.execute(insert(Facility), [{'name': 'Ours', 'type': 'OFFICE', 'department_id': hq.id}])
+
+    assert index_new_rows(Facility, 0) == 1
+    db.session.commit()
+    assert _indexed_count() == before + 2
+
+
+def _resource(name, department):
+    db.session.add(Resource(name=name, type='HARDWARE', department_id=department.id))
+    db.session.commit()
+
+
+def test_search_is_limited_to_the_callers_scope(app, client, make_department, make_user, login):
+    root = make_department('Root')
+    sales = make_department('Sales', parent=root)
+    other = make_department('Other')
+    _resource('Dell Laptop 12', sales)
+    _resource('Dell Laptop 14', other)
+    login(make_user('org', role='ORG_ADMIN', department=root))
+
+    response = client.get('/api/search?q=dell lap')
+    assert response.status_code == 200
+    assert [r['title'] for r in response.json['results']] == ['Dell Laptop 12']
+
+
+def test_search_filters_by_kind(app, client, make_department, make_user, login):
+    hq = make_department('Laptops')
+    _resource('Laptop stand', hq)
+    login(make_user('master', role='MASTER_ADMIN'))
+
+    response = client.get('/api/search?q=lap&kind=resource')
+    assert [r['kind'] for r in response.json['results']] == ['resource']
+    assert client.get('/api/search?q=lap&kind=ship').status_code == 400
+    assert client.get('/api/search').status_code == 400
@@ -0,0 +1,100 @@
+import io
+
+import pytest
+
+from app import db
+
+from conftest import PASSWORD
+
+
+@pytest.fixture
+def tokens(app, make_user):
+    user = make_user('alice', role='ORG_ADMIN')
+    response = app.test_client().post('/api/auth/login', json={'email': user.email, 'password': PASSWORD})
+    assert response.status_code == 200
+    return response.json
+
+
+def _profile(app, token):
+    # A client of its own: no session cookie, the bearer token is all it has
+    return app.test_client().get('/api/auth/user-profile', headers={'Authorization': f'Bearer {token}'})
+
+
+def test_bearer_token_authenticates_api_calls(app, tokens):
+    response = _profile(app, tokens['token'])
+    assert response.status_code == 200
+    assert response.json['username'] == 'alice'
+
+
+def test_missing_or_bad_token_is_rejected(app, tokens):
+    assert app.test_client().get('/api/auth/user-profile').status_code == 401
+    assert _profile(app, tokens['token'] + 'x').status_code == 401
+    # A refresh token is not an access token
+    assert _profile(app, tokens['refresh_token']).status_code == 401
+
+
+def test_refresh_token_is_exchanged_once(app, tokens):
+    client = app.test_client()
+    response = client.post('/api/auth/refresh-token', json={'refresh_token': tokens['refresh_token']})
+    assert response.status_code == 200
+    assert _profile(app, response.json['token']).status_code == 200
+
+    replay = client.post('/api/auth/refresh-token', json={'refresh_token': tokens['refresh_token']})
+    assert replay.status_code == 401
+
+
+def test_expired_access_token_is_rejected(app, make_user):
+    app.config.update(JWT_ACCESS_TOKEN_TTL=-1, JWT_LEEWAY=0)
+    user = make_user('bob')
+    response = app.test_client().post('/api/auth/login', json={'email': user.email, 'password': PASSWORD})
+
+    assert _profile(app, response.json['token']).status_code == 401
+    refreshed = app.test_client().post('/api/auth/refresh-token', json={'refresh_token': response.json['refresh_token']})
+    assert refreshed.status_code == 200
+
+
+def test_role_change_revokes_tokens(app, tokens):
+    from app.models import User
+    user = User.query.filter_by(username='alice').one()
+    user.role = 'REGULAR_USER'
+    db.session.commit()
+
+    assert _profile(app, tokens['token']).status_code == 401
+    response = app.test_client().post('/api/auth/refresh-token', json={'refresh_token': tokens['refresh_token']})
+    assert response.status_code == 401
+
+
+def _register(client, **values):
+    return client.post('/api/auth/register', json={
+        'username': 'mallory', 'email': 'mallory@example.com', 'password': PASSWORD, **values
+    })
+
+
+def test_anonymous_registration_cannot_create_an_admin(app, client):
+    assert _register(client, role='MASTER_ADMIN').status_code == 401
+    login = client.post('/api/auth/login', json={'email': 'mallory@example.com', 'password': PASSWORD})
+    assert login.status_code == 401
+
+
+def test_registration_is_limited_to_the_callers_role_and_scope(app, client, make_department, make_user, login):
+    sales, other = make_department('Sales'), make_department('Other')
+    login(make_user('dana', role='DEPT_ADMIN', department=sales))
+
+    assert _register(client, role='USER', department_id=sales.id).status_code == 400
+    assert _register(client, role='ORG_ADMIN', department_id=sales.id).status_code == 403
+    assert _register(client, department_id=other.id).status_code == 403
+    response = _register(client, department_id=sales.id)
+    assert response.status_code == 201
+    assert response.json['user']['role'] == 'REGULAR_USER'
+
+
+def test_upsert_demotion_revokes_tokens(app, tokens):
+    from app.identity import load_user
+    from app.importer import iter_csv_chunks, run_import
+    from app.models import User
+    rows = iter_csv_chunks(io.BytesIO(b'email,username,role\nalice@example.com,alice,REGULAR_USER\n'), 10)
+    assert run_import('users', rows, mode='upsert').updated == 1
+
+    assert _profile(app, tokens['token']).status_code == 401
+    user = User.query.filter_by(username='alice').one()
+    assert load_user(user.id).role == 'REGULAR_USER'
@@ -0,0 +1,67 @@
+import pytest
+
+from app import db
+from app.models import Resource, User
+
+
+@pytest.fixture
+def departments(make_department, make_user):
+    """Sales and Other, each with a user and an admin"""
+    sales, other = make_department('Sales'), make_department('Other')
+    make_user('sam', department=sales)
+    make_user('sara', role='DEPT_ADMIN', department=sales)
+    make_user('otto', department=other)
+    make_user('olga', role='DEPT_ADMIN', department=other)
+    return sales, other
+
+
+def _labels(client, kind, q):
+    response = client.get(f'/typeahead/{kind}?q={q}')
+    assert response.status_code == 200
+    return [r['label'].split()[0] for r in response.json['results']]
+
+
+def test_matches_are_limited_to_the_callers_scope(app, client, departments, make_user, login):
+    sales, other = departments
+    login(make_user('dana', role='DEPT_ADMIN', department=sales))
+
+    assert _labels(client, 'departments', 's') == ['Sales']
+    assert _labels(client, 'departments', 'o') == []
+    assert _labels(client, 'users', 's') == ['sam', 'sara']
+    assert _labels(client, 'users', 'o') == []
+    assert _labels(client, 'admins', 'o') == []
+
+
+def test_master_admin_matches_everyone(app, client, departments, admin):
+    assert _labels(client, 'users', 'o') == ['olga', 'otto']
+    assert _labels(client, 'admins', 'o') == ['olga']
+
+
+def test_form_rejects_a_user_outside_the_callers_scope(app, client, departments, make_user, login):
+    sales, other = departments
+    login(make_user('dana', role='DEPT_ADMIN', department=sales))
+    otto = make_user('otto2', department=other)
+    sam = make_user('sam2', department=sales)
+
+    def add(assignee):
+        return client.post('/resource/add', data={
+            'name': f'Laptop {assignee.id}', 'type': 'HARDWARE', 'status': 'in_use', 'assigned_to': assignee.id
+        })
+
+    response = add(otto)
+    assert response.status_code == 200
+    assert 'You cannot choose someone outside your department.' in response.get_data(as_text=True)
+    assert add(sam).status_code == 302
+    assert [r.assigned_to_id for r in Resource.query.all()] == [sam.id]
+
+
+def test_moved_user_follows_their_department(app, client, departments, make_user, login):
+    sales, other = departments
+    login(make_user('dana', role='DEPT_ADMIN', department=sales))
+    assert _labels(client, 'users', 'sam') == ['sam']
+
+    sam = User.query.filter_by(username='sam').one()
+    sam.department_id = other.id
+    db.session.commit()
+    assert _labels(client, 'users', 'sam') == []
+    assert _labels(client, 'users', 's') == ['sara']
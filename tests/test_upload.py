@@ -0,0 +1,103 @@
+import io
+
+import pytest
+
+from app.models import ImportJob
+from app.validation import read_frame, read_validated_csv, validate_file, validate_frame
+
+
+def _upload(client, path, text, filename='rows.csv', **data):
+    return client.post(path, data={'file': (io.BytesIO(text.encode('utf-8')), filename), **data})
+
+
+def test_upload_reports_progress_until_completed(app, client, admin, make_department, wait_for_job):
+    hq = make_department('HQ')
+    response = _upload(client, '/api/upload/csv/facilities',
+                       f'name,department_id\nRoom A,{hq.id}\nRoom B,{hq.id}\n')
+    assert response.status_code == 202
+
+    status = wait_for_job(response.json['job_id'])
+    assert status['status'] == 'completed'
+    assert (status['rows_total'], status['rows_inserted']) == (2, 2)
+
+
+def test_unknown_job_is_not_found(app, client, admin):
+    assert client.get('/api/upload/status/no-such-job').status_code == 404
+
+
+@pytest.mark.parametrize('role', ['REGULAR_USER', 'ORG_ADMIN'])
+def test_upload_needs_a_master_admin(app, client, make_department, make_user, login, role):
+    hq = make_department('HQ')
+    login(make_user('someone', role=role, department=hq))
+    response = _upload(client, '/api/upload/csv/facilities', 'name,department_id\nRoom,1\n')
+    assert response.status_code == 403
+    page = _upload(client, '/upload/csv', 'name,department_id\nRoom,1\n', upload_type='facilities', mode='insert')
+    assert page.status_code == 302
+    assert ImportJob.query.count() == 0
+
+
+def test_upload_page_links_the_error_report(app, client, admin, make_department, wait_for_job):
+    hq = make_department('HQ')
+    response = _upload(client, '/upload/csv', f'name,type,department_id\nLaptop,,{hq.id}\nPhone,TOASTER,{hq.id}\n',
+                       upload_type='resources', mode='insert')
+    assert response.status_code == 302
+    job = ImportJob.query.one()
+    assert wait_for_job(job.id)['status'] == 'failed'
+
+    page = client.get(response.headers['Location']).get_data(as_text=True)
+    report_url = f'/api/upload/status/{job.id}/errors.csv'
+    assert report_url in page
+    report = client.get(report_url).get_data(as_text=True)
+    assert '2,type,required,' in report
+    assert '3,type,invalid_choice,TOASTER' in report
+
+
+def test_resources_need_a_type_column(app, tmp_path):
+    report = validate_frame('resources', read_frame(io.StringIO('name,department_id\nDesk,1\n')))
+    report.write_csv(tmp_path / 'errors.csv')
+    assert '1,type,missing_column,' in (tmp_path / 'errors.csv').read_text()
+
+
+def test_chunks_are_checked_against_each_other(app, make_department):
+    hq = make_department('HQ')
+    text = (f'email,username,role,department_id\na@example.com,a,REGULAR_USER,{hq.id}\n'
+            f'b@example.com,b,REGULAR_USER,{hq.id}\nc@example.com,c,REGULAR_USER,{hq.id}\n'
+            f'A@example.com,d,REGULAR_USER,{hq.id}\ne@example.com,b,REGULAR_USER,{hq.id}\n')
+    report, depths = validate_file(io.StringIO(text), 'users', chunk_size=2)
+    assert depths is None
+    assert report.rows_checked == 5
+    assert report.errors[['line', 'column', 'code']].values.tolist() == [
+        [5, 'email', 'duplicate_in_file'], [6, 'username', 'duplicate_in_file']
+    ]
+
+
+def test_department_ids_span_chunks(app, make_department):
+    hq = make_department('HQ')
+    # 101 and 100 name rows of later chunks as parents; 200 and 201 are a cycle across chunks
+    text = (f'id,name,parent_id\n101,Team,100\n200,Loop A,201\n100,Office,{hq.id}\n'
+            f'101,Again,\n201,Loop B,200\n300,Lost,999\n')
+    report, _ = validate_file(io.StringIO(text), 'departments', chunk_size=2)
+    assert report.errors[['line', 'column', 'code']].values.tolist() == [
+        [3, 'parent_id', 'parent_cycle'], [5, 'id', 'duplicate_in_file'],
+        [6, 'parent_id', 'parent_cycle'], [7, 'parent_id', 'unknown_department']
+    ]
+
+
+def test_departments_are_imported_parents_first(app, make_department, tmp_path):
+    hq = make_department('HQ')
+    path = tmp_path / 'departments.csv'
+    path.write_text(f'id,name,parent_id\n102,Desk,101\n101,Team,100\n100,Office,{hq.id}\n103,Other,\n')
+    chunks = list(read_validated_csv(str(path), 'departments', chunk_size=2))
+    assert [[row['id'] for row in chunk] for chunk in chunks] == [['100', '103'], ['101'], ['102']]
+
+
+def test_upsert_is_refused_where_the_database_cannot_do_it(app, client, admin, monkeypatch):
+    monkeypatch.setattr('app.upsert._UPSERT_DIALECTS', ())
+    response = _upload(client, '/api/upload/csv/facilities', 'name,department_id\nRoom,1\n', mode='upsert')
+    assert response.status_code == 400
+    assert 'needs SQLite or PostgreSQL' in response.json['error']
+
+    page = _upload(client, '/upload/csv', 'email,username\na@example.com,a\n', upload_type='users', mode='upsert')
+    assert page.status_code == 200
+    assert 'needs SQLite or PostgreSQL' in page.get_data(as_text=True)
+    assert ImportJob.query.count() == 0